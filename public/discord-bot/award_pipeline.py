@@ -0,0 +1,197 @@
+"""Asynchronous message XP pipeline.
+
+on_message only queues an AwardEvent and returns. Consumer tasks wait a few
+milliseconds to collect a batch, group it by guild, load all the batch's
+users of a guild in one query (off the event loop), decide every award and
+commit them as one queued transaction. The results go to follow-up tasks
+for the slow parts (web sync, level-up messages and role edits), so a
+level-up never holds up awarding the next messages. When the follow-ups
+fall too far behind, new ones are merged per member instead of queued: the
+member's follow-up then runs once, from their XP before the first merged
+award to their XP after the last, so level-ups and level roles are never
+lost (only the crit reactions of the merged messages before the last are).
+
+Guilds are spread over the consumers and over the follow-up tasks by id,
+so one guild's messages and level-ups are always handled in order, and a
+guild with slow Discord calls only delays the guilds sharing its task.
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+BATCH_WINDOW = 0.005    # seconds to collect a batch after its first event
+MAX_BATCH = 500
+QUEUE_SIZE = 10000      # per consumer; events beyond this are dropped
+FOLLOWUP_WORKERS = 4
+FOLLOWUP_QUEUE_SIZE = 1000  # per follow-up task; awards beyond this are merged per member
+RECENT_TTL = 5.0        # seconds an awarded user row is trusted over the database
+
+
+class AwardEvent:
+    __slots__ = ('message', 'received')
+
+    def __init__(self, message):
+        self.message = message
+        self.received = time.monotonic()
+
+
+class AwardPipeline:
+    def __init__(self, db, decide, on_awarded, workers=2, batch_window=BATCH_WINDOW, max_batch=MAX_BATCH,
+                 on_queued=None):
+        """decide(message, context) returns {'xp': int, 'advance_combo': bool, 'mention': bool, ...}
+        or None for no award; on_awarded(message, context, award, old_xp, new_xp) is a
+        coroutine run by a follow-up task after the award is queued; under load a member's
+        awards are merged into one call (the first old_xp, everything else from the last).
+        on_queued(message, award), if given, is called inline for every queued award, for
+        quick bookkeeping that must run once per award.
+        """
+        self.db = db
+        self.decide = decide
+        self.on_awarded = on_awarded
+        self.on_queued = on_queued
+        self.workers = workers
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._queues = []
+        self._followups = []
+        self._overflow = []  # per follow-up task: (guild_id, user_id) -> merged result, run after the queue
+        self._tasks = []
+        # Rows of users awarded in the last few seconds; their writes may still
+        # be queued, so the database copy can be behind
+        self._recent = {}  # (guild_id, user_id) -> (monotonic, user dict)
+        # Users whose XP changed some other way (/daily, /setxp, voice, ...), from any thread
+        self._stale = deque()
+        db.add_xp_listener(self.forget)
+        self.awarded = 0
+        self.batches = 0
+        self.dropped = 0
+        self.followups_merged = 0
+
+    def start(self):
+        """Start the consumer and follow-up tasks (call from the running event loop)."""
+        if self._tasks:
+            return
+        self._queues = [asyncio.Queue(maxsize=QUEUE_SIZE) for _ in range(self.workers)]
+        self._followups = [asyncio.Queue(maxsize=FOLLOWUP_QUEUE_SIZE) for _ in range(FOLLOWUP_WORKERS)]
+        self._overflow = [OrderedDict() for _ in range(FOLLOWUP_WORKERS)]
+        self._tasks = [asyncio.create_task(self._consume(q)) for q in self._queues]
+        self._tasks += [asyncio.create_task(self._follow_up(q, o)) for q, o in zip(self._followups, self._overflow)]
+        print(f"✅ XP award pipeline started ({self.workers} consumers, {FOLLOWUP_WORKERS} follow-up tasks)")
+
+    def submit(self, message):
+        """Queue a message for XP. Never waits; returns False if the event was dropped."""
+        if not self._queues:
+            return False
+        queue = self._queues[message.guild.id % len(self._queues)]
+        try:
+            queue.put_nowait(AwardEvent(message))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+    def pending(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def forget(self, guild_id, user_id):
+        """Stop trusting the remembered row of a user whose XP changed outside the pipeline."""
+        self._stale.append((str(guild_id), str(user_id)))
+
+    async def _consume(self, queue):
+        while True:
+            batch = [await queue.get()]
+            await asyncio.sleep(self.batch_window)
+            while len(batch) < self.max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                await self._process(batch)
+            except Exception as e:
+                print(f"❌ XP award batch error: {e}")
+
+    async def _process(self, batch):
+        self.batches += 1
+        now = time.monotonic()
+        self._recent = {key: entry for key, entry in self._recent.items() if now - entry[0] < RECENT_TTL}
+
+        by_guild = {}
+        for event in batch:
+            by_guild.setdefault(event.message.guild.id, []).append(event)
+
+        for guild_id, events in by_guild.items():
+            guild = events[0].message.guild
+            while self._stale:
+                self._recent.pop(self._stale.popleft(), None)
+            known = {}
+            for event in events:
+                entry = self._recent.get((str(guild_id), str(event.message.author.id)))
+                if entry:
+                    known[str(event.message.author.id)] = entry[1]
+            contexts = await asyncio.to_thread(
+                self.db.load_message_contexts,
+                guild,
+                [(event.message.author, event.message.channel) for event in events],
+                known
+            )
+
+            statements = []
+            results = []
+            for event, context in zip(events, contexts):
+                if context['user'] is None:
+                    # Channel gives no XP, or the member was on cooldown (no row was read)
+                    continue
+                # Pick up awards made earlier in this batch for the same user
+                self.db.refresh_message_context(context)
+                if not context['can_gain_xp']:
+                    continue
+                award = self.decide(event.message, context)
+                if not award:
+                    continue
+                old_xp = context['user'].get('xp') or 0
+                statements += self.db.award_statements(
+                    context, award['xp'], award.get('advance_combo', False), award.get('mention', False)
+                )
+                self._recent[(str(guild_id), context['user']['user_id'])] = (now, context['user'])
+                results.append((event.message, context, award, old_xp, context['user']['xp']))
+
+            if statements:
+                self.db.queue_transaction(statements, guild_id=guild_id)
+                self.awarded += len(results)
+            if self.on_queued:
+                for message, context, award, old_xp, new_xp in results:
+                    try:
+                        self.on_queued(message, award)
+                    except Exception as e:
+                        print(f"❌ XP award bookkeeping error: {e}")
+            index = guild_id % len(self._followups)
+            for result in results:
+                self._follow(self._followups[index], self._overflow[index], guild_id, result)
+
+    def _follow(self, followups, overflow, guild_id, result):
+        # Once anything has overflowed, newer results go there too, so they stay behind it
+        if not overflow:
+            try:
+                followups.put_nowait(result)
+                return
+            except asyncio.QueueFull:
+                pass
+        key = (guild_id, result[1]['user']['user_id'])
+        merged = overflow.get(key)  # updated in place, so the member keeps their turn
+        if merged is not None:
+            # Keep the XP from before the first merged award, so a level-up in between still shows
+            result = (*result[:3], merged[3], result[4])
+        overflow[key] = result
+        self.followups_merged += 1
+        if self.followups_merged % 100 == 1:
+            print(f"⚠️ Level-up follow-ups are behind, merged {self.followups_merged} per member so far "
+                  f"(XP was still awarded)")
+
+    async def _follow_up(self, followups, overflow):
+        while True:
+            if overflow and followups.empty():
+                _, result = overflow.popitem(last=False)
+            else:
+                result = await followups.get()
+            try:
+                await self.on_awarded(*result)
+            except Exception as e:
+                print(f"❌ XP award follow-up error: {e}")
@@ -13,29 +13,13 @@ from calendar import monthrange
 import config as bot_config
 import math
 from database import Database
+from award_pipeline import AwardPipeline
+from web_sync import XPSyncAggregator
+from web_cache import LinkStatusCache, WebResponseCache, parse_ttls
+import consistency
+from write_scheduler import INTERACTIVE
 from rank_card import create_rank_card
 _formula_cache = {}
-# Guild settings cache to avoid database spam
-_guild_settings_cache = {}
-_CACHE_TTL = 600  # 5 minutes
-
-def get_cached_guild_settings(guild_id):
-    """Get guild settings with caching to prevent database spam"""
-    now = datetime.now().timestamp()
-    cache_key = str(guild_id)
-    
-    # Check if cached and not expired
-    if cache_key in _guild_settings_cache:
-        cached_data, timestamp = _guild_settings_cache[cache_key]
-        if now - timestamp < _CACHE_TTL:
-            # Uncomment for debugging: print(f"Cache HIT for guild {guild_id}")
-            return cached_data
-    
-    # Cache miss - fetch from database
-    print(f"Cache MISS for guild {guild_id} - fetching from DB")
-    settings = db.get_guild_settings(guild_id)
-    _guild_settings_cache[cache_key] = (settings, now)
-    return settings
 
 
 INTENTS = discord.Intents.default()
@@ -43,8 +27,27 @@ INTENTS.message_content = True
 INTENTS.members = True
 INTENTS.voice_states = True
 
-bot = commands.Bot(command_prefix="!", intents=INTENTS, help_command=None)
-db = Database("system.db")
+class SystemBot(commands.Bot):
+    async def setup_hook(self):
+        # One pooled HTTP session for every web app call, warmed before the gateway connects
+        await db.open_web_session()
+        xp_sync.start()
+        db.outbox.start()
+
+    async def close(self):
+        # XP still being summed goes into the outbox, which sends it on the next start
+        xp_sync.stop()
+        db.outbox.stop()
+        await db.close_web_session()
+        await super().close()
+
+bot = SystemBot(command_prefix="!", intents=INTENTS, help_command=None)
+db = Database("system.db", shard_count=bot_config.DB_SHARD_COUNT, event_log_path=bot_config.XP_EVENT_LOG,
+              profile=bot_config.DB_PROFILE,
+              web_cache=WebResponseCache(parse_ttls(bot_config.WEB_CACHE_TTLS), bot_config.WEB_CACHE_MAX_ENTRIES),
+              link_cache=LinkStatusCache(bot_config.WEB_LINKED_CACHE_SECONDS, bot_config.WEB_UNLINKED_CACHE_SECONDS,
+                                         bot_config.WEB_CACHE_MAX_ENTRIES))
+xp_sync = XPSyncAggregator(db, flush_interval=bot_config.WEB_SYNC_FLUSH_SECONDS)
 
 # Initialize Supabase
 try:
@@ -118,31 +121,46 @@ SERVER_CLASS_ROLES = {
 # -------------------------
 # SUPABASE HELPERS
 # -------------------------
-def get_web_app_user(discord_id):
-    """Get user's web app data from Supabase"""
+WEB_APP_USER = "web_app_user"  # cache key, see web_cache.TTLS
+# The profile with its player_stats row embedded (player_stats.user_id references profiles.user_id)
+WEB_APP_USER_SELECT = "user_id, hunter_name, avatar, title, player_stats(*)"
+
+async def get_web_app_user(discord_id, fresh=False):
+    """Get user's web app data from Supabase (one request, cached for linked users)
+    
+    Returns None at once for members recently found not to be linked, unless fresh.
+    """
     if not supabase:
         return None
     
-    try:
-        # First get profile
-        profile_result = supabase.table('profiles').select('user_id, hunter_name, avatar, title').eq('discord_id', str(discord_id)).execute()
-        
-        if not profile_result.data:
+    discord_id = str(discord_id)
+    if not fresh and db.bot_sync.links.get(discord_id) is False:
+        return None
+    cached = db.bot_sync.cache.get(discord_id, WEB_APP_USER)
+    if cached is not None:
+        return cached
+    
+    async def fetch():
+        token = db.bot_sync.cache.begin()
+        status, rows = await db.bot_sync.session.get_json(
+            f"{bot_config.SUPABASE_URL}/rest/v1/profiles",
+            params={"select": WEB_APP_USER_SELECT, "discord_id": f"eq.{discord_id}", "limit": "1"},
+            headers={"apikey": bot_config.SUPABASE_KEY, "Authorization": f"Bearer {bot_config.SUPABASE_KEY}"}
+        )
+        if status != 200:
+            print(f"Error fetching web app user: {rows}")
             return None
-        
-        profile = profile_result.data[0]
-        
-        # Then get stats
-        stats_result = supabase.table('player_stats').select('*').eq('user_id', profile['user_id']).execute()
-        
-        if not stats_result.data:
+        profile = rows[0] if rows else {}
+        stats = profile.get('player_stats')
+        if isinstance(stats, list):
+            stats = stats[0] if stats else None
+        db.bot_sync.links.set(discord_id, bool(stats))
+        if not stats:
             return None
         
-        stats = stats_result.data[0]
-        
         # Combine data
-        return {
-            'discord_id': str(discord_id),
+        user = {
+            'discord_id': discord_id,
             'hunter_name': profile['hunter_name'],
             'avatar': profile.get('avatar'),
             'title': profile.get('title'),
@@ -159,6 +177,12 @@ def get_web_app_user(discord_id):
             'gems': stats.get('gems', 0),
             'credits': stats.get('credits', 0),
         }
+        db.bot_sync.cache.put(discord_id, WEB_APP_USER, user, token)
+        return user
+    
+    try:
+        # Concurrent lookups of the same user share one request
+        return await db.bot_sync.reads.do((WEB_APP_USER, discord_id), fetch)
     except Exception as e:
         print(f"Error fetching web app user: {e}")
         return None
@@ -447,99 +471,22 @@ def generate_rank_image(username, old_rank, new_rank):
 
 
 # -------------------------
-# EVENTS
+# MESSAGE XP (run by the award pipeline, see award_pipeline.py)
 # -------------------------
-@bot.event
-async def on_ready():
-    print(f"🔮 SYSTEM ONLINE — Logged in as {bot.user}")
-
-    # Start the voice XP task only if not already running (avoid RuntimeError on hot reloads)
-    try:
-        if not voice_xp_task.is_running():
-            voice_xp_task.start()
-    except Exception as e:
-        print(f"Warning: could not start voice_xp_task: {e}")
-
-    # Start the season check task
-    try:
-        if not check_season_end.is_running():
-            check_season_end.start()
-    except Exception as e:
-        print(f"Warning: could not start check_season_end: {e}")
-
-    # Sync global slash commands in background (global registration may take time)
-    async def _sync():
-        await bot.wait_until_ready()
-        try:
-            await bot.tree.sync()
-            print("🔁 Synced global slash commands")
-        except Exception as e:
-            print(f"Error syncing app commands: {e}")
-    bot.loop.create_task(_sync())
-
-@bot.event
-async def on_message(message):
-    if message.author.bot or not message.guild:
-        return
-
-    # Load guild settings early so we can respect prefix toggle
-    settings = db.get_guild_settings(message.guild.id)
-    prefix_enabled = settings.get('prefix_commands_enabled', True)
-
-    # Anti-spam: track recent messages per user per guild
-    guild_cache = message_cache.setdefault(message.guild.id, {})
-    user_times = guild_cache.setdefault(message.author.id, [])
-    now_ts = datetime.now().timestamp()
-    # remove old
-    user_times = [t for t in user_times if now_ts - t <= WINDOW_SECONDS]
-    user_times.append(now_ts)
-    guild_cache[message.author.id] = user_times
-
-    # If user sent too many messages in short window, ignore XP
-    if len(user_times) > MAX_MESSAGES_WINDOW:
-        # Optional: warn user once
-        try:
-            await message.add_reaction("⏱️")
-        except:
-            pass
-        if prefix_enabled:
-            await bot.process_commands(message)
-        return
-
-    # Check if channel is allowed
-    if not db.is_channel_allowed(message.guild.id, message.channel.id):
-        if prefix_enabled:
-            await bot.process_commands(message)
-        return
-
-    # Ensure user exists
-    user_data = db.get_user(message.author.id, message.guild.id)
-    if not user_data:
-        db.create_user(message.author.id, message.guild.id)
-        user_data = db.get_user(message.author.id, message.guild.id)
-
-    # Check cooldown (TANK gets 50% reduction: 30s → 15s)
-    user_class = db.get_user_class(message.author.id, message.guild.id)
-    cooldown_time = settings['xp_cooldown']
-    
-    if user_class == "TANK":
-        cooldown_time = int(cooldown_time * 0.5)  # 50% reduction
-    
-    if not db.can_gain_xp(message.author.id, message.guild.id, cooldown=cooldown_time):
-        if prefix_enabled:
-            await bot.process_commands(message)
-        return
-
-    # Calculate XP with guild settings
-    old_level = level_from_xp(user_data['xp'], message.guild.id)
+def decide_message_award(message, context):
+    """XP for one message from its loaded context, or None. No IO; runs inside a pipeline batch."""
+    settings = context['settings']
+    user_data = context['user']
+    user_class = context['user_class']
     base_xp = random.randint(settings['xp_min'], settings['xp_max'])
     
     # Apply role multiplier
-    multiplier = db.get_user_multiplier(message.author)
+    multiplier = context['multiplier']
+    advance_combo = False
+    mention = False
+    crit = False
     
     # Apply CLASS bonuses
-    user_class = db.get_user_class(message.author.id, message.guild.id)
-    
     if user_class == "TANK":
         # 0.9x message XP (focuses on voice)
         multiplier *= 0.9
@@ -548,34 +495,31 @@ async def on_message(message):
         # 1.5x base + combo bonus
         multiplier *= 1.5
         
-        # 15% chance for double XP
+        # 15% chance for double XP (reacted to in after_message_award)
         if random.random() < 0.15:
             multiplier *= 2.0
-            try:
-                await message.add_reaction("💥")  # Crit feedback
-            except:
-                pass
+            crit = True
         
         # Combo system: +5% per message in a row (max 20%)
-        combo = db.get_message_combo(message.author.id, message.guild.id)
+        combo = context['combo']
         combo_bonus = min(combo * 0.05, 0.20)
         multiplier *= (1 + combo_bonus)
         
-        # Increment combo
-        db.increment_message_combo(message.author.id, message.guild.id)
+        # Increment combo (recorded with the award)
+        advance_combo = True
     
     elif user_class == "FIGHTER":
         # 1.2x base + daily streak bonus
         multiplier *= 1.2
         
         # Daily streak bonus: +5% per day (max 25%)
-        streak = user_data.get('daily_streak', 0)
+        streak = user_data.get('daily_streak') or 0
         streak_bonus = min(streak * 0.05, 0.25)
         multiplier *= (1 + streak_bonus)
     
     elif user_class == "RANGER":
         # 2x if in focus channel, 0.8x otherwise
-        focus_channel = db.get_focus_channel(message.author.id, message.guild.id)
+        focus_channel = context['focus_channel']
         if focus_channel and str(message.channel.id) == focus_channel:
             multiplier *= 2.0
         else:
@@ -592,18 +536,12 @@ async def on_message(message):
                 last_time = datetime.fromisoformat(user_data['last_mention_xp'])
                 if (datetime.now() - last_time).total_seconds() >= 300:
                     base_xp += 25
-                    # Update last mention time
-                    try:
-                        db.set_last_mention_time(message.author.id, message.guild.id)
-                    except Exception as e:
-                        print(f"Warning: failed to set last_mention_xp for {message.author.id}: {e}")
+                    # Update last mention time (recorded with the award)
+                    mention = True
             else:
                 # First time
                 base_xp += 25
-                try:
-                    db.set_last_mention_time(message.author.id, message.guild.id)
-                except Exception as e:
-                    print(f"Warning: failed to set last_mention_xp for {message.author.id}: {e}")
+                mention = True
     
     elif user_class == "MAGE":
         # 1.4x for long messages (50+ chars), 0.7x for short (<20)
@@ -625,14 +563,24 @@ async def on_message(message):
             xp_gain = max(1, xp_gain // 3)
         last_message_cache[key] = content
     
-    db.add_xp(message.author.id, message.guild.id, xp_gain)
-    
-    # Sync XP to web app (fire-and-forget, non-blocking)
-    asyncio.create_task(db.sync_xp_to_web(str(message.author.id), xp_gain, "discord_message"))
+    return {'xp': xp_gain, 'advance_combo': advance_combo, 'mention': mention, 'crit': crit}
+
+def record_message_award(message, award):
+    """Runs for every queued award: sync the XP to the web app (batched, sent within a few seconds)."""
+    xp_sync.add(str(message.author.id), award['xp'], "discord_message")
+
+async def after_message_award(message, context, award, old_xp, new_xp):
+    """Follow-ups for a queued award: crit reaction and level-up."""
+    settings = context['settings']
+    if award['crit']:
+        try:
+            await message.add_reaction("💥")  # Crit feedback
+        except:
+            pass
     
     # Check for level up
-    new_data = db.get_user(message.author.id, message.guild.id)
-    new_level = level_from_xp(new_data['xp'], message.guild.id)
+    old_level = level_from_xp(old_xp, message.guild.id)
+    new_level = level_from_xp(new_xp, message.guild.id)
     
     if new_level > old_level and settings['levelup_messages']:
         # Use custom levelup channel if set
@@ -648,6 +596,82 @@ async def on_message(message):
         else:
             await handle_levelup(message.author, message.guild, message.channel, old_level, new_level)
 
+award_pipeline = AwardPipeline(db, decide_message_award, after_message_award, on_queued=record_message_award)
+
+# -------------------------
+# EVENTS
+# -------------------------
+@bot.event
+async def on_ready():
+    print(f"🔮 SYSTEM ONLINE — Logged in as {bot.user}")
+
+    # Start the voice XP task only if not already running (avoid RuntimeError on hot reloads)
+    try:
+        if not voice_xp_task.is_running():
+            voice_xp_task.start()
+    except Exception as e:
+        print(f"Warning: could not start voice_xp_task: {e}")
+
+    # Start the season check task
+    try:
+        if not check_season_end.is_running():
+            check_season_end.start()
+    except Exception as e:
+        print(f"Warning: could not start check_season_end: {e}")
+
+    # Start the database maintenance task
+    try:
+        if not db_maintenance_task.is_running():
+            db_maintenance_task.start()
+    except Exception as e:
+        print(f"Warning: could not start db_maintenance_task: {e}")
+
+    # Start the message XP award pipeline
+    award_pipeline.start()
+
+    # Sync global slash commands in background (global registration may take time)
+    async def _sync():
+        await bot.wait_until_ready()
+        try:
+            await bot.tree.sync()
+            print("🔁 Synced global slash commands")
+        except Exception as e:
+            print(f"Error syncing app commands: {e}")
+    bot.loop.create_task(_sync())
+
+@bot.event
+async def on_message(message):
+    if message.author.bot or not message.guild:
+        return
+
+    # Load guild settings early so we can respect prefix toggle
+    settings = db.get_guild_settings(message.guild.id)
+    prefix_enabled = settings.get('prefix_commands_enabled', True)
+
+    # Anti-spam: track recent messages per user per guild
+    guild_cache = message_cache.setdefault(message.guild.id, {})
+    user_times = guild_cache.setdefault(message.author.id, [])
+    now_ts = datetime.now().timestamp()
+    # remove old
+    user_times = [t for t in user_times if now_ts - t <= WINDOW_SECONDS]
+    user_times.append(now_ts)
+    guild_cache[message.author.id] = user_times
+
+    # If user sent too many messages in short window, ignore XP
+    if len(user_times) > MAX_MESSAGES_WINDOW:
+        # Optional: warn user once
+        try:
+            await message.add_reaction("⏱️")
+        except:
+            pass
+        if prefix_enabled:
+            await bot.process_commands(message)
+        return
+
+    # XP is awarded by the award pipeline; on_message only queues the event
+    if not award_pipeline.submit(message):
+        print(f"⚠️ XP award queue full, dropped message from {message.author.id}")
+
     if prefix_enabled:
         await bot.process_commands(message)
 
@@ -687,7 +711,7 @@ async def on_voice_state_update(member, before, after):
             db.add_xp(member.id, member.guild.id, xp_gain)
             
             # Sync voice XP to web app
-            asyncio.create_task(db.sync_xp_to_web(str(member.id), xp_gain, "discord_voice"))
+            xp_sync.add(str(member.id), xp_gain, "discord_voice")
             
             # track voice time (seconds)
             db.add_voice_time(member.id, member.guild.id, int(time_spent))
@@ -903,7 +927,7 @@ async def voice_xp_task():
                     db.add_xp(member.id, guild.id, xp_gain)
                     
                     # Sync voice task XP to web app
-                    asyncio.create_task(db.sync_xp_to_web(str(member.id), xp_gain, "discord_voice_task"))
+                    xp_sync.add(str(member.id), xp_gain, "discord_voice_task")
                     
                     # account for 5 minutes of voice time
                     db.add_voice_time(member.id, guild.id, 5 * 60)
@@ -925,6 +949,30 @@ async def check_season_end():
             except Exception as e:
                 print(f"Error ending season for guild {guild.id}: {e}")
 
+# -------------------------
+# DATABASE MAINTENANCE TASK
+# -------------------------
+MAINTENANCE_MAX_PENDING_WRITES = 20        # more queued writes than this = busy, try later
+WAL_FORCE_CHECKPOINT_BYTES = 64 * 1024 * 1024  # checkpoint anyway once a WAL gets this big
+XPCHECK_ROWS_PER_SECOND = 20000           # IO budget for /xpcheck on the live database
+XPCHECK_SETTLE_SECONDS = 2.0               # re-check drift after queued writes have landed
+
+@tasks.loop(minutes=15)
+async def db_maintenance_task():
+    """Checkpoint the WAL and run daily ANALYZE / prune / vacuum while the bot is quiet"""
+    busy = db.pending_writes() > MAINTENANCE_MAX_PENDING_WRITES
+    if busy and not any(db.wal_size(p) > WAL_FORCE_CHECKPOINT_BYTES for p in db.all_db_paths()):
+        return
+    try:
+        report = await asyncio.to_thread(
+            db.run_maintenance, bot_config.XP_HISTORY_RETENTION_DAYS, checkpoint_only=busy
+        )
+        for path, done in report.items():
+            if len(done) > 1:
+                print(f"🧹 DB maintenance {os.path.basename(path)}: {', '.join(done)}")
+    except Exception as e:
+        print(f"Error running DB maintenance: {e}")
+
 # -------------------------
 # NEW COMMANDS: weekly, stats, rewards
 # -------------------------
@@ -937,8 +985,8 @@ async def link(ctx):
         await ctx.send("❌ Supabase connection not available. Contact admin.")
         return
     
-    # Check if user is linked
-    web_user = get_web_app_user(discord_id)
+    # Check if user is linked (always asks, so a member who just linked is picked up)
+    web_user = await get_web_app_user(discord_id, fresh=True)
     
     if web_user:
         embed = discord.Embed(
@@ -1155,7 +1203,6 @@ async def setformula(ctx, *, formula: str):
 
     # Store in guild settings
     db.update_guild_setting(ctx.guild.id, 'xp_formula', formula)
-    clear_guild_cache(ctx.guild.id)  # ← ADD THIS LINE
     await ctx.send(f"✅ XP formula updated to: `{formula}`\nExample: `xp_for_level(10)` = {sample_val}")
 
 # Slash wrappers for formula and setformula (admin-only)
@@ -1459,6 +1506,12 @@ async def leaderboard_slash(interaction: discord.Interaction, page: int = 1):
         return
     await _call_cmd_with_interaction(interaction, 'leaderboard', page, defer=False)
 
+@bot.tree.command(name="aroundme", description="See the leaderboard around you (or another user)")
+async def aroundme_slash(interaction: discord.Interaction, member: discord.Member = None, radius: int = 5):
+    if not await defer_interaction(interaction):
+        return
+    await _call_cmd_with_interaction(interaction, 'aroundme', member, radius, defer=False)
+
 @bot.tree.command(name="daily", description="Claim your daily XP reward")
 async def daily_slash(interaction: discord.Interaction):
     if not await defer_interaction(interaction):
@@ -1749,7 +1802,7 @@ async def serverstats_slash(interaction: discord.Interaction):
         return
     await _call_cmd_with_interaction(interaction, 'serverstats', defer=False)
 
-@bot.tree.command(name="dbcheck", description="Check database schema and column existence (Admin)")
+@bot.tree.command(name="dbcheck", description="Check database schema, size and maintenance status (Admin)")
 @discord.app_commands.checks.has_permissions(administrator=True)
 async def dbcheck_slash(interaction: discord.Interaction):
     if not await defer_interaction(interaction):
@@ -1777,6 +1830,30 @@ async def dbcheck_slash(interaction: discord.Interaction):
             else:
                 embed.add_field(name="Critical Columns", value="All present ✓", inline=False)
             
+            # Storage and maintenance report (first few files when sharded)
+            files = db.get_db_report()
+            depths = db.write_queue_depths()
+            embed.add_field(
+                name="Pending Writes",
+                value="\n".join(f"{lane}: {d['writes']} ({d['guilds']} guilds)" for lane, d in depths.items()),
+                inline=True
+            )
+            embed.add_field(name="Database Files", value=str(len(files)), inline=True)
+            for info in files[:5]:
+                last = {task: (info['last_runs'].get(task) or "never")[:16].replace("T", " ")
+                        for task in ('checkpoint', 'optimize', 'prune', 'vacuum')}
+                embed.add_field(
+                    name=f"📁 {os.path.basename(info['path'])}",
+                    value=(
+                        f"Size: {info['size'] / 1048576:.1f} MB · WAL: {info['wal_size'] / 1048576:.1f} MB\n"
+                        f"Pages: {info['page_count']:,} · Free: {info['freelist']:,} · Vacuum: {info['auto_vacuum']}\n"
+                        f"History months: {info['history_months']} live · {info['archived_months']} archived\n"
+                        f"Checkpoint: {last['checkpoint']} · Optimize: {last['optimize']}\n"
+                        f"Prune: {last['prune']} · Vacuum: {last['vacuum']}"
+                    ),
+                    inline=False
+                )
+            
             ctx = InteractionContext(interaction)
             await ctx.send(embed=embed)
         else:
@@ -1786,6 +1863,115 @@ async def dbcheck_slash(interaction: discord.Interaction):
         ctx = InteractionContext(interaction)
         await ctx.send(f"❌ Error checking database: {e}")
 
+@bot.tree.command(name="webstatus", description="Show the web app connection, circuit breaker and sync queue (Admin)")
+@discord.app_commands.checks.has_permissions(administrator=True)
+async def webstatus_slash(interaction: discord.Interaction):
+    if not await defer_interaction(interaction):
+        return
+    ctx = InteractionContext(interaction)
+    try:
+        breaker = db.bot_sync.session.breaker.status()
+        pending = await asyncio.to_thread(db.outbox.pending)
+        colors = {"closed": 0x00ff00, "half-open": 0xffaa00, "open": 0xff0000}
+        embed = discord.Embed(title="Web App Sync Status", color=colors.get(breaker['state'], 0x00ff00))
+        if not db.web_sync_enabled():
+            embed.description = "⚠️ Web sync is not configured (BOT_SYNC_SECRET / SUPABASE_SERVICE_ROLE_KEY)"
+        state = breaker['state'].upper()
+        if breaker['retry_in']:
+            state += f" (probing in {breaker['retry_in']:.0f}s)"
+        embed.add_field(name="Circuit", value=state, inline=True)
+        embed.add_field(
+            name="Recent Calls",
+            value=f"{breaker['calls']} · {breaker['failures']} failed · avg {breaker['avg_seconds'] * 1000:.0f} ms",
+            inline=True
+        )
+        embed.add_field(name="Trips / Refused", value=f"{breaker['trips']} / {breaker['rejected']:,}", inline=True)
+        requests = db.bot_sync.session.scheduler.status()
+        queued = f"In flight: {requests['in_flight']} · Waiting: {requests['waiting_interactive']} interactive, {requests['waiting_background']} background"
+        if requests['paused_for']:
+            queued += f"\nRate limited, paused {requests['paused_for']:.0f}s"
+        embed.add_field(name=f"Requests (429s: {requests['throttled']})", value=queued, inline=False)
+        embed.add_field(
+            name="Outbox",
+            value=(
+                f"Waiting: {pending:,}\n"
+                f"Sent: {db.outbox.sent:,} in {db.bot_sync.batches:,} batches · Retried: {db.outbox.retried:,} · Dropped: {db.outbox.dropped:,}"
+            ),
+            inline=False
+        )
+        cache = db.bot_sync.cache.status()
+        links = db.bot_sync.links.status()
+        lookups = cache['hits'] + cache['misses']
+        embed.add_field(
+            name="Read Cache",
+            value=(
+                f"{cache['entries']:,} entries · {cache['hits']:,} hits ({cache['hits'] / lookups if lookups else 0:.0%})"
+                f" · {db.bot_sync.reads.shared:,} shared reads"
+                f"\nLinked: {links['linked']:,} · Not linked: {links['unlinked']:,} · {links['hits']:,} lookups saved"
+            ),
+            inline=False
+        )
+        embed.add_field(
+            name="XP Sync",
+            value=f"{xp_sync.awards:,} awards sent as {xp_sync.calls:,} calls · {xp_sync.pending()} users summing",
+            inline=False
+        )
+        if breaker['last_error']:
+            embed.set_footer(text=f"Last error: {breaker['last_error'][:200]}")
+        await ctx.send(embed=embed)
+    except Exception as e:
+        await ctx.send(f"❌ Error reading web status: {e}")
+
+@bot.tree.command(name="xpcheck", description="Check users' XP totals against XP history, optionally repair (Admin)")
+@discord.app_commands.checks.has_permissions(administrator=True)
+async def xpcheck_slash(interaction: discord.Interaction, repair: str = None):
+    if not await defer_interaction(interaction):
+        return
+    ctx = InteractionContext(interaction)
+    if repair and repair not in consistency.REPAIR_MODES:
+        await ctx.send(f"❌ Repair must be one of: {', '.join(consistency.REPAIR_MODES)}")
+        return
+    guild_id = str(interaction.guild.id)
+    
+    def run_check():
+        results = list(consistency.check(
+            db, [guild_id], rows_per_second=XPCHECK_ROWS_PER_SECOND, settle=XPCHECK_SETTLE_SECONDS
+        ))
+        _, drifts, checked = results[0]
+        repaired = consistency.repair(db, drifts, repair) if repair and drifts else 0
+        return drifts, checked, repaired
+    
+    try:
+        drifts, checked, repaired = await asyncio.to_thread(run_check)
+        drifting = [d for d in drifts if d.users_xp is not None]
+        orphans = len(drifts) - len(drifting)
+        embed = discord.Embed(
+            title="XP Consistency Check",
+            color=0x00ff00 if not drifts else 0xffaa00
+        )
+        embed.add_field(name="Users Checked", value=f"{checked:,}", inline=True)
+        embed.add_field(name="Drifting", value=f"{len(drifting):,}", inline=True)
+        embed.add_field(name="History Without User", value=f"{orphans:,}", inline=True)
+        if drifting:
+            worst = sorted(drifting, key=lambda d: abs(d.users_xp - d.history_xp), reverse=True)[:10]
+            embed.add_field(
+                name="Largest Differences",
+                value="\n".join(
+                    f"<@{d.user_id}>: {d.users_xp:,} total vs {d.history_xp:,} history ({d.users_xp - d.history_xp:+,})"
+                    for d in worst
+                ),
+                inline=False
+            )
+        if repair:
+            embed.add_field(name="Repaired", value=f"{repaired:,} users ({repair})", inline=False)
+        elif drifting:
+            embed.set_footer(text="Run /xpcheck repair:history to fix (repair:users only if history is right)")
+        await ctx.send(embed=embed)
+    except ValueError as e:
+        await ctx.send(f"❌ {e}")
+    except Exception as e:
+        await ctx.send(f"❌ Error checking XP consistency: {e}")
+
 @bot.tree.command(name="setxp", description="Set a user's XP (Admin)")
 @discord.app_commands.checks.has_permissions(administrator=True)
 async def setxp_slash(interaction: discord.Interaction, member: discord.Member, amount: str):
@@ -1931,12 +2117,11 @@ async def endseason_slash(interaction: discord.Interaction):
 async def toggle_prefix_commands_slash(interaction: discord.Interaction, enabled: bool = None):
     if not await defer_interaction(interaction):
         return
-    current = db.get_guild_settings(interaction.guild.id).get('prefix_commands_enabled', True)
     if enabled is None:
-        new_state = not current
+        new_state = db.toggle_guild_setting(interaction.guild.id, 'prefix_commands_enabled')
     else:
         new_state = bool(enabled)
-    db.update_guild_setting(interaction.guild.id, 'prefix_commands_enabled', 1 if new_state else 0)
+        db.update_guild_setting(interaction.guild.id, 'prefix_commands_enabled', new_state)
     ctx = InteractionContext(interaction)
     await ctx.send(f"✅ Prefix commands {'enabled' if new_state else 'disabled'}")
 
@@ -1950,13 +2135,11 @@ async def help_config_slash(interaction: discord.Interaction):
 @bot.command()
 @commands.has_permissions(manage_guild=True)
 async def toggleprefix(ctx, enabled: bool = None):
-    settings = db.get_guild_settings(ctx.guild.id)
     if enabled is None:
-        new_state = not settings.get('prefix_commands_enabled', True)
+        new_state = db.toggle_guild_setting(ctx.guild.id, 'prefix_commands_enabled')
     else:
         new_state = bool(enabled)
-    db.update_guild_setting(ctx.guild.id, 'prefix_commands_enabled', 1 if new_state else 0)
-    clear_guild_cache(ctx.guild.id)  # ← ADD THIS LINE
+        db.update_guild_setting(ctx.guild.id, 'prefix_commands_enabled', new_state)
     await ctx.send(f"✅ Prefix commands {'enabled' if new_state else 'disabled'}")
 
 # -------------------------
@@ -2054,9 +2237,8 @@ async def compare(ctx, member: discord.Member):
 async def serverstats(ctx):
     """Show aggregated server stats"""
     ag = db.get_server_aggregates(ctx.guild.id)
-    xp_list = db.get_all_user_xp(ctx.guild.id)
-    avg_xp = int(sum(xp_list)/len(xp_list)) if xp_list else 0
-    avg_level = sum(level_from_xp(x, ctx.guild.id) for x in xp_list) / len(xp_list) if xp_list else 0
+    avg_xp = ag['avg_xp']
+    avg_level = ag['avg_level']
 
     embed = discord.Embed(title=f"📈 Server Stats - {ctx.guild.name}", color=0x9b59b6)
     embed.add_field(name="Total Users (tracked)", value=str(ag['total_users']), inline=True)
@@ -2066,6 +2248,17 @@ async def serverstats(ctx):
     embed.add_field(name="Average XP per User", value=f"{avg_xp:,}", inline=True)
     embed.add_field(name="Average Level", value=f"{avg_level:.2f}", inline=True)
 
+    # Level distribution in bands of 10 levels
+    bands = {}
+    for level, count in ag['level_histogram'].items():
+        bands[level // 10] = bands.get(level // 10, 0) + count
+    if bands:
+        embed.add_field(
+            name="Level Distribution",
+            value="\n".join(f"Lv {b * 10}-{b * 10 + 9}: **{count:,}**" for b, count in sorted(bands.items())[:10]),
+            inline=False
+        )
+
     await ctx.send(embed=embed)
 
 # -------------------------
@@ -2290,7 +2483,7 @@ async def xp(ctx, member: discord.Member = None):
     member = member or ctx.author
     
     # First check if user is linked to web app
-    web_user = get_web_app_user(member.id)
+    web_user = await get_web_app_user(member.id)
     
     if web_user:
         # User is linked - show web app data
@@ -2469,6 +2662,43 @@ async def leaderboard(ctx, page: int = 1):
     
     await ctx.send(embed=embed)
 
+@bot.command(aliases=['around'])
+async def aroundme(ctx, member: discord.Member = None, radius: int = 5):
+    """View the leaderboard around you, with XP gaps to the users next to you"""
+    member = member or ctx.author
+    radius = max(1, min(radius, 10))
+    window = db.get_leaderboard_window(member.id, ctx.guild.id, radius=radius)
+    
+    if not window:
+        await ctx.send(f"❌ {member.display_name} isn't on the leaderboard yet. Start chatting to earn XP!")
+        return
+    
+    my_position, _, my_xp = next(row for row in window if row[1] == str(member.id))
+    lines = []
+    for position, user_id, xp in window:
+        other = ctx.guild.get_member(int(user_id))
+        name = other.display_name if other else f"<@{user_id}>"
+        level = safe_level_from_xp(xp, ctx.guild.id)
+        if position == my_position:
+            lines.append(f"**#{position} • {name} • Level {level} • {xp:,} XP** ◀")
+        else:
+            gap = xp - my_xp
+            gap_str = f"+{gap:,} ahead" if gap > 0 else ("tied" if gap == 0 else f"{-gap:,} behind")
+            lines.append(f"#{position} • {name} • Level {level} • {xp:,} XP ({gap_str})")
+    
+    embed = discord.Embed(
+        title="🏆 AROUND ME",
+        description="\n".join(lines),
+        color=0xffd700
+    )
+    ahead = [row for row in window if row[0] < my_position]
+    if ahead:
+        embed.set_footer(text=f"{ahead[-1][2] - my_xp + 1:,} XP to move up a spot")
+    else:
+        embed.set_footer(text="Top of the server!")
+    
+    await ctx.send(embed=embed)
+
 @bot.command()
 async def daily(ctx):
     """Claim your daily XP reward (scales with level)"""
@@ -2515,7 +2745,7 @@ async def daily(ctx):
     
     if success:
         # Sync daily XP to web app
-        asyncio.create_task(db.sync_xp_to_web(str(ctx.author.id), result, "discord_daily"))
+        xp_sync.add(str(ctx.author.id), result, "discord_daily")
         
         await ctx.send(
             f"🎁 **DAILY REWARD**\n"
@@ -2578,10 +2808,10 @@ async def addxp(ctx, member: discord.Member, amount: int):
     old_level = level_from_xp(user_data['xp'], ctx.guild.id)
     old_rank = rank_from_level(old_level)
 
-    db.add_xp(member.id, ctx.guild.id, amount)
+    db.add_xp(member.id, ctx.guild.id, amount, lane=INTERACTIVE)
     
     # Sync admin-added XP to web app
-    asyncio.create_task(db.sync_xp_to_web(str(member.id), amount, "discord_admin"))
+    xp_sync.add(str(member.id), amount, "discord_admin")
 
     new_data = db.get_user(member.id, ctx.guild.id)
     new_level = level_from_xp(new_data['xp'], ctx.guild.id)
@@ -2614,6 +2844,7 @@ async def help_leveling(ctx):
         value=(
             "`/xp [@user]` - View XP and rank\n"
             "`/leaderboard [page]` - View top hunters\n"
+            "`/aroundme [@user]` - Your spot on the leaderboard\n"
             "`/weekly [page]` - Weekly XP leaderboard\n"
             "`/voicetop [page]` - Voice time leaderboard\n"
             "`/stats [@user]` - Detailed user stats\n"
@@ -2631,6 +2862,7 @@ async def help_leveling(ctx):
         value=(
             "`/xp [@user]` - View XP and rank\n"
             "`/leaderboard [page]` - View top hunters\n"
+            "`/aroundme [@user]` - Your spot on the leaderboard\n"
             "`/weekly [page]` - Weekly XP leaderboard\n"
             "`/voicetop [page]` - Voice time leaderboard\n"
             "`/stats [@user]` - Detailed user stats\n"
@@ -2713,12 +2945,6 @@ async def syncroles(ctx):
         f"✗ Errors: {errors} users"
     )
 
-def clear_guild_cache(guild_id):
-    """Clear cached settings when admin changes them"""
-    cache_key = str(guild_id)
-    if cache_key in _guild_settings_cache:
-        del _guild_settings_cache[cache_key]
-        print(f"Cleared cache for guild {guild_id}")
 
 # -------------------------
 # ADMIN CONFIGURATION COMMANDS
@@ -2804,10 +3030,7 @@ async def setxprange(ctx, min_xp: int, max_xp: int):
         await ctx.send("❌ Invalid range! Min must be ≥1, Max must be ≥Min and ≤100")
         return
     
-    db.update_guild_setting(ctx.guild.id, 'xp_min', min_xp)
-    db.update_guild_setting(ctx.guild.id, 'xp_max', max_xp)
-    
-    clear_guild_cache(ctx.guild.id)  # ← ADD THIS LINE
+    db.update_guild_settings(ctx.guild.id, xp_min=min_xp, xp_max=max_xp)
     
     await ctx.send(f"✅ XP range set to **{min_xp}-{max_xp} XP** per message")
 
@@ -2820,18 +3043,13 @@ async def setcooldown(ctx, seconds: int):
         return
     
     db.update_guild_setting(ctx.guild.id, 'xp_cooldown', seconds)
-    clear_guild_cache(ctx.guild.id)  # ← ADD THIS LINE
     await ctx.send(f"✅ XP cooldown set to **{seconds} seconds**")
 
 @bot.command()
 @commands.has_permissions(manage_guild=True)
 async def togglevoicexp(ctx):
     """Toggle voice XP on/off (Admin only)"""
-    settings = db.get_guild_settings(ctx.guild.id)
-    new_state = not settings['voice_xp_enabled']
-    
-    db.update_guild_setting(ctx.guild.id, 'voice_xp_enabled', 1 if new_state else 0)
-    clear_guild_cache(ctx.guild.id)  # ← ADD THIS LINE
+    new_state = db.toggle_guild_setting(ctx.guild.id, 'voice_xp_enabled')
     status = "✅ Enabled" if new_state else "❌ Disabled"
     await ctx.send(f"{status} voice XP")
 
@@ -2843,18 +3061,13 @@ async def setvoicexp(ctx, xp_per_minute: int):
         await ctx.send("❌ Voice XP must be between 0 and 50 per minute")
         return
     db.update_guild_setting(ctx.guild.id, 'voice_xp_rate', xp_per_minute)
-    clear_guild_cache(ctx.guild.id)  # ← ADD THIS LINE
     await ctx.send(f"✅ Voice XP set to **{xp_per_minute} XP per minute**")
 
 @bot.command()
 @commands.has_permissions(manage_guild=True)
 async def toggledaily(ctx):
     """Toggle daily rewards on/off (Admin only)"""
-    settings = db.get_guild_settings(ctx.guild.id)
-    new_state = not settings['daily_enabled']
-    
-    db.update_guild_setting(ctx.guild.id, 'daily_enabled', 1 if new_state else 0)
-    clear_guild_cache(ctx.guild.id)  # ← ADD THIS LINE
+    new_state = db.toggle_guild_setting(ctx.guild.id, 'daily_enabled')
     status = "✅ Enabled" if new_state else "❌ Disabled"
     await ctx.send(f"{status} daily rewards")
 
@@ -2867,7 +3080,6 @@ async def setdaily(ctx, xp_amount: int):
         return
     
     db.update_guild_setting(ctx.guild.id, 'daily_reward', xp_amount)
-    clear_guild_cache(ctx.guild.id)  # ← ADD THIS LINE
     await ctx.send(f"✅ Daily reward set to **{xp_amount:,} XP**")
 
 @bot.command()
@@ -2875,7 +3087,6 @@ async def setdaily(ctx, xp_amount: int):
 async def blacklist(ctx, channel: discord.TextChannel):
     """Blacklist a channel from giving XP (Admin only)"""
     db.add_blacklisted_channel(ctx.guild.id, channel.id)
-    clear_guild_cache(ctx.guild.id)  # ← ADD THIS LINE
     await ctx.send(f"🚫 {channel.mention} will no longer give XP")
 
 @bot.command()
@@ -2883,7 +3094,6 @@ async def blacklist(ctx, channel: discord.TextChannel):
 async def unblacklist(ctx, channel: discord.TextChannel):
     """Remove a channel from blacklist (Admin only)"""
     db.remove_blacklisted_channel(ctx.guild.id, channel.id)
-    clear_guild_cache(ctx.guild.id)  # ← ADD THIS LINE
     await ctx.send(f"✅ {channel.mention} can now give XP")
 
 @bot.command()
@@ -2891,7 +3101,6 @@ async def unblacklist(ctx, channel: discord.TextChannel):
 async def whitelist(ctx, channel: discord.TextChannel):
     """Whitelist a channel (only whitelisted channels give XP) (Admin only)"""
     db.add_whitelisted_channel(ctx.guild.id, channel.id)
-    clear_guild_cache(ctx.guild.id)  # ← ADD THIS LINE
     await ctx.send(f"✅ {channel.mention} added to whitelist. Only whitelisted channels will give XP.")
 
 @bot.command()
@@ -2899,7 +3108,6 @@ async def whitelist(ctx, channel: discord.TextChannel):
 async def unwhitelist(ctx, channel: discord.TextChannel):
     """Remove a channel from whitelist (Admin only)"""
     db.remove_whitelisted_channel(ctx.guild.id, channel.id)
-    clear_guild_cache(ctx.guild.id)  # ← ADD THIS LINE
     await ctx.send(f"❌ {channel.mention} removed from whitelist")
 
 @bot.command()
@@ -2907,7 +3115,6 @@ async def unwhitelist(ctx, channel: discord.TextChannel):
 async def clearwhitelist(ctx):
     """Clear all whitelisted channels (Admin only)"""
     db.update_guild_setting(ctx.guild.id, 'whitelisted_channels', [])
-    clear_guild_cache(ctx.guild.id)  # ← ADD THIS LINE
     await ctx.send("✅ Whitelist cleared. All channels can now give XP (except blacklisted)")
 
 @bot.command()
@@ -2919,7 +3126,6 @@ async def setmultiplier(ctx, role: discord.Role, multiplier: float):
         return
     
     db.set_role_multiplier(ctx.guild.id, role.id, multiplier)
-    clear_guild_cache(ctx.guild.id)  # ← ADD THIS LINE
     await ctx.send(f"⚡ {role.mention} now has **{multiplier}x** XP multiplier")
 
 @bot.command()
@@ -2927,7 +3133,6 @@ async def setmultiplier(ctx, role: discord.Role, multiplier: float):
 async def removemultiplier(ctx, role: discord.Role):
     """Remove XP multiplier from a role (Admin only)"""
     db.remove_role_multiplier(ctx.guild.id, role.id)
-    clear_guild_cache(ctx.guild.id)  # ← ADD THIS LINE
     await ctx.send(f"❌ Removed XP multiplier from {role.mention}")
 
 @bot.command()
@@ -2936,22 +3141,16 @@ async def setlevelupchannel(ctx, channel: discord.TextChannel = None):
     """Set a specific channel for level-up messages (Admin only)"""
     if channel:
         db.update_guild_setting(ctx.guild.id, 'levelup_channel', str(channel.id))
-        clear_guild_cache(ctx.guild.id)  # ← ADD THIS LINE
         await ctx.send(f"📢 Level-up messages will now be sent to {channel.mention}")
     else:
         db.update_guild_setting(ctx.guild.id, 'levelup_channel', None)
-        clear_guild_cache(ctx.guild.id)  # ← ADD THIS LINE
         await ctx.send("📢 Level-up messages will be sent in the same channel as the user")
 
 @bot.command()
 @commands.has_permissions(manage_guild=True)
 async def togglelevelup(ctx):
     """Toggle level-up messages on/off (Admin only)"""
-    settings = db.get_guild_settings(ctx.guild.id)
-    new_state = not settings['levelup_messages']
-    
-    db.update_guild_setting(ctx.guild.id, 'levelup_messages', 1 if new_state else 0)
-    clear_guild_cache(ctx.guild.id)  # ← ADD THIS LINE
+    new_state = db.toggle_guild_setting(ctx.guild.id, 'levelup_messages')
     status = "✅ Enabled" if new_state else "❌ Disabled"
     await ctx.send(f"{status} level-up messages")
 
@@ -3370,7 +3569,7 @@ async def claimstored(ctx):
     db.add_xp(ctx.author.id, ctx.guild.id, total_xp)
     
     # Sync mage daily XP to web app
-    asyncio.create_task(db.sync_xp_to_web(str(ctx.author.id), total_xp, "discord_mage_daily"))
+    xp_sync.add(str(ctx.author.id), total_xp, "discord_mage_daily")
     
     # Clear stored dailies
     db.use_stored_dailies(ctx.author.id, ctx.guild.id)
@@ -3951,19 +4150,6 @@ async def card_slash(interaction: discord.Interaction):
     embed.set_footer(text="\"I am a Hunter chosen by The System\" | Use /xp for Discord-based rank card")
     
     await interaction.followup.send(embed=embed)
-            
-            # Clean up temp file
-            try:
-                os.remove(card_path)
-            except:
-                pass
-        else:
-            # Fallback to text-only if image generation fails
-            await _send_text_card(interaction, result)
-    except Exception as e:
-        print(f"Error generating card image: {e}")
-        # Fallback to text-only
-        await _send_text_card(interaction, result)
 
 async def _send_text_card(interaction: discord.Interaction, result: dict):
     """Fallback text-based card when image generation fails."""
@@ -4006,4 +4192,8 @@ async def _send_text_card(interaction: discord.Interaction, result: dict):
 # RUN BOT
 # -------------------------
 if __name__ == "__main__":
-    bot.run(bot_config.TOKEN)
+    try:
+        bot.run(bot_config.TOKEN)
+    finally:
+        # Write back pending settings and drain the write queues
+        db.stop_write_worker()
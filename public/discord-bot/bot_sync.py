@@ -0,0 +1,193 @@
+"""Client for the web app's bot-sync Edge Function.
+
+Every bot-sync request is the same POST of {discord_id, action, data} with
+the bot's credentials, so the Database web methods, the web outbox and
+anything new go through one BotSyncClient instead of each building the
+request and handling its errors:
+
+    status, result = await client.call(discord_id, "get_quests")
+    result = await client.request(discord_id, "complete_quest", {"quest_index": 0})
+    answers = await client.batch([(id_a, "get_stats", None), (id_b, "get_card_data", None)])
+
+call() and batch() share the session (pooling, circuit breaker, request
+scheduling, see web_client.py), the read cache (web_cache.py) and
+single-flight reads. batch() sends any number of actions, for any users, as
+one 'batch' request of up to MAX_BATCH_ITEMS items; cached reads in it are
+answered locally and never sent.
+
+Each answer also tells whether the member is linked to a web account
+(web_cache.LinkStatusCache); reads for a member known not to be are
+answered with the edge function's "User not linked" 404 without sending.
+"""
+from web_cache import LinkStatusCache, WebResponseCache
+from web_client import BACKGROUND, INTERACTIVE, SingleFlight, WebSession
+
+# Actions that only read; every other action changes something for the user
+READ_ACTIONS = {
+    "get_stats", "verify_link", "get_quests", "get_habits", "get_streak", "get_gates", "get_challenges",
+    "get_card_data",
+}
+# Actions nobody is waiting on, sent after interactive ones
+BACKGROUND_ACTIONS = {"add_xp"}
+MAX_BATCH_ITEMS = 50   # enforced by the bot-sync edge function
+NOT_LINKED = "User not linked"  # error of the edge function's 404 for unlinked members
+
+
+class BatchError(Exception):
+    """A batch request was answered with an error as a whole (e.g. an edge function without 'batch')."""
+
+    def __init__(self, status, error):
+        super().__init__(f"Batch failed: {error} (HTTP {status})")
+        self.status = status
+
+
+class BotSyncClient:
+    def __init__(self, cache=None, session=None, links=None):
+        self.session = session or WebSession()
+        self.cache = cache or WebResponseCache()
+        self.links = links or LinkStatusCache()
+        self.reads = SingleFlight()
+        # Totals since start, for /webstatus
+        self.batches = 0
+
+    def enabled(self):
+        import config as bot_config
+        return bool(bot_config.BOT_SYNC_SECRET and bot_config.SUPABASE_SERVICE_ROLE_KEY)
+
+    def url(self):
+        import config as bot_config
+        return f"{bot_config.SUPABASE_URL}/functions/v1/bot-sync"
+
+    async def start(self):
+        """Open the session and warm a connection to the Edge Function (call at startup)."""
+        await self.session.start(self.url())
+
+    async def close(self):
+        await self.session.close()
+
+    async def _post(self, payload, priority):
+        import config as bot_config
+        return await self.session.post_json(
+            self.url(),
+            payload,
+            headers={
+                "Authorization": f"Bearer {bot_config.SUPABASE_SERVICE_ROLE_KEY}",
+                "X-Bot-Secret": bot_config.BOT_SYNC_SECRET,
+                "Content-Type": "application/json"
+            },
+            priority=priority
+        )
+
+    def _learn(self, discord_id, action, status, result):
+        # Any answer about a member says whether they are linked
+        if status == 200:
+            linked = result.get("linked") if action == "verify_link" else True
+            self.links.set(discord_id, bool(linked))
+        elif status == 404 and (result or {}).get("error") == NOT_LINKED:
+            self.links.set(discord_id, False)
+
+    def _not_linked(self, discord_id, action):
+        """True for a read for a member known not to be linked (verify_link always asks)."""
+        return action in READ_ACTIONS and action != "verify_link" and self.links.get(discord_id) is False
+
+    def _changed(self, discord_id):
+        # Even a failed change may have landed
+        self.cache.invalidate(discord_id)
+        for action in self.cache.ttls:
+            self.reads.forget((action, discord_id))
+
+    async def call(self, discord_id, action, data=None):
+        """Send one action; returns (status, result).
+
+        Reads are answered from the cache when they can be, and concurrent identical
+        reads share one request; any other action clears the user's cached reads.
+        Reads for members known not to be linked get a 404 without being sent.
+        Read results are shared, so don't modify them. Raises on timeouts, connection
+        errors and while the circuit is open.
+        """
+        discord_id = str(discord_id)
+        payload = {"discord_id": discord_id, "action": action}
+        if data:
+            payload["data"] = data
+        priority = BACKGROUND if action in BACKGROUND_ACTIONS else INTERACTIVE
+        if action not in READ_ACTIONS:
+            try:
+                status, result = await self._post(payload, priority)
+            finally:
+                self._changed(discord_id)
+            self._learn(discord_id, action, status, result)
+            return status, result
+
+        if self._not_linked(discord_id, action):
+            return 404, {"success": False, "error": NOT_LINKED}
+        if not self.cache.cacheable(payload):
+            status, result = await self._post(payload, priority)
+            self._learn(discord_id, action, status, result)
+            return status, result
+        cached = self.cache.get(discord_id, action)
+        if cached is not None:
+            return 200, cached
+
+        async def fetch():
+            token = self.cache.begin()
+            status, result = await self._post(payload, priority)
+            self._learn(discord_id, action, status, result)
+            if status == 200:
+                self.cache.put(discord_id, action, result, token)
+            return status, result
+
+        return await self.reads.do((action, discord_id), fetch)
+
+    async def request(self, discord_id, action, data=None):
+        """call() for command handlers: the result, or {"success": False, "error": ...}."""
+        if not self.enabled():
+            return {"success": False, "error": "Web sync not configured"}
+        try:
+            status, result = await self.call(discord_id, action, data)
+            return result
+        except Exception as e:
+            print(f"❌ Web {action} error: {e}")
+            return {"success": False, "error": str(e) or type(e).__name__}
+
+    async def batch(self, items):
+        """Send (discord_id, action, data) items in as few round trips as possible.
+
+        Returns a (status, result) pair per item, in order. A user's items are applied
+        in the order given. Raises like call() if a request can't be made, and BatchError
+        if it is refused as a whole; items in that request were not (or not knowingly) applied.
+        """
+        answers = [None] * len(items)
+        to_send = []
+        for index, (discord_id, action, data) in enumerate(items):
+            discord_id = str(discord_id)
+            payload = {"discord_id": discord_id, "action": action}
+            if data:
+                payload["data"] = data
+            if self._not_linked(discord_id, action):
+                answers[index] = (404, {"success": False, "error": NOT_LINKED})
+                continue
+            cached = self.cache.get(discord_id, action) if self.cache.cacheable(payload) else None
+            if cached is not None:
+                answers[index] = (200, cached)
+            else:
+                to_send.append((index, payload))
+
+        for start in range(0, len(to_send), MAX_BATCH_ITEMS):
+            chunk = to_send[start:start + MAX_BATCH_ITEMS]
+            priority = BACKGROUND if all(p["action"] in BACKGROUND_ACTIONS for _, p in chunk) else INTERACTIVE
+            token = self.cache.begin()
+            try:
+                status, result = await self._post({"action": "batch", "items": [p for _, p in chunk]}, priority)
+            finally:
+                for _, payload in chunk:
+                    if payload["action"] not in READ_ACTIONS:
+                        self._changed(payload["discord_id"])
+            self.batches += 1
+            if status != 200:
+                raise BatchError(status, (result or {}).get("error", "Unknown error"))
+            for (index, payload), answer in zip(chunk, result.get("results", [])):
+                answers[index] = (answer.get("status", 500), answer.get("result") or {})
+                self._learn(payload["discord_id"], payload["action"], *answers[index])
+                if answers[index][0] == 200 and self.cache.cacheable(payload):
+                    self.cache.put(payload["discord_id"], payload["action"], answers[index][1], token)
+        return [answer or (500, {"success": False, "error": "No result in batch response"}) for answer in answers]
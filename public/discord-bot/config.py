@@ -17,6 +17,37 @@ BOT_SYNC_SECRET = os.getenv("BOT_SYNC_SECRET")
 # Service Role Key (for authenticated API calls)
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
+# Database sharding: "0" = single system.db, "N" = N hash buckets, "guild" = one file per guild
+_db_shards = os.getenv("DB_SHARDS", "0").strip().lower()
+DB_SHARD_COUNT = -1 if _db_shards == "guild" else int(_db_shards or 0)
+
+# Append-only XP event log (see xp_log.py); empty disables it
+XP_EVENT_LOG = os.getenv("XP_EVENT_LOG", "").strip() or None
+
+# Delete xp_history rows older than this many days during maintenance; 0 keeps everything.
+# Never less than 7 so /weekly keeps working.
+_retention = int(os.getenv("XP_HISTORY_RETENTION_DAYS", "0") or 0)
+XP_HISTORY_RETENTION_DAYS = max(_retention, 7) if _retention > 0 else 0
+
+# SQLite performance profile for the bot: "durable" or "balanced" (default), see database.PRAGMA_PROFILES.
+# "fast" turns fsync off, which can corrupt the database on an OS crash or power loss, so the bot won't use it.
+DB_PROFILE = os.getenv("DB_PROFILE", "balanced").strip().lower()
+if DB_PROFILE == "fast":
+    print("⚠️ DB_PROFILE=fast can corrupt the database on an OS crash or power loss, using 'balanced'")
+    DB_PROFILE = "balanced"
+
+# XP synced to the web app is summed per user and sent every this many seconds (see web_sync.py)
+WEB_SYNC_FLUSH_SECONDS = float(os.getenv("WEB_SYNC_FLUSH_SECONDS", "5") or 5)
+
+# Web app reads (/viewquests, /habits, ...) are cached per user; "action=seconds" pairs override
+# the defaults in web_cache.TTLS, 0 turns an action's cache off
+WEB_CACHE_TTLS = os.getenv("WEB_CACHE_TTLS", "").strip()
+WEB_CACHE_MAX_ENTRIES = int(os.getenv("WEB_CACHE_MAX_ENTRIES", "5000") or 5000)
+
+# How long a member is remembered as linked / not linked to a web account (0 = always ask)
+WEB_LINKED_CACHE_SECONDS = float(os.getenv("WEB_LINKED_CACHE_SECONDS", "600") or 0)
+WEB_UNLINKED_CACHE_SECONDS = float(os.getenv("WEB_UNLINKED_CACHE_SECONDS", "300") or 0)
+
 if not TOKEN:
     raise ValueError("DISCORD_TOKEN not found in environment variables!")
 
@@ -0,0 +1,242 @@
+"""Reconcile users.xp totals against xp_history.
+
+Older versions changed users.xp in set_xp and claim_daily without any
+history, and before add_xp wrote both tables in one transaction a crash
+could lose either half, so the two drift apart over time. (Now every XP
+change writes its history row, or an adjustment for set_xp, in the same
+transaction as the total.) This walks every guild, compares each user's
+total with the sum of their history (live months and archived ones), and
+reports or repairs the difference.
+
+Memory is bounded by the largest guild: one guild's history sums are held
+at a time and users are read in keyset chunks. Every query is short, so it
+is safe to run against the live database; pass a rows-per-second budget to
+keep its IO down while the bot is busy.
+
+Usage:
+    python consistency.py [--guild ID] [--csv drift.csv] [--repair history|users]
+                          [--rate 20000] [--chunk 5000] [--db system.db] [--shards 0]
+
+Repair modes:
+    history  append an adjustment row per user so history adds up to users.xp
+             (dated at the start of the oldest live month, to keep it out
+             of weekly leaderboards)
+    users    move users.xp to the history total, as a delta queued with the
+             XP awards, so XP earned since the check isn't lost. Only for
+             drift from lost history writes: on a database from before
+             dailies and set_xp wrote history, it takes that XP away, so
+             run a history repair there first
+
+Repairs are refused once XP_HISTORY_RETENTION_DAYS has pruned history,
+because the totals can no longer be rebuilt from it.
+"""
+import argparse
+import csv
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import history_partitions
+from database import Database, PER_GUILD_SHARDS
+
+CHUNK_SIZE = 5000
+REPAIR_MODES = ("history", "users")
+
+# users_xp is None for history rows whose user no longer exists
+Drift = namedtuple("Drift", "guild_id user_id users_xp history_xp")
+
+
+class _Throttle:
+    """Sleeps so no more than rows_per_second rows are read on average (0 = no limit)."""
+
+    def __init__(self, rows_per_second=0):
+        self.rate = rows_per_second
+        self.start = time.monotonic()
+        self.rows = 0
+
+    def spend(self, rows):
+        if not self.rate:
+            return
+        self.rows += rows
+        ahead = self.rows / self.rate - (time.monotonic() - self.start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def history_pruned(conn):
+    """True once retention pruning has deleted history from this file."""
+    try:
+        return conn.execute("SELECT 1 FROM maintenance_log WHERE task = 'prune'").fetchone() is not None
+    except Exception:
+        return False
+
+
+def history_totals(conn, db_path, guild_id):
+    """{user_id: history XP} for one guild, plus the number of history rows read."""
+    totals = {}
+    scanned = 0
+
+    def add(table):
+        nonlocal scanned
+        rows = conn.execute(
+            f"SELECT user_id, SUM(xp), COUNT(*) FROM {table} WHERE guild_id = ? GROUP BY user_id",
+            (guild_id,)
+        )
+        for user_id, xp, count in rows:
+            totals[user_id] = totals.get(user_id, 0) + (xp or 0)
+            scanned += count
+
+    # One month at a time rather than through the view, to keep each read short
+    for month in history_partitions.live_months(conn):
+        add(history_partitions.table_for(month))
+    for month in history_partitions.archived_months(db_path):
+        with history_partitions.attached_archive(conn, db_path, month) as table:
+            add(table)
+    return totals, scanned
+
+
+def check_guild(conn, db_path, guild_id, chunk_size=CHUNK_SIZE, throttle=None):
+    """Compare one guild's users with its history. Returns (drifts, users_checked)."""
+    throttle = throttle or _Throttle()
+    guild_id = str(guild_id)
+    history, scanned = history_totals(conn, db_path, guild_id)
+    throttle.spend(scanned)
+
+    drifts = []
+    checked = 0
+    last_user = ""
+    while True:
+        rows = conn.execute(
+            "SELECT user_id, xp FROM users WHERE guild_id = ? AND user_id > ? ORDER BY user_id LIMIT ?",
+            (guild_id, last_user, chunk_size)
+        ).fetchall()
+        if not rows:
+            break
+        for user_id, xp in rows:
+            total = history.pop(user_id, 0)
+            if (xp or 0) != total:
+                drifts.append(Drift(guild_id, user_id, xp or 0, total))
+        checked += len(rows)
+        last_user = rows[-1][0]
+        throttle.spend(len(rows))
+
+    # Whatever is left has history but no users row
+    drifts.extend(Drift(guild_id, user_id, None, total) for user_id, total in history.items() if total)
+    return drifts, checked
+
+
+def _guild_ids(conn):
+    guilds = {row[0] for row in conn.execute("SELECT DISTINCT guild_id FROM users")}
+    for month in history_partitions.live_months(conn):
+        table = history_partitions.table_for(month)
+        guilds.update(row[0] for row in conn.execute(f"SELECT DISTINCT guild_id FROM {table}"))
+    return sorted(g for g in guilds if g is not None)
+
+
+def check(db, guild_ids=None, chunk_size=CHUNK_SIZE, rows_per_second=0, settle=0.0):
+    """Yield (guild_id, drifts, users_checked) for every guild (or just guild_ids).
+
+    With settle > 0, a guild with drift is checked again after that many
+    seconds and only drift seen both times is reported, so writes that were
+    still queued during the first pass don't show up as false positives.
+    """
+    throttle = _Throttle(rows_per_second)
+    by_path = {}
+    if guild_ids is not None:
+        for guild_id in guild_ids:
+            by_path.setdefault(db.shard_path(guild_id), []).append(str(guild_id))
+    else:
+        for path in db.all_db_paths():
+            with db.get_conn(path) as conn:
+                by_path[path] = _guild_ids(conn)
+
+    for path, guilds in by_path.items():
+        for guild_id in guilds:
+            with db.get_conn(path) as conn:
+                drifts, checked = check_guild(conn, path, guild_id, chunk_size, throttle)
+            if drifts and settle:
+                time.sleep(settle)
+                first = {(d.user_id, d.users_xp is None) for d in drifts}
+                with db.get_conn(path) as conn:
+                    again, _ = check_guild(conn, path, guild_id, chunk_size, throttle)
+                drifts = [d for d in again if (d.user_id, d.users_xp is None) in first]
+            yield guild_id, drifts, checked
+
+
+def repair(db, drifts, mode="history"):
+    """Queue fixes for drifts (orphaned history is left alone). Returns users repaired."""
+    if mode not in REPAIR_MODES:
+        raise ValueError(f"Repair mode must be one of {', '.join(REPAIR_MODES)}")
+    repaired = 0
+    adjustment_times = {}
+    for drift in drifts:
+        if drift.users_xp is None:
+            continue
+        path = db.shard_path(drift.guild_id)
+        if path not in adjustment_times:
+            with db.get_conn(path) as conn:
+                if history_pruned(conn):
+                    raise ValueError(f"XP history in {path} has been pruned, totals can't be reconciled")
+                months = history_partitions.live_months(conn)
+            adjustment_times[path] = datetime.fromisoformat(f"{months[0]}-01")
+        if mode == "history":
+            db.add_xp_history(drift.user_id, drift.guild_id, drift.users_xp - drift.history_xp, adjustment_times[path])
+        else:
+            # Awards add to both sides, so the difference holds even if some landed since the check
+            db.adjust_xp(drift.user_id, drift.guild_id, drift.history_xp - drift.users_xp)
+        repaired += 1
+    return repaired
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Check users.xp totals against xp_history")
+    parser.add_argument("--guild", action="append", help="only check this guild (repeatable)")
+    parser.add_argument("--csv", help="write every drift to this CSV file")
+    parser.add_argument("--repair", choices=REPAIR_MODES)
+    parser.add_argument("--rate", type=int, default=0, help="max rows read per second (0 = no limit)")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--settle", type=float, default=0.0,
+                        help="re-check drifting guilds after this many seconds (when the bot is running)")
+    parser.add_argument("--db", default="system.db")
+    parser.add_argument("--shards", default="0")
+    args = parser.parse_args()
+
+    shards = args.shards.strip().lower()
+    db = Database(args.db, shard_count=PER_GUILD_SHARDS if shards == "guild" else int(shards))
+    out = open(args.csv, "w", newline="") if args.csv else None
+    writer = csv.writer(out) if out else None
+    if writer:
+        writer.writerow(["guild_id", "user_id", "users_xp", "history_xp", "difference"])
+    guilds = users = drifting = orphans = repaired = 0
+    total_drift = 0
+    try:
+        for guild_id, drifts, checked in check(db, args.guild, args.chunk, args.rate, args.settle):
+            guilds += 1
+            users += checked
+            for drift in drifts:
+                if drift.users_xp is None:
+                    orphans += 1
+                else:
+                    drifting += 1
+                    total_drift += drift.users_xp - drift.history_xp
+                if writer:
+                    difference = "" if drift.users_xp is None else drift.users_xp - drift.history_xp
+                    writer.writerow([*drift, difference])
+            if drifts:
+                print(f"⚠️ Guild {guild_id}: {len(drifts)} discrepancies in {checked:,} users")
+            if drifts and args.repair:
+                repaired += repair(db, drifts, args.repair)
+        print(f"✅ Checked {users:,} users in {guilds} guild(s): {drifting:,} drifting "
+              f"({total_drift:+,} XP), {orphans:,} with history but no user row")
+        if args.repair:
+            print(f"✅ Queued {args.repair} repairs for {repaired:,} users")
+    except ValueError as e:
+        print(f"❌ {e}")
+    finally:
+        if out:
+            out.close()
+        db.stop_write_worker()
+
+
+if __name__ == "__main__":
+    _main()
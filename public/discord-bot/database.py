@@ -1,73 +1,360 @@
 import sqlite3
 import os
+import glob
+import re
+import uuid
+import zlib
 from datetime import datetime, timedelta
 import json
 import queue
 import threading
 import time
 from contextlib import contextmanager
-import aiohttp
+from functools import lru_cache
 import asyncio
 
+import xp_log
+import history_partitions
+from settings_store import GuildSettingsStore
+from guild_stats import GuildStats
+from member_state import MemberStateTable
+from bot_sync import BotSyncClient
+import web_outbox
+from write_scheduler import FairWriteQueue, INTERACTIVE, BULK, LANES
+
+# Sharding modes: 0 keeps everything in one file, N > 0 hashes guilds into N
+# bucket files, PER_GUILD_SHARDS gives every guild its own file.
+PER_GUILD_SHARDS = -1
+
+# Tables whose changes by other processes invalidate in-memory caches. Every
+# write transaction that touches one records (table, guild) in cache_changes,
+# once per transaction, tagged with the writing process. When PRAGMA
+# data_version says someone else committed, the entries since the last look
+# tell which guilds to refresh; a process skips its own (see _write_worker_loop).
+CACHE_TABLES = ("users", "guild_settings")
+COHERENCE_POLL_SECONDS = 1.0
+GUILD_CHUNK = 500  # guild ids per IN (...) query
+
+_WRITE_TARGET = re.compile(
+    r'\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+(\w+)', re.I
+)
+
+
+@lru_cache(maxsize=512)
+def _cached_table(query):
+    """The CACHE_TABLES table a write statement changes, or None."""
+    match = _WRITE_TARGET.match(query)
+    table = match.group(1).lower() if match else None
+    return table if table in CACHE_TABLES else None
+
+
+def after_commit(callback):
+    """Statement-list entry that calls callback() on the write worker once the
+    transaction has committed (not at all if it fails)."""
+    return (None, callback)
+
+
+def create_cache_changes_table(conn):
+    """Latest change per cached table and guild, for caches in other processes."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS cache_changes (
+        name TEXT NOT NULL,
+        guild_id TEXT NOT NULL,  -- '' when not limited to one guild
+        origin TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        PRIMARY KEY (name, guild_id)
+    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_changes_version ON cache_changes (version)')
+
+
+def record_cache_changes(conn, changes, origin):
+    """Record {table: guild_ids} changed in conn's open transaction, so other processes
+    refresh those guilds; guild_ids of None means the whole file. Scripts that write
+    users or guild_settings without the write queue call this before committing."""
+    version = conn.execute('SELECT COALESCE(MAX(version), 0) + 1 FROM cache_changes').fetchone()[0]
+    conn.executemany(
+        '''INSERT INTO cache_changes (name, guild_id, origin, version) VALUES (?, ?, ?, ?)
+           ON CONFLICT(name, guild_id) DO UPDATE SET origin = excluded.origin, version = excluded.version''',
+        [(name, str(guild_id), origin, version)
+         for name, guild_ids in changes.items() for guild_id in (guild_ids if guild_ids is not None else ('',))]
+    )
+    return version
+
+
+def merge_changes(into, changes):
+    """Merge {name: guild_ids or None} into another such dict; None (everything) wins."""
+    for name, guild_ids in changes.items():
+        if guild_ids is None or (name in into and into[name] is None):
+            into[name] = None
+        else:
+            into.setdefault(name, set()).update(str(g) for g in guild_ids)
+    return into
+
+
+# Connection pragmas applied once when a pooled connection is opened. All of
+# them run in WAL mode; synchronous=NORMAL only risks the last commits on
+# power loss (never corruption). OFF skips fsync entirely, so an OS crash or
+# power loss can corrupt the database file: "fast" is only for offline jobs
+# on a copy (db_benchmark.py), and config.py won't let the bot use it.
+PRAGMA_PROFILES = {
+    "durable": {
+        "synchronous": "FULL",
+        "cache_size": -8000,           # 8 MB
+        "temp_store": "DEFAULT",
+        "mmap_size": 0,
+    },
+    "balanced": {
+        "synchronous": "NORMAL",
+        "cache_size": -32000,          # 32 MB
+        "temp_store": "MEMORY",
+        "mmap_size": 256 * 1024 ** 2,
+    },
+    "fast": {
+        "synchronous": "OFF",
+        "cache_size": -128000,         # 128 MB
+        "temp_store": "MEMORY",
+        "mmap_size": 1024 ** 3,
+    },
+}
+DEFAULT_PROFILE = "balanced"
+
+
+def _bucket_path(db_path, bucket):
+    base, ext = os.path.splitext(db_path)
+    return f"{base}.shard-{bucket:02d}{ext or '.db'}"
+
+
+def shard_path_for(db_path, guild_id, shard_count):
+    """Return the database file that owns a guild for the given shard mode."""
+    if not shard_count or guild_id is None:
+        return db_path
+    if shard_count == PER_GUILD_SHARDS:
+        base, ext = os.path.splitext(db_path)
+        return f"{base}.guild-{guild_id}{ext or '.db'}"
+    # crc32 is stable across processes, unlike hash() on str
+    return _bucket_path(db_path, zlib.crc32(str(guild_id).encode()) % shard_count)
+
+
 class Database:
-    def __init__(self, db_path="system.db"):
+    def __init__(self, db_path="system.db", shard_count=0, event_log_path=None, profile=DEFAULT_PROFILE,
+                 web_cache=None, link_cache=None):
         self.db_path = db_path
-        self.write_queue = queue.Queue()
+        self.shard_count = shard_count
+        if profile not in PRAGMA_PROFILES:
+            print(f"⚠️ Unknown DB profile '{profile}', using '{DEFAULT_PROFILE}'")
+            profile = DEFAULT_PROFILE
+        self.profile = profile
+        self.pragmas = PRAGMA_PROFILES[profile]
+        # Optional append-only record of every XP change, see xp_log.py
+        self.event_log = xp_log.XPEventLog(event_log_path) if event_log_path else None
+        self.write_queue = FairWriteQueue()
         self.worker_thread = None
         self.stop_worker = False
-        self._local = threading.local()
+        self._local = threading.local()  # per-thread {db_path: connection}
+        self._pool = []
+        self._pool_lock = threading.Lock()
+        # db file -> (queue, thread); the main file uses self.write_queue
+        self._writers = {}
+        self._writers_lock = threading.Lock()
+        self._initialized_paths = set()
+        self._history_months = set()  # (db_path, month) partitions known to exist
+        self._coherence = {}  # db_path -> cache_changes version / data_version / schema_version last seen
+        self._invalidation_listeners = {}  # CACHE_TABLES name or 'schema' -> [callback(db_path, guild_ids)]
+        self._xp_listeners = []  # callback(guild_id, user_id), see add_xp_listener
+        self.origin = uuid.uuid4().hex  # tags this process's cache_changes entries
+        self.bot_sync = BotSyncClient(web_cache, links=link_cache)  # every web app call, see bot_sync.py
+        self.outbox = web_outbox.WebOutbox(self)  # durable, retried web mutations
+        
+        for path in self.all_db_paths():
+            self.init_db(path)
         
-        self.init_db()
-        self.add_monthly_xp_column()
-        self.add_class_columns()
+        # Guild settings live in memory and are written back in the background
+        self.settings = GuildSettingsStore(self)
+        self.settings.load_all()
+        
+        # Per-guild totals for /serverstats, kept current by the write methods
+        self.stats = GuildStats()
+        self.load_guild_stats()
+        
+        # Cooldown, combo and mention timers, answered from memory and written back in the background
+        self.member_state = MemberStateTable(self)
+        self.member_state.load_all()
+        
+        # Refresh the in-memory state when another process writes to a file
+        self.add_invalidation_listener('guild_settings', self.settings.reload)
+        self.add_invalidation_listener('users', self.reload_guild_stats)
+        self.add_invalidation_listener('users', self.member_state.reload)
+        self.add_invalidation_listener('schema', self._forget_history_months)
         
         # Start the write worker thread
         self.start_write_worker()
     
+    def all_db_paths(self):
+        """Every database file currently owned by this instance."""
+        paths = [self.db_path]
+        if self.shard_count == PER_GUILD_SHARDS:
+            base, ext = os.path.splitext(self.db_path)
+            paths.extend(sorted(glob.glob(f"{glob.escape(base)}.guild-*{ext or '.db'}")))
+        elif self.shard_count and self.shard_count > 0:
+            paths.extend(_bucket_path(self.db_path, i) for i in range(self.shard_count))
+        return paths
+    
+    def owns(self, path, guild_id):
+        """True if path is the file that holds guild_id's data. shard_migrate.py leaves a copy
+        of every moved row in the source file; loaders skip those stale copies."""
+        return shard_path_for(self.db_path, guild_id, self.shard_count) == path
+    
+    def owned_rows(self, path, rows):
+        """The rows (guild_id first) of guilds owned by path."""
+        owned = {}
+        for row in rows:
+            keep = owned.get(row[0])
+            if keep is None:
+                keep = owned[row[0]] = self.owns(path, row[0])
+            if keep:
+                yield row
+    
+    def shard_path(self, guild_id=None):
+        """Database file for a guild, creating its schema on first use."""
+        path = shard_path_for(self.db_path, guild_id, self.shard_count)
+        if path not in self._initialized_paths:
+            with self._writers_lock:
+                if path not in self._initialized_paths:
+                    self.init_db(path)
+        return path
+    
+    def _connect(self, db_path):
+        """Open a connection and apply the performance profile."""
+        conn = sqlite3.connect(
+            db_path,
+            timeout=30.0,  # Increased timeout
+            check_same_thread=False,
+            isolation_level='IMMEDIATE'  # Better for concurrent writes
+        )
+        conn.execute('PRAGMA journal_mode=WAL')  # Write-Ahead Logging
+        conn.execute('PRAGMA busy_timeout=30000')  # 30 second busy timeout
+        for pragma, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {pragma}={value}')
+        with self._pool_lock:
+            self._pool.append(conn)
+        return conn
+
+    def _discard_conn(self, db_path, conn):
+        self._local.conns.pop(db_path, None)
+        with self._pool_lock:
+            if conn in self._pool:
+                self._pool.remove(conn)
+        try:
+            conn.close()
+        except Exception as e:
+            print(f"Error closing connection: {e}")
+
     @contextmanager
-    def get_conn(self):
-        """Context manager for safe connection handling"""
-        conn = None
+    def get_conn(self, db_path=None):
+        """Borrow this thread's pooled connection to a database file.
+
+        Connections stay open between calls so the profile pragmas and the
+        page cache survive; anything left uncommitted is rolled back on exit,
+        as closing the connection used to do.
+        """
+        db_path = db_path or self.db_path
+        conns = getattr(self._local, 'conns', None)
+        if conns is None:
+            conns = self._local.conns = {}
+        conn = conns.get(db_path)
+        if conn is None:
+            conn = conns[db_path] = self._connect(db_path)
         try:
-            conn = sqlite3.connect(
-                self.db_path,
-                timeout=30.0,  # Increased timeout
-                check_same_thread=False,
-                isolation_level='IMMEDIATE'  # Better for concurrent writes
-            )
-            conn.execute('PRAGMA journal_mode=WAL')  # Write-Ahead Logging
-            conn.execute('PRAGMA busy_timeout=30000')  # 30 second busy timeout
             yield conn
-        finally:
-            if conn:
-                try:
-                    conn.close()
-                except Exception as e:
-                    print(f"Error closing connection: {e}")
+        except Exception:
+            # Don't hand a possibly broken connection to the next caller
+            self._discard_conn(db_path, conn)
+            raise
+        else:
+            if conn.in_transaction:
+                conn.rollback()
+
+    def close_connections(self):
+        """Close every pooled connection, from any thread."""
+        with self._pool_lock:
+            pool, self._pool = self._pool, []
+        for conn in pool:
+            try:
+                conn.close()
+            except Exception as e:
+                print(f"Error closing connection: {e}")
+        self._local = threading.local()
 
     def start_write_worker(self):
         """Start the background thread that processes DB writes serially."""
         self.stop_worker = False
-        self.worker_thread = threading.Thread(target=self._write_worker_loop, daemon=True)
+        self.worker_thread = threading.Thread(
+            target=self._write_worker_loop, args=(self.db_path, self.write_queue), daemon=True
+        )
         self.worker_thread.start()
+        self._writers[self.db_path] = (self.write_queue, self.worker_thread)
         print("✅ DB write worker thread started")
 
-    def _write_worker_loop(self):
-        """Background thread loop: process writes from the queue one at a time."""
+    def _get_write_queue(self, guild_id=None):
+        """Return the write queue for a guild's shard, starting its worker on first use."""
+        path = self.shard_path(guild_id)
+        writer = self._writers.get(path)
+        if writer:
+            return writer[0]
+        with self._writers_lock:
+            writer = self._writers.get(path)
+            if not writer:
+                write_queue = FairWriteQueue()
+                thread = threading.Thread(
+                    target=self._write_worker_loop, args=(path, write_queue), daemon=True
+                )
+                thread.start()
+                writer = (write_queue, thread)
+                self._writers[path] = writer
+                print(f"✅ DB write worker started for shard {os.path.basename(path)}")
+        return writer[0]
+
+    def _write_worker_loop(self, db_path, write_queue):
+        """Background thread loop: process queued transactions one at a time."""
         while not self.stop_worker:
             try:
-                item = self.write_queue.get(timeout=1.0)
+                item = write_queue.get(timeout=COHERENCE_POLL_SECONDS)
                 if item is None:
                     break
-                query, params = item
-                
+                guild_id, statements = item
+                changed = {}
                 max_retries = 5
                 for attempt in range(max_retries):
                     try:
-                        with self.get_conn() as conn:
+                        with self.get_conn(db_path) as conn:
+                            # Holding the write lock, nobody else can commit until we
+                            # do: what the poll sees is everything before us, and our
+                            # cache_changes entry is the next version
+                            conn.execute('BEGIN IMMEDIATE')
+                            state = self._coherence[db_path]
+                            merge_changes(changed, self._poll_changes(conn, state))
                             c = conn.cursor()
-                            c.execute(query, params)
+                            hooks = []
+                            tables = set()
+                            for query, params in statements:
+                                if query is None:
+                                    hooks.append(params)
+                                    continue
+                                c.execute(query, params)
+                                table = _cached_table(query)
+                                if table:
+                                    tables.add(table)
+                            version = None
+                            if tables:
+                                guilds = None if guild_id is None else (guild_id,)
+                                version = record_cache_changes(conn, dict.fromkeys(tables, guilds), self.origin)
                             conn.commit()
+                        if version:
+                            state['version'] = version
+                        for hook in hooks:
+                            try:
+                                hook()
+                            except Exception as e:
+                                print(f"❌ Write worker commit hook error: {e}")
                         break  # Success
                     except sqlite3.OperationalError as e:
                         if attempt < max_retries - 1 and ('locked' in str(e).lower() or 'busy' in str(e).lower()):
@@ -78,32 +365,66 @@ class Database:
                     except Exception as e:
                         print(f"❌ Write worker error: {e}")
                         break
+                self._notify_invalidation(db_path, changed)
                         
             except queue.Empty:
+                try:
+                    self.check_coherence(db_path)
+                except Exception as e:
+                    print(f"❌ Cache coherence check error: {e}")
                 continue
             except Exception as e:
                 print(f"❌ Write worker exception: {e}")
 
-    def queue_write(self, query, params=()):
-        """Queue a write operation (INSERT, UPDATE, DELETE) to be processed serially."""
-        self.write_queue.put((query, params))
+    def queue_write(self, query, params=(), guild_id=None, lane=BULK, after_bulk=False, on_commit=None):
+        """Queue a write operation (INSERT, UPDATE, DELETE) to be processed serially.
+
+        Writes are routed to the shard that owns guild_id; each shard has its own
+        worker so a busy guild only delays writes in its own file. Within a shard,
+        INTERACTIVE writes go before BULK ones and guilds take turns. Pass
+        after_bulk=True for writes that overwrite a value the guild's queued BULK
+        writes increment (see write_scheduler.py). on_commit() is called on the
+        worker once the write has committed.
+        """
+        statements = [(query, params)]
+        if on_commit:
+            statements.append(after_commit(on_commit))
+        self.queue_transaction(statements, guild_id=guild_id, lane=lane, after_bulk=after_bulk)
+
+    def queue_transaction(self, statements, guild_id=None, lane=BULK, after_bulk=False):
+        """Queue several (query, params) writes that commit together or not at all.
+        
+        Entries made with after_commit() run once the transaction has committed.
+        """
+        guild_id = guild_id and str(guild_id)
+        self._get_write_queue(guild_id).put(
+            (guild_id, list(statements)), guild_id=guild_id, lane=lane, after_bulk=after_bulk
+        )
 
     def stop_write_worker(self):
-        """Gracefully stop the write worker thread."""
+        """Gracefully stop all write worker threads."""
+        self.settings.flush()
+        self.member_state.flush()
+        writers = list(self._writers.values())
+        for write_queue, _ in writers:
+            write_queue.put(None)  # Signal to stop once the queue is drained
+        for _, thread in writers:
+            thread.join(timeout=5.0)
         self.stop_worker = True
-        self.write_queue.put(None)  # Signal to stop
-        if self.worker_thread:
-            self.worker_thread.join(timeout=5.0)
-            print("🛑 DB write worker thread stopped")
+        if self.event_log:
+            self.event_log.close()
+        self.close_connections()
+        print("🛑 DB write worker thread stopped")
 
-    def _execute_query(self, query, params=(), fetchone=False, fetchall=False, commit=False, retries=5):
+    def _execute_query(self, query, params=(), fetchone=False, fetchall=False, commit=False, retries=5, guild_id=None):
         """Execute a query with proper connection management and retries"""
         last_exc = None
         backoff = 0.05
+        db_path = self.shard_path(guild_id)
         
         for attempt in range(retries):
             try:
-                with self.get_conn() as conn:
+                with self.get_conn(db_path) as conn:
                     c = conn.cursor()
                     c.execute(query, params)
                     
@@ -148,9 +469,17 @@ class Database:
             raise last_exc
         raise Exception("Database operation failed after retries")
     
-    def init_db(self):
+    def init_db(self, db_path=None):
         """Initialize database with all tables"""
-        with self.get_conn() as conn:
+        db_path = db_path or self.db_path
+        if not os.path.exists(db_path):
+            # auto_vacuum must be chosen before the file is first written (get_conn's
+            # WAL switch counts); existing files are converted offline by db_vacuum.py
+            conn = sqlite3.connect(db_path)
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.close()
+        with self.get_conn(db_path) as conn:
             c = conn.cursor()
             
             # Users table
@@ -164,6 +493,11 @@ class Database:
                 last_daily TEXT,
                 PRIMARY KEY (user_id, guild_id)
             )''')
+            # Lets WHERE guild_id = ? queries and the consistency checker walk one guild
+            # without scanning the whole table (the primary key starts with user_id)
+            c.execute('CREATE INDEX IF NOT EXISTS idx_users_guild ON users (guild_id, user_id)')
+            # Leaderboards, ranks and the around-me window seek into this instead of sorting the guild
+            c.execute('CREATE INDEX IF NOT EXISTS idx_users_guild_xp ON users (guild_id, xp DESC, user_id)')
             
             # Guild settings table
             c.execute('''CREATE TABLE IF NOT EXISTS guild_settings (
@@ -184,15 +518,6 @@ class Database:
                 xp_formula TEXT
             )''')
             
-            # XP history table
-            c.execute('''CREATE TABLE IF NOT EXISTS xp_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT,
-                guild_id TEXT,
-                xp INTEGER,
-                timestamp TEXT
-            )''')
-            
             # Seasons table
             c.execute('''CREATE TABLE IF NOT EXISTS seasons (
                 guild_id TEXT,
@@ -202,12 +527,333 @@ class Database:
                 PRIMARY KEY (guild_id, season_id)
             )''')
             
+            # Which guilds' cached tables changed, for caches in other processes
+            create_cache_changes_table(conn)
+            # Earlier versions bumped a counter per row with triggers, which doubled write costs
+            for table in CACHE_TABLES:
+                for event in ('insert', 'update', 'delete'):
+                    c.execute(f'DROP TRIGGER IF EXISTS {table}_{event}_epoch')
+            c.execute('DROP TABLE IF EXISTS cache_epochs')
+            
+            # Last run of each maintenance job in this file
+            c.execute('''CREATE TABLE IF NOT EXISTS maintenance_log (
+                task TEXT PRIMARY KEY,
+                last_run TEXT,
+                detail TEXT
+            )''')
+            
+            # Pending web app mutations (see web_outbox.py), only in the main file
+            if db_path == self.db_path:
+                web_outbox.create_table(conn)
+            
             conn.commit()
+            
+            # XP history: one table per month behind an xp_history view
+            history_partitions.setup(conn)
+        
+        self.add_monthly_xp_column(db_path)
+        self.add_class_columns(db_path)
+        self.add_guild_settings_columns(db_path)
+        # Changes after this point are picked up by the file's writer (caches load after init)
+        with self.get_conn(db_path) as conn:
+            version = conn.execute('SELECT COALESCE(MAX(version), 0) FROM cache_changes').fetchone()[0]
+        self._coherence.setdefault(db_path, {'version': version, 'data_version': None, 'schema_version': None})
+        self._initialized_paths.add(db_path)
+    
+    def guild_selects(self, query, guild_ids=None):
+        """(sql, params) to run query (a SELECT with no WHERE) for every guild, or just guild_ids."""
+        if guild_ids is None:
+            return [(query, ())]
+        ids = sorted(str(g) for g in guild_ids)
+        return [
+            (f'{query} WHERE guild_id IN ({", ".join("?" for _ in ids[start:start + GUILD_CHUNK])})',
+             tuple(ids[start:start + GUILD_CHUNK]))
+            for start in range(0, len(ids), GUILD_CHUNK)
+        ]
     
+    def _stat_rows(self, path, guild_ids=None):
+        with self.get_conn(path) as conn:
+            for sql, params in self.guild_selects('SELECT guild_id, user_id, xp, messages, voice_time FROM users', guild_ids):
+                cursor = conn.execute(sql, params)
+                while True:
+                    rows = cursor.fetchmany(5000)
+                    if not rows:
+                        break
+                    yield from self.owned_rows(path, rows)
+    
+    def load_guild_stats(self):
+        """Build the in-memory guild counters from every users table."""
+        for path in self.all_db_paths():
+            self.stats.load(self._stat_rows(path))
+    
+    def reload_guild_stats(self, path, guild_ids=None):
+        """Rebuild the counters of some (default: every) guild stored in one database file.
+        
+        The counters follow committed writes (see after_commit), so on the file's write
+        worker this matches them exactly, with nothing queued dropped.
+        """
+        if guild_ids is None:
+            guild_ids = [g for g in self.stats.guild_ids() if self.owns(path, g)]
+            rows = self._stat_rows(path)
+        else:
+            rows = self._stat_rows(path, guild_ids)
+        self.stats.replace(guild_ids, rows)
+    
+    # -------------------------
+    # CACHE COHERENCE
+    # -------------------------
+    
+    def add_invalidation_listener(self, name, callback):
+        """Call callback(db_path, guild_ids) when another process changes a table in CACHE_TABLES
+        in that file, or with name='schema' when any schema changes (tables created or dropped).
+        guild_ids is the set of guilds changed, or None for all of the file's guilds.
+        
+        Callbacks run on the file's write worker thread, between transactions.
+        """
+        self._invalidation_listeners.setdefault(name, []).append(callback)
+    
+    def _poll_changes(self, conn, state):
+        """{name: guild_ids} other processes changed since the last poll on this connection.
+        
+        PRAGMA data_version only changes when some other connection commits, so when
+        nothing happened this is a single cheap pragma.
+        """
+        data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == state['data_version']:
+            return {}
+        state['data_version'] = data_version
+        changes = {}
+        rows = conn.execute(
+            'SELECT name, guild_id, origin, version FROM cache_changes WHERE version > ?', (state['version'],)
+        ).fetchall()
+        for name, guild_id, origin, version in rows:
+            state['version'] = max(state['version'], version)
+            if origin != self.origin:
+                merge_changes(changes, {name: (guild_id,) if guild_id else None})
+        schema_version = conn.execute('PRAGMA schema_version').fetchone()[0]
+        if state['schema_version'] is not None and schema_version != state['schema_version']:
+            changes['schema'] = None
+        state['schema_version'] = schema_version
+        return changes
+    
+    def check_coherence(self, db_path):
+        """Refresh caches if another process changed this file since the last check.
+        Runs on the file's write worker when it's idle."""
+        with self.get_conn(db_path) as conn:
+            changes = self._poll_changes(conn, self._coherence[db_path])
+        self._notify_invalidation(db_path, changes)
+    
+    def refresh_guild(self, guild_id, names=CACHE_TABLES):
+        """Reload a guild's cached tables after writing them outside the write queue
+        (e.g. guild_transfer.py imports), on its write worker after the writes queued so far."""
+        path = self.shard_path(guild_id)
+        changes = dict.fromkeys(names, (str(guild_id),))
+        self.queue_transaction(
+            [after_commit(lambda: self._notify_invalidation(path, changes, foreign=False))],
+            guild_id=guild_id, lane=INTERACTIVE, after_bulk=True
+        )
+    
+    def _notify_invalidation(self, db_path, changes, foreign=True):
+        if not changes:
+            return
+        tables = [name for name in changes if name != 'schema']
+        if tables and foreign:
+            guilds = ("all guilds" if any(changes[name] is None for name in tables)
+                      else f"{len(set().union(*(changes[name] for name in tables)))} guild(s)")
+            print(f"🔄 {os.path.basename(db_path)} changed by another process, "
+                  f"refreshing {', '.join(tables)} for {guilds}")
+        for name, guild_ids in changes.items():
+            for callback in self._invalidation_listeners.get(name, ()):
+                try:
+                    callback(db_path, guild_ids)
+                except Exception as e:
+                    print(f"❌ Error refreshing cache for {name}: {e}")
+    
+    def _forget_history_months(self, path, guild_ids=None):
+        # Months may have been archived or dropped; they're re-checked on next use
+        self._history_months = {key for key in self._history_months if key[0] != path}
+
+    # -------------------------
+    # DATABASE MAINTENANCE
+    # -------------------------
+
+    def pending_writes(self):
+        """Number of writes waiting in all write queues."""
+        return sum(q.qsize() for q, _ in list(self._writers.values()))
+
+    def write_queue_depths(self):
+        """Queued writes and waiting guilds per lane, summed over all shards."""
+        totals = {lane: {'writes': 0, 'guilds': 0} for lane in LANES}
+        for write_queue, _ in list(self._writers.values()):
+            for lane, depth in write_queue.depths().items():
+                totals[lane]['writes'] += depth['writes']
+                totals[lane]['guilds'] += depth['guilds']
+        return totals
+
+    def wal_size(self, db_path=None):
+        """Size in bytes of a database file's -wal file."""
+        try:
+            return os.path.getsize((db_path or self.db_path) + "-wal")
+        except OSError:
+            return 0
+
+    def _log_maintenance(self, conn, task, detail=""):
+        conn.execute(
+            'INSERT OR REPLACE INTO maintenance_log (task, last_run, detail) VALUES (?, ?, ?)',
+            (task, datetime.now().isoformat(), str(detail))
+        )
+        conn.commit()
+
+    def _last_maintenance(self, conn, task):
+        row = conn.execute('SELECT last_run FROM maintenance_log WHERE task = ?', (task,)).fetchone()
+        return datetime.fromisoformat(row[0]) if row and row[0] else None
+
+    def checkpoint_wal(self, conn):
+        """Copy the WAL back into the database and truncate it. Returns (busy, wal_pages, checkpointed)."""
+        result = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+        self._log_maintenance(conn, 'checkpoint', f"busy={result[0]} pages={result[1]}")
+        return result
+
+    def optimize(self, conn):
+        """Refresh query planner statistics."""
+        has_stats = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+        ).fetchone()
+        # The first run needs a full ANALYZE, after that PRAGMA optimize only
+        # re-analyzes tables whose size changed enough to matter
+        conn.execute('PRAGMA optimize' if has_stats else 'ANALYZE')
+        self._log_maintenance(conn, 'optimize', 'optimize' if has_stats else 'analyze')
+
+    def prune_xp_history(self, conn, retention_days):
+        """Delete xp_history rows older than retention_days. Returns rows deleted."""
+        cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+        # Whole months are dropped as tables, only the boundary month needs a DELETE
+        deleted = history_partitions.prune_before(conn, cutoff)
+        self._history_months = {k for k in self._history_months if k[1] >= cutoff[:7]}
+        self._log_maintenance(conn, 'prune', f"{deleted} rows older than {retention_days}d")
+        return deleted
+
+    def incremental_vacuum(self, conn):
+        """Release free pages back to the filesystem. Returns pages freed."""
+        mode = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+        if mode != 2:
+            # Switching needs a full VACUUM (write lock held throughout, up to 2x the
+            # disk space), so it's left to db_vacuum.py with the bot stopped
+            path = conn.execute('PRAGMA database_list').fetchone()[2]
+            size = os.path.getsize(path) if path and os.path.exists(path) else 0
+            print(f"⚠️ {os.path.basename(path or self.db_path)} ({size / 1048576:,.0f} MB) doesn't use incremental "
+                  f"auto-vacuum; run `python db_vacuum.py {path}` while the bot is stopped to reclaim free pages")
+            self._log_maintenance(conn, 'vacuum', 'skipped, not in incremental mode (see db_vacuum.py)')
+            return 0
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if free:
+            conn.execute('PRAGMA incremental_vacuum').fetchall()
+        self._log_maintenance(conn, 'vacuum', f"{free} pages freed")
+        return free
+
+    @contextmanager
+    def _autocommit(self, conn):
+        # VACUUM and checkpoints can't run inside a transaction; the
+        # connection is pooled so restore its mode afterwards
+        previous = conn.isolation_level
+        conn.isolation_level = None
+        try:
+            yield conn
+        finally:
+            conn.isolation_level = previous
+
+    def run_maintenance(self, retention_days=0, optimize_every=timedelta(hours=24), force=False, checkpoint_only=False):
+        """Checkpoint, optimize, prune and vacuum every database file.
+
+        Blocking; call it from a worker thread when the write queues are quiet.
+        The checkpoint runs every time, the other jobs at most once per
+        optimize_every unless force is set (or never with checkpoint_only).
+        """
+        report = {}
+        for path in self.all_db_paths():
+            done = []
+            try:
+                with self.get_conn(path) as conn, self._autocommit(conn):
+                    busy, _, _ = self.checkpoint_wal(conn)
+                    done.append('checkpoint' if not busy else 'checkpoint (busy)')
+                    
+                    last = self._last_maintenance(conn, 'optimize')
+                    due = force or not last or datetime.now() - last >= optimize_every
+                    if due and not checkpoint_only:
+                        self.optimize(conn)
+                        done.append('optimize')
+                        
+                        deleted = self.prune_xp_history(conn, retention_days) if retention_days else 0
+                        if deleted:
+                            done.append(f"pruned {deleted}")
+                        freed = self.incremental_vacuum(conn)
+                        done.append(f"vacuum ({freed} pages)")
+            except Exception as e:
+                print(f"❌ Maintenance error on {os.path.basename(path)}: {e}")
+                done.append(f"error: {e}")
+            report[path] = done
+        return report
+
+    def get_db_report(self):
+        """Size, WAL, page and maintenance stats for every database file."""
+        report = []
+        for path in self.all_db_paths():
+            try:
+                with self.get_conn(path) as conn:
+                    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+                    page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+                    freelist = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                    auto_vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+                    last_runs = dict(conn.execute('SELECT task, last_run FROM maintenance_log').fetchall())
+                    live_months = history_partitions.live_months(conn)
+                report.append({
+                    'path': path,
+                    'size': page_size * page_count,
+                    'wal_size': self.wal_size(path),
+                    'page_count': page_count,
+                    'freelist': freelist,
+                    'auto_vacuum': {0: 'none', 1: 'full', 2: 'incremental'}.get(auto_vacuum, auto_vacuum),
+                    'history_months': len(live_months),
+                    'archived_months': len(history_partitions.archived_months(path)),
+                    'last_runs': last_runs,
+                })
+            except Exception as e:
+                print(f"❌ Error reading stats for {path}: {e}")
+        return report
+
     # =====================================
     # WEB APP SYNC METHODS (NEW)
     # =====================================
     
+    def web_sync_enabled(self):
+        return self.bot_sync.enabled()
+    
+    async def open_web_session(self):
+        """Open the shared web session and warm a connection to the Edge Function (call at startup)."""
+        await self.bot_sync.start()
+    
+    async def close_web_session(self):
+        await self.bot_sync.close()
+    
+    async def _web_data(self, discord_id, action, data=None):
+        """A bot-sync call as {"success": True, "data": result}, or {"success": False, "error": ...}."""
+        if not self.web_sync_enabled():
+            return {"success": False, "error": "Web sync not configured"}
+        
+        try:
+            status, result = await self.bot_sync.call(discord_id, action, data)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Web {action} timeout for {discord_id}")
+            return {"success": False, "error": "Timeout"}
+        except Exception as e:
+            print(f"❌ Web {action} error: {e}")
+            return {"success": False, "error": str(e)}
+        
+        if status == 200:
+            return {"success": True, "data": result}
+        print(f"❌ Web {action} failed: {result}")
+        return {"success": False, "error": result.get("error", "Unknown error")}
+    
     async def sync_xp_to_web(self, discord_id: str, xp_amount: int, source: str = "discord"):
         """
         Sync XP earned in Discord to the web app via the bot-sync Edge Function.
@@ -220,48 +866,7 @@ class Database:
         Returns:
             dict with success status and data, or error message
         """
-        import config as bot_config
-        
-        # Check if sync is configured
-        if not bot_config.BOT_SYNC_SECRET or not bot_config.SUPABASE_SERVICE_ROLE_KEY:
-            return {"success": False, "error": "Web sync not configured"}
-        
-        url = f"{bot_config.SUPABASE_URL}/functions/v1/bot-sync"
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    url,
-                    json={
-                        "discord_id": str(discord_id),
-                        "action": "add_xp",
-                        "data": {
-                            "xp": min(xp_amount, 1000),  # Cap at 1000 per call
-                            "source": source
-                        }
-                    },
-                    headers={
-                        "Authorization": f"Bearer {bot_config.SUPABASE_SERVICE_ROLE_KEY}",
-                        "X-Bot-Secret": bot_config.BOT_SYNC_SECRET,
-                        "Content-Type": "application/json"
-                    },
-                    timeout=aiohttp.ClientTimeout(total=10)
-                ) as response:
-                    result = await response.json()
-                    
-                    if response.status == 200:
-                        print(f"✅ Synced {xp_amount} XP to web for Discord ID {discord_id}")
-                        return {"success": True, "data": result}
-                    else:
-                        print(f"❌ Web sync failed: {result}")
-                        return {"success": False, "error": result.get("error", "Unknown error")}
-                        
-        except asyncio.TimeoutError:
-            print(f"⚠️ Web sync timeout for {discord_id}")
-            return {"success": False, "error": "Timeout"}
-        except Exception as e:
-            print(f"❌ Web sync error: {e}")
-            return {"success": False, "error": str(e)}
+        return await self._web_data(discord_id, "add_xp", {"xp": min(xp_amount, 1000), "source": source})
     
     async def get_web_stats(self, discord_id: str):
         """
@@ -273,43 +878,7 @@ class Database:
         Returns:
             dict with user profile and stats or error
         """
-        import config as bot_config
-        
-        if not bot_config.BOT_SYNC_SECRET or not bot_config.SUPABASE_SERVICE_ROLE_KEY:
-            return {"success": False, "error": "Web sync not configured"}
-        
-        url = f"{bot_config.SUPABASE_URL}/functions/v1/bot-sync"
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    url,
-                    json={
-                        "discord_id": str(discord_id),
-                        "action": "get_stats"  # Use get_stats to pull data
-                    },
-                    headers={
-                        "Authorization": f"Bearer {bot_config.SUPABASE_SERVICE_ROLE_KEY}",
-                        "X-Bot-Secret": bot_config.BOT_SYNC_SECRET,
-                        "Content-Type": "application/json"
-                    },
-                    timeout=aiohttp.ClientTimeout(total=10)
-                ) as response:
-                    result = await response.json()
-                    
-                    if response.status == 200:
-                        print(f"✅ Pulled web stats for Discord ID {discord_id}")
-                        return {"success": True, "data": result}
-                    else:
-                        print(f"❌ Pull web stats failed: {result}")
-                        return {"success": False, "error": result.get("error", "Unknown error")}
-                        
-        except asyncio.TimeoutError:
-            print(f"⚠️ Pull web stats timeout for {discord_id}")
-            return {"success": False, "error": "Timeout"}
-        except Exception as e:
-            print(f"❌ Pull web stats error: {e}")
-            return {"success": False, "error": str(e)}
+        return await self._web_data(discord_id, "get_stats")
     
     async def verify_web_link(self, discord_id: str):
         """
@@ -321,87 +890,7 @@ class Database:
         Returns:
             dict with linked status and hunter_name if linked
         """
-        import config as bot_config
-        
-        if not bot_config.BOT_SYNC_SECRET or not bot_config.SUPABASE_SERVICE_ROLE_KEY:
-            return {"success": False, "error": "Web sync not configured"}
-        
-        url = f"{bot_config.SUPABASE_URL}/functions/v1/bot-sync"
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    url,
-                    json={
-                        "discord_id": str(discord_id),
-                        "action": "verify_link"
-                    },
-                    headers={
-                        "Authorization": f"Bearer {bot_config.SUPABASE_SERVICE_ROLE_KEY}",
-                        "X-Bot-Secret": bot_config.BOT_SYNC_SECRET,
-                        "Content-Type": "application/json"
-                    },
-                    timeout=aiohttp.ClientTimeout(total=10)
-                ) as response:
-                    result = await response.json()
-                    
-                    if response.status == 200:
-                        return {"success": True, "data": result}
-                    else:
-                        return {"success": False, "error": result.get("error", "Unknown error")}
-                        
-        except asyncio.TimeoutError:
-            return {"success": False, "error": "Timeout"}
-        except Exception as e:
-            return {"success": False, "error": str(e)}
-    
-    async def sync_class_to_web(self, discord_id: str, class_name: str):
-        """
-        Sync class selection to the web app.
-        
-        Args:
-            discord_id: The user's Discord ID
-            class_name: The selected class (e.g., "TANK", "ASSASSIN", etc.)
-            
-        Returns:
-            dict with success status
-        """
-        import config as bot_config
-        
-        if not bot_config.BOT_SYNC_SECRET or not bot_config.SUPABASE_SERVICE_ROLE_KEY:
-            return {"success": False, "error": "Web sync not configured"}
-        
-        url = f"{bot_config.SUPABASE_URL}/functions/v1/bot-sync"
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    url,
-                    json={
-                        "discord_id": str(discord_id),
-                        "action": "set_class",
-                        "data": {
-                            "class": class_name
-                        }
-                    },
-                    headers={
-                        "Authorization": f"Bearer {bot_config.SUPABASE_SERVICE_ROLE_KEY}",
-                        "X-Bot-Secret": bot_config.BOT_SYNC_SECRET,
-                        "Content-Type": "application/json"
-                    },
-                    timeout=aiohttp.ClientTimeout(total=10)
-                ) as response:
-                    result = await response.json()
-                    
-                    if response.status == 200:
-                        print(f"✅ Synced class {class_name} to web for Discord ID {discord_id}")
-                        return {"success": True, "data": result}
-                    else:
-                        return {"success": False, "error": result.get("error", "Unknown error")}
-                        
-        except Exception as e:
-            print(f"❌ Class sync error: {e}")
-            return {"success": False, "error": str(e)}
+        return await self._web_data(discord_id, "verify_link")
     
     # ----------------
     # USER OPERATIONS
@@ -409,54 +898,92 @@ class Database:
     def get_user(self, user_id, guild_id):
         """Get user data with proper error handling"""
         try:
-            # Get column names
-            columns_rows = self._execute_query("PRAGMA table_info(users)", fetchall=True)
-            columns = [col[1] for col in columns_rows] if columns_rows else []
-            
-            # Get user data
-            result = self._execute_query(
-                'SELECT * FROM users WHERE user_id = ? AND guild_id = ?',
-                (str(user_id), str(guild_id)),
-                fetchone=True
-            )
-            
-            if result:
-                user_dict = {}
-                for i, col_name in enumerate(columns):
-                    if i < len(result):
-                        user_dict[col_name] = result[i]
-                return user_dict
+            with self.get_conn(self.shard_path(guild_id)) as conn:
+                # Column names come from the cursor, no PRAGMA table_info round trip
+                cursor = conn.execute(
+                    'SELECT * FROM users WHERE user_id = ? AND guild_id = ?',
+                    (str(user_id), str(guild_id))
+                )
+                result = cursor.fetchone()
+                if result:
+                    user = dict(zip([d[0] for d in cursor.description], result))
+                    return self.member_state.overlay(guild_id, user_id, user)
             return None
             
         except Exception as e:
             print(f"❌ Error getting user {user_id}: {e}")
             return None
     
-    def create_user(self, user_id, guild_id):
+    def create_user(self, user_id, guild_id, wait=True):
         """Create user with proper handling"""
         self.queue_write(
             'INSERT OR IGNORE INTO users (user_id, guild_id, xp, monthly_xp) VALUES (?, ?, ?, ?)',
-            (str(user_id), str(guild_id), 0, 0)
+            (str(user_id), str(guild_id), 0, 0),
+            guild_id=guild_id,
+            lane=INTERACTIVE,
+            on_commit=lambda: self.stats.add_user(guild_id, user_id)
         )
-        # Small delay to ensure write completes before next read
-        time.sleep(0.05)
-    
-    def add_xp(self, user_id, guild_id, amount):
-        """Add XP with proper queueing"""
-        self.queue_write('''UPDATE users 
-                             SET xp = xp + ?, 
-                                 monthly_xp = monthly_xp + ?,
-                                 messages = messages + 1, 
-                                 last_xp_time = ? 
-                             WHERE user_id = ? AND guild_id = ?''',
-                         (amount, amount, datetime.now().isoformat(), str(user_id), str(guild_id)))
-        
-        # Queue XP history
+        self.member_state.ensure(guild_id, user_id)
+        if wait:
+            # Small delay to ensure write completes before next read
+            time.sleep(0.05)
+    
+    def _xp_statements(self, user_id, guild_id, amount, now):
+        """Record an XP gain in the event log; returns the users/history writes (stats follow on commit)."""
+        if self.event_log:
+            self.event_log.append(xp_log.XP, guild_id, user_id, amount, now.timestamp())
+        return [
+            ('''UPDATE users 
+                SET xp = xp + ?, 
+                    monthly_xp = monthly_xp + ?,
+                    messages = messages + 1, 
+                    last_xp_time = ? 
+                WHERE user_id = ? AND guild_id = ?''',
+             (amount, amount, now.isoformat(), str(user_id), str(guild_id))),
+            (f'INSERT INTO {self._history_table(guild_id, now)} (user_id, guild_id, xp, timestamp) VALUES (?, ?, ?, ?)',
+             (str(user_id), str(guild_id), int(amount), now.isoformat())),
+            after_commit(lambda: self.stats.add_xp(guild_id, user_id, int(amount), messages=1)),
+        ]
+    
+    def add_xp_listener(self, callback):
+        """Call callback(guild_id, user_id) whenever a user's XP is changed by anything other
+        than a message award (add_xp, set_xp, adjust_xp, claim_daily). Runs on the caller's thread."""
+        self._xp_listeners.append(callback)
+    
+    def _xp_changed(self, guild_id, user_id):
+        for callback in self._xp_listeners:
+            try:
+                callback(str(guild_id), str(user_id))
+            except Exception as e:
+                print(f"❌ XP change listener error: {e}")
+    
+    def add_xp(self, user_id, guild_id, amount, lane=BULK):
+        """Add XP with proper queueing (pass lane=INTERACTIVE for admin grants)"""
+        # Totals and history commit together, so they can't drift apart on a crash
+        self.queue_transaction(
+            self._xp_statements(user_id, guild_id, amount, datetime.now()), guild_id=guild_id, lane=lane
+        )
+        self._xp_changed(guild_id, user_id)
+
+    def add_xp_history(self, user_id, guild_id, amount, when, lane=BULK):
+        """Record XP in xp_history only, without touching the user's totals"""
         self.queue_write(
-            'INSERT INTO xp_history (user_id, guild_id, xp, timestamp) VALUES (?, ?, ?, ?)',
-            (str(user_id), str(guild_id), int(amount), datetime.now().isoformat())
+            f'INSERT INTO {self._history_table(guild_id, when)} (user_id, guild_id, xp, timestamp) VALUES (?, ?, ?, ?)',
+            (str(user_id), str(guild_id), int(amount), when.isoformat()),
+            guild_id=guild_id,
+            lane=lane
         )
 
+    def _history_table(self, guild_id, when):
+        """Monthly xp_history table for a timestamp, created on first use."""
+        path = self.shard_path(guild_id)
+        month = when.strftime("%Y-%m")
+        if (path, month) not in self._history_months:
+            with self.get_conn(path) as conn:
+                history_partitions.ensure_partition(conn, month)
+            self._history_months.add((path, month))
+        return history_partitions.table_for(month)
+
     def get_weekly_leaderboard(self, guild_id, days=7, limit=10):
         """Get weekly leaderboard"""
         try:
@@ -468,7 +995,7 @@ class Database:
                                              ORDER BY total_xp DESC
                                              LIMIT ?''',
                                           (str(guild_id), since.isoformat(), limit),
-                                          fetchall=True)
+                                          fetchall=True, guild_id=guild_id)
             return results if results else []
         except Exception as e:
             print(f"❌ Error getting weekly leaderboard: {e}")
@@ -481,7 +1008,7 @@ class Database:
             res_row = self._execute_query('''SELECT SUM(xp) FROM xp_history
                                              WHERE guild_id = ? AND user_id = ? AND timestamp >= ?''',
                                           (str(guild_id), str(user_id), since.isoformat()),
-                                          fetchone=True)
+                                          fetchone=True, guild_id=guild_id)
             res = res_row[0] if res_row else None
             return int(res) if res else 0
         except Exception as e:
@@ -490,9 +1017,13 @@ class Database:
 
     def add_voice_time(self, user_id, guild_id, seconds):
         """Add voice time"""
+        if self.event_log:
+            self.event_log.append(xp_log.VOICE, guild_id, user_id, seconds)
         self.queue_write(
             'UPDATE users SET voice_time = voice_time + ? WHERE user_id = ? AND guild_id = ?',
-            (int(seconds), str(user_id), str(guild_id))
+            (int(seconds), str(user_id), str(guild_id)),
+            guild_id=guild_id,
+            on_commit=lambda: self.stats.add_voice_time(guild_id, user_id, int(seconds))
         )
 
     def get_voice_leaderboard(self, guild_id, limit=10):
@@ -503,7 +1034,8 @@ class Database:
                    WHERE guild_id = ? AND voice_time > 0
                    ORDER BY voice_time DESC LIMIT ?''',
                 (str(guild_id), limit),
-                fetchall=True
+                fetchall=True,
+                guild_id=guild_id
             )
             return results if results else []
         except Exception as e:
@@ -516,7 +1048,8 @@ class Database:
             rows = self._execute_query(
                 'SELECT xp FROM users WHERE guild_id = ?',
                 (str(guild_id),),
-                fetchall=True
+                fetchall=True,
+                guild_id=guild_id
             )
             return [r[0] for r in rows] if rows else []
         except Exception as e:
@@ -524,44 +1057,59 @@ class Database:
             return []
 
     def get_server_aggregates(self, guild_id):
-        """Get server statistics"""
-        try:
-            res = self._execute_query(
-                'SELECT SUM(messages), SUM(xp), COUNT(*), SUM(voice_time) FROM users WHERE guild_id = ?',
-                (str(guild_id),),
-                fetchone=True
-            )
-            return {
-                'total_messages': int(res[0]) if res and res[0] else 0,
-                'total_xp': int(res[1]) if res and res[1] else 0,
-                'total_users': int(res[2]) if res and res[2] else 0,
-                'total_voice_time': int(res[3]) if res and res[3] else 0
-            }
-        except Exception as e:
-            print(f"❌ Error getting server aggregates: {e}")
-            return {'total_messages': 0, 'total_xp': 0, 'total_users': 0, 'total_voice_time': 0}
+        """Get server statistics (totals, averages and level histogram) from memory"""
+        return self.stats.aggregates(guild_id)
 
     def set_xp(self, user_id, guild_id, amount):
-        """Set user XP"""
-        self.queue_write(
-            'UPDATE users SET xp = ? WHERE user_id = ? AND guild_id = ?',
-            (amount, str(user_id), str(guild_id))
+        """Set user XP (history gets the difference, so it still adds up to the total)"""
+        now = datetime.now()
+        if self.event_log:
+            self.event_log.append(xp_log.SET_XP, guild_id, user_id, amount, now.timestamp())
+        self.queue_transaction(
+            [
+                (f'''INSERT INTO {self._history_table(guild_id, now)} (user_id, guild_id, xp, timestamp)
+                     SELECT user_id, guild_id, ? - xp, ? FROM users
+                     WHERE user_id = ? AND guild_id = ? AND xp != ?''',
+                 (int(amount), now.isoformat(), str(user_id), str(guild_id), int(amount))),
+                ('UPDATE users SET xp = ? WHERE user_id = ? AND guild_id = ?',
+                 (amount, str(user_id), str(guild_id))),
+                after_commit(lambda: self.stats.set_xp(guild_id, user_id, int(amount))),
+            ],
+            guild_id=guild_id,
+            lane=INTERACTIVE,
+            after_bulk=True,  # queued XP gains were already counted in the set value
         )
+        self._xp_changed(guild_id, user_id)
 
-    def set_last_mention_time(self, user_id, guild_id, timestamp_iso: str = None):
-        """Set last mention time"""
-        ts = timestamp_iso or datetime.now().isoformat()
+    def adjust_xp(self, user_id, guild_id, amount, lane=BULK):
+        """Correct user XP by amount, without history or message counts.
+
+        Queued like add_xp, so awards queued before or after it all still count.
+        """
+        if self.event_log:
+            self.event_log.append(xp_log.ADJUST_XP, guild_id, user_id, amount)
         self.queue_write(
-            'UPDATE users SET last_mention_xp = ? WHERE user_id = ? AND guild_id = ?',
-            (ts, str(user_id), str(guild_id))
+            'UPDATE users SET xp = xp + ? WHERE user_id = ? AND guild_id = ?',
+            (amount, str(user_id), str(guild_id)),
+            guild_id=guild_id,
+            lane=lane,
+            on_commit=lambda: self.stats.add_xp(guild_id, user_id, int(amount))
         )
+        self._xp_changed(guild_id, user_id)
+
+    def set_last_mention_time(self, user_id, guild_id, timestamp_iso: str = None):
+        """Set last mention time (written back in the background)"""
+        when = datetime.fromisoformat(timestamp_iso) if timestamp_iso else datetime.now()
+        self.member_state.set_last_mention(guild_id, user_id, when.timestamp())
 
     def set_last_daily(self, user_id, guild_id, timestamp_iso: str = None):
         """Set last daily time"""
         ts = timestamp_iso or datetime.now().isoformat()
         self.queue_write(
             'UPDATE users SET last_daily = ? WHERE user_id = ? AND guild_id = ?',
-            (ts, str(user_id), str(guild_id))
+            (ts, str(user_id), str(guild_id)),
+            guild_id=guild_id,
+            lane=INTERACTIVE
         )
 
     def get_all_users_in_guild(self, guild_id):
@@ -570,7 +1118,8 @@ class Database:
             rows = self._execute_query(
                 'SELECT user_id, xp FROM users WHERE guild_id = ?',
                 (str(guild_id),),
-                fetchall=True
+                fetchall=True,
+                guild_id=guild_id
             )
             return rows if rows else []
         except Exception as e:
@@ -580,6 +1129,9 @@ class Database:
     def can_gain_xp(self, user_id, guild_id, cooldown=60):
         """Check if user can gain XP"""
         try:
+            state = self.member_state.get(guild_id, user_id)
+            if state is not None:
+                return state.can_gain_xp(cooldown, time.time())
             user = self.get_user(user_id, guild_id)
             if not user or not user.get('last_xp_time'):
                 return True
@@ -597,10 +1149,11 @@ class Database:
                 '''SELECT user_id, xp, messages 
                    FROM users 
                    WHERE guild_id = ? 
-                   ORDER BY xp DESC 
+                   ORDER BY xp DESC, user_id 
                    LIMIT ?''',
                 (str(guild_id), limit),
-                fetchall=True
+                fetchall=True,
+                guild_id=guild_id
             )
             return results if results else []
         except Exception as e:
@@ -608,22 +1161,28 @@ class Database:
             return []
     
     def get_rank(self, user_id, guild_id):
-        """Get user's server rank"""
+        """Get user's server rank (ties ordered by user_id, like the leaderboards)"""
         try:
-            res = self._execute_query(
-                '''SELECT COUNT(*) + 1 
-                   FROM users 
-                   WHERE guild_id = ? AND xp > (
-                       SELECT xp FROM users WHERE user_id = ? AND guild_id = ?
-                   )''',
-                (str(guild_id), str(user_id), str(guild_id)),
-                fetchone=True
-            )
-            return res[0] if res else 0
+            # From the in-memory ranking, which follows committed XP writes like /serverstats
+            rank = self.stats.rank(guild_id, user_id)
+            return rank if rank is not None else 1
         except Exception as e:
             print(f"❌ Error getting rank: {e}")
             return 0
     
+    def get_leaderboard_window(self, user_id, guild_id, radius=5):
+        """Get leaderboard rows around a user: [(position, user_id, xp)], up to radius above and below
+        
+        Served from the in-memory ranking (guild_stats.RankIndex) in O(log n) plus the
+        rows returned, however far down the user is. Ties are ordered by user_id, like
+        get_leaderboard and get_rank.
+        """
+        try:
+            return self.stats.window(guild_id, user_id, radius) or []
+        except Exception as e:
+            print(f"❌ Error getting leaderboard window: {e}")
+            return []
+    
     def claim_daily(self, user_id, guild_id, reward_amount=None):
         """Claim daily reward"""
         try:
@@ -653,10 +1212,22 @@ class Database:
                         else:
                             self.reset_daily_streak(user_id, guild_id)
             
-            self.queue_write(
-                'UPDATE users SET xp = xp + ?, monthly_xp = monthly_xp + ?, last_daily = ? WHERE user_id = ? AND guild_id = ?',
-                (daily_xp, daily_xp, datetime.now().isoformat(), str(user_id), str(guild_id))
+            now = datetime.now()
+            if self.event_log:
+                self.event_log.append(xp_log.DAILY, guild_id, user_id, daily_xp, now.timestamp())
+            # Like add_xp, the total and its history row commit together
+            self.queue_transaction(
+                [
+                    ('UPDATE users SET xp = xp + ?, monthly_xp = monthly_xp + ?, last_daily = ? WHERE user_id = ? AND guild_id = ?',
+                     (daily_xp, daily_xp, now.isoformat(), str(user_id), str(guild_id))),
+                    (f'INSERT INTO {self._history_table(guild_id, now)} (user_id, guild_id, xp, timestamp) VALUES (?, ?, ?, ?)',
+                     (str(user_id), str(guild_id), int(daily_xp), now.isoformat())),
+                    after_commit(lambda: self.stats.add_xp(guild_id, user_id, int(daily_xp))),
+                ],
+                guild_id=guild_id,
+                lane=INTERACTIVE
             )
+            self._xp_changed(guild_id, user_id)
             
             return True, daily_xp
         except Exception as e:
@@ -667,119 +1238,67 @@ class Database:
     # GUILD SETTINGS
     # ----------------
     def get_guild_settings(self, guild_id):
-        """Get guild settings with error handling"""
-        try:
-            result = self._execute_query(
-                'SELECT * FROM guild_settings WHERE guild_id = ?',
-                (str(guild_id),),
-                fetchone=True
-            )
-            
-            if result:
-                return {
-                    'guild_id': result[0],
-                    'xp_min': result[1],
-                    'xp_max': result[2],
-                    'xp_cooldown': result[3],
-                    'voice_xp_enabled': bool(result[4]),
-                    'voice_xp_rate': result[5],
-                    'daily_enabled': bool(result[6]),
-                    'daily_reward': result[7],
-                    'levelup_messages': bool(result[8]),
-                    'levelup_channel': result[9],
-                    'blacklisted_channels': json.loads(result[10]) if result[10] else [],
-                    'whitelisted_channels': json.loads(result[11]) if result[11] else [],
-                    'role_multipliers': json.loads(result[12]) if result[12] else {},
-                    'prefix_commands_enabled': bool(result[13]) if len(result) > 13 and result[13] is not None else True,
-                    'xp_formula': result[14] if len(result) > 14 else None
-                }
-        except Exception as e:
-            print(f"❌ Error getting guild settings: {e}")
-        
-        # Return defaults
-        return {
-            'guild_id': str(guild_id),
-            'xp_min': 15,
-            'xp_max': 25,
-            'xp_cooldown': 60,
-            'voice_xp_enabled': True,
-            'voice_xp_rate': 5,
-            'daily_enabled': True,
-            'daily_reward': 500,
-            'levelup_messages': True,
-            'levelup_channel': None,
-            'blacklisted_channels': [],
-            'whitelisted_channels': [],
-            'role_multipliers': {},
-            'prefix_commands_enabled': True,
-            'xp_formula': None
-        }
+        """Get a read-only snapshot of guild settings (served from memory)"""
+        return self.settings.get(guild_id)
     
     def init_guild_settings(self, guild_id):
         """Initialize guild settings"""
-        self.queue_write(
-            'INSERT OR IGNORE INTO guild_settings (guild_id) VALUES (?)',
-            (str(guild_id),)
-        )
+        if self.settings.get(guild_id).version == 0:
+            self.settings.update(guild_id)
     
     def update_guild_setting(self, guild_id, setting, value):
         """Update guild setting"""
-        self.init_guild_settings(guild_id)
-        
-        if isinstance(value, (list, dict)):
-            value = json.dumps(value)
-        
-        self.queue_write(
-            f'UPDATE guild_settings SET {setting} = ? WHERE guild_id = ?',
-            (value, str(guild_id))
-        )
+        self.settings.update(guild_id, **{setting: value})
+    
+    def update_guild_settings(self, guild_id, **values):
+        """Update several guild settings in one atomic change"""
+        self.settings.update(guild_id, **values)
     
     def add_blacklisted_channel(self, guild_id, channel_id):
         """Add blacklisted channel"""
-        settings = self.get_guild_settings(guild_id)
-        blacklist = settings['blacklisted_channels']
-        if str(channel_id) not in blacklist:
-            blacklist.append(str(channel_id))
-            self.update_guild_setting(guild_id, 'blacklisted_channels', blacklist)
+        def change(settings):
+            if str(channel_id) not in settings['blacklisted_channels']:
+                settings['blacklisted_channels'].append(str(channel_id))
+        self.settings.mutate(guild_id, change)
     
     def remove_blacklisted_channel(self, guild_id, channel_id):
         """Remove blacklisted channel"""
-        settings = self.get_guild_settings(guild_id)
-        blacklist = settings['blacklisted_channels']
-        if str(channel_id) in blacklist:
-            blacklist.remove(str(channel_id))
-            self.update_guild_setting(guild_id, 'blacklisted_channels', blacklist)
+        def change(settings):
+            if str(channel_id) in settings['blacklisted_channels']:
+                settings['blacklisted_channels'].remove(str(channel_id))
+        self.settings.mutate(guild_id, change)
     
     def add_whitelisted_channel(self, guild_id, channel_id):
         """Add whitelisted channel"""
-        settings = self.get_guild_settings(guild_id)
-        whitelist = settings['whitelisted_channels']
-        if str(channel_id) not in whitelist:
-            whitelist.append(str(channel_id))
-            self.update_guild_setting(guild_id, 'whitelisted_channels', whitelist)
+        def change(settings):
+            if str(channel_id) not in settings['whitelisted_channels']:
+                settings['whitelisted_channels'].append(str(channel_id))
+        self.settings.mutate(guild_id, change)
     
     def remove_whitelisted_channel(self, guild_id, channel_id):
         """Remove whitelisted channel"""
-        settings = self.get_guild_settings(guild_id)
-        whitelist = settings['whitelisted_channels']
-        if str(channel_id) in whitelist:
-            whitelist.remove(str(channel_id))
-            self.update_guild_setting(guild_id, 'whitelisted_channels', whitelist)
+        def change(settings):
+            if str(channel_id) in settings['whitelisted_channels']:
+                settings['whitelisted_channels'].remove(str(channel_id))
+        self.settings.mutate(guild_id, change)
     
     def set_role_multiplier(self, guild_id, role_id, multiplier):
         """Set role multiplier"""
-        settings = self.get_guild_settings(guild_id)
-        multipliers = settings['role_multipliers']
-        multipliers[str(role_id)] = float(multiplier)
-        self.update_guild_setting(guild_id, 'role_multipliers', multipliers)
+        def change(settings):
+            settings['role_multipliers'][str(role_id)] = float(multiplier)
+        self.settings.mutate(guild_id, change)
     
     def remove_role_multiplier(self, guild_id, role_id):
         """Remove role multiplier"""
-        settings = self.get_guild_settings(guild_id)
-        multipliers = settings['role_multipliers']
-        if str(role_id) in multipliers:
-            del multipliers[str(role_id)]
-            self.update_guild_setting(guild_id, 'role_multipliers', multipliers)
+        def change(settings):
+            settings['role_multipliers'].pop(str(role_id), None)
+        self.settings.mutate(guild_id, change)
+    
+    def toggle_guild_setting(self, guild_id, setting):
+        """Flip a boolean setting atomically and return the new value"""
+        return self.settings.mutate(
+            guild_id, lambda settings: settings.update({setting: not settings[setting]})
+        )[setting]
     
     def is_channel_allowed(self, guild_id, channel_id):
         """Check if channel can give XP"""
@@ -817,6 +1336,114 @@ class Database:
             print(f"❌ Error getting multiplier: {e}")
             return 1.0
     
+    # ----------------
+    # MESSAGE XP
+    # ----------------
+    def load_message_context(self, guild, member, channel):
+        """Everything on_message needs to decide an XP award, in at most one query.
+        
+        Settings, the channel check, the cooldown and the role multiplier come from
+        memory; the user row is the only read, and is skipped when the channel gives
+        no XP or the member is still on cooldown. Unknown users are created (without
+        waiting) and get a default row.
+        """
+        return self.load_message_contexts(guild, [(member, channel)])[0]
+    
+    def _xp_cooldown(self, settings, user_class):
+        cooldown = settings['xp_cooldown']
+        if user_class == "TANK":
+            cooldown = int(cooldown * 0.5)  # 50% reduction
+        return cooldown
+    
+    def load_message_contexts(self, guild, entries, known_users=None):
+        """load_message_context for many (member, channel) pairs in one guild, one query per 500 users.
+        
+        Entries for the same member share one user dict, so awards committed for
+        an earlier entry (see award_statements) are seen by refresh_message_context.
+        known_users ({user_id: user dict}) are used as-is instead of being read.
+        Contexts that can't earn XP (channel or cooldown) have user None.
+        """
+        settings = self.get_guild_settings(guild.id)
+        now = time.time()
+        known_users = known_users or {}
+        users = {}
+        for member, channel in entries:
+            if not self.is_channel_allowed(guild.id, channel.id):
+                continue
+            state = self.member_state.get(guild.id, member.id)
+            if state is None or state.can_gain_xp(self._xp_cooldown(settings, state.user_class), now):
+                users[str(member.id)] = known_users.get(str(member.id))
+        user_ids = [user_id for user_id, user in users.items() if user is None]
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            try:
+                with self.get_conn(self.shard_path(guild.id)) as conn:
+                    cursor = conn.execute(
+                        f'SELECT * FROM users WHERE guild_id = ? AND user_id IN ({", ".join("?" for _ in chunk)})',
+                        (str(guild.id), *chunk)
+                    )
+                    names = [d[0] for d in cursor.description]
+                    for row in cursor.fetchall():
+                        user = dict(zip(names, row))
+                        users[user['user_id']] = self.member_state.overlay(guild.id, user['user_id'], user)
+            except Exception as e:
+                print(f"❌ Error loading users for guild {guild.id}: {e}")
+        
+        contexts = []
+        for member, channel in entries:
+            context = {'settings': settings, 'member': member, 'user': None, 'can_gain_xp': False}
+            context['channel_allowed'] = self.is_channel_allowed(guild.id, channel.id)
+            user_id = str(member.id)
+            if user_id in users:
+                if users[user_id] is None:
+                    self.create_user(member.id, guild.id, wait=False)
+                    users[user_id] = {'user_id': user_id, 'guild_id': str(guild.id), 'xp': 0, 'monthly_xp': 0, 'messages': 0}
+                context['user'] = users[user_id]
+                self.refresh_message_context(context)
+            contexts.append(context)
+        return contexts
+    
+    def refresh_message_context(self, context):
+        """(Re)derive cooldown, combo and multiplier fields from the member's in-memory state."""
+        user = context['user']
+        state = self.member_state.ensure(user['guild_id'], user['user_id'])
+        now = time.time()
+        cooldown = self._xp_cooldown(context['settings'], state.user_class)
+        context.update({
+            'user_class': state.user_class,
+            'cooldown': cooldown,
+            'can_gain_xp': state.can_gain_xp(cooldown, now),
+            'multiplier': self.get_user_multiplier(context['member']),
+            'focus_channel': user.get('focus_channel'),
+            'combo': state.combo_at(now),
+        })
+        return context
+    
+    def award_statements(self, context, xp_gain, advance_combo=False, mention=False):
+        """Statements for a message XP award.
+        
+        Also applies the award to the member's state and the context's user dict, so
+        the new total and cooldown are known without reading the row back. Combo and
+        mention timers are written back by member_state, not in these statements.
+        """
+        user = context['user']
+        user_id, guild_id = user['user_id'], user['guild_id']
+        now = datetime.now()
+        statements = self._xp_statements(user_id, guild_id, xp_gain, now)
+        self.member_state.record_award(guild_id, user_id, now.timestamp(), advance_combo, mention)
+        self.member_state.overlay(guild_id, user_id, user)
+        user['xp'] = (user.get('xp') or 0) + xp_gain
+        return statements
+    
+    def commit_award(self, context, xp_gain, advance_combo=False, mention=False):
+        """Write a message XP award as one queued transaction.
+        
+        Returns the user's new XP total, so level-ups can be checked without a read.
+        """
+        statements = self.award_statements(context, xp_gain, advance_combo, mention)
+        self.queue_transaction(statements, guild_id=context['user']['guild_id'])
+        return context['user']['xp']
+    
     # ----------------
     # SEASON METHODS
     # ----------------
@@ -830,17 +1457,18 @@ class Database:
                    ORDER BY monthly_xp DESC 
                    LIMIT ?''',
                 (str(guild_id), limit),
-                fetchall=True
+                fetchall=True,
+                guild_id=guild_id
             )
             return results if results else []
         except Exception as e:
             print(f"❌ Error getting season leaderboard: {e}")
             return []
     
-    def add_monthly_xp_column(self):
+    def add_monthly_xp_column(self, db_path=None):
         """Add monthly_xp column if missing"""
         try:
-            with self.get_conn() as conn:
+            with self.get_conn(db_path) as conn:
                 c = conn.cursor()
                 c.execute("PRAGMA table_info(users)")
                 columns = [column[1] for column in c.fetchall()]
@@ -854,10 +1482,10 @@ class Database:
         except Exception as e:
             print(f"❌ Error adding monthly_xp: {e}")
 
-    def add_class_columns(self):
+    def add_class_columns(self, db_path=None):
         """Add class-related columns"""
         try:
-            with self.get_conn() as conn:
+            with self.get_conn(db_path) as conn:
                 c = conn.cursor()
                 c.execute("PRAGMA table_info(users)")
                 columns = [column[1] for column in c.fetchall()]
@@ -882,13 +1510,37 @@ class Database:
         except Exception as e:
             print(f"❌ Error adding class columns: {e}")
 
+    def add_guild_settings_columns(self, db_path=None):
+        """Add guild_settings columns missing from older databases"""
+        try:
+            with self.get_conn(db_path) as conn:
+                c = conn.cursor()
+                c.execute("PRAGMA table_info(guild_settings)")
+                columns = [column[1] for column in c.fetchall()]
+                
+                new_columns = {
+                    'prefix_commands_enabled': 'INTEGER DEFAULT 1',
+                    'xp_formula': 'TEXT DEFAULT NULL'
+                }
+                
+                for col_name, col_type in new_columns.items():
+                    if col_name not in columns:
+                        print(f"➕ Adding {col_name} column...")
+                        c.execute(f'ALTER TABLE guild_settings ADD COLUMN {col_name} {col_type}')
+                        conn.commit()
+                        print(f"✅ {col_name} column added")
+        except Exception as e:
+            print(f"❌ Error adding guild settings columns: {e}")
+
     def save_season_winners(self, guild_id, season_id, winner_ids):
         """Save season winners"""
         winners_json = json.dumps(winner_ids)
         self.queue_write(
             '''INSERT OR REPLACE INTO seasons (guild_id, season_id, winners, ended_at)
                VALUES (?, ?, ?, ?)''',
-            (str(guild_id), season_id, winners_json, datetime.now().isoformat())
+            (str(guild_id), season_id, winners_json, datetime.now().isoformat()),
+            guild_id=guild_id,
+            lane=INTERACTIVE
         )
 
     def get_season_winners(self, guild_id, limit=12):
@@ -901,7 +1553,8 @@ class Database:
                    ORDER BY season_id DESC
                    LIMIT ?''',
                 (str(guild_id), limit),
-                fetchall=True
+                fetchall=True,
+                guild_id=guild_id
             )
             return results if results else []
         except Exception as e:
@@ -910,9 +1563,14 @@ class Database:
 
     def reset_season(self, guild_id):
         """Reset season"""
+        if self.event_log:
+            self.event_log.append(xp_log.SEASON_RESET, guild_id, 0, 0)
         self.queue_write(
             'UPDATE users SET monthly_xp = 0 WHERE guild_id = ?',
-            (str(guild_id),)
+            (str(guild_id),),
+            guild_id=guild_id,
+            lane=INTERACTIVE,
+            after_bulk=True
         )
     
     # -------------------------
@@ -923,8 +1581,11 @@ class Database:
         """Set user class"""
         self.queue_write(
             'UPDATE users SET class = ? WHERE user_id = ? AND guild_id = ?',
-            (class_name, str(user_id), str(guild_id))
+            (class_name, str(user_id), str(guild_id)),
+            guild_id=guild_id,
+            lane=INTERACTIVE
         )
+        self.member_state.set_class(guild_id, user_id, class_name)
         time.sleep(0.05)  # Small delay to ensure write completes
     
     def get_user_class(self, user_id, guild_id):
@@ -936,14 +1597,18 @@ class Database:
         """Increment daily streak"""
         self.queue_write(
             'UPDATE users SET daily_streak = daily_streak + 1 WHERE user_id = ? AND guild_id = ?',
-            (str(user_id), str(guild_id))
+            (str(user_id), str(guild_id)),
+            guild_id=guild_id,
+            lane=INTERACTIVE
         )
     
     def reset_daily_streak(self, user_id, guild_id):
         """Reset daily streak"""
         self.queue_write(
             'UPDATE users SET daily_streak = 0 WHERE user_id = ? AND guild_id = ?',
-            (str(user_id), str(guild_id))
+            (str(user_id), str(guild_id)),
+            guild_id=guild_id,
+            lane=INTERACTIVE
         )
     
     def add_stored_daily(self, user_id, guild_id):
@@ -954,7 +1619,9 @@ class Database:
             if stored < 3:
                 self.queue_write(
                     'UPDATE users SET stored_dailies = stored_dailies + 1 WHERE user_id = ? AND guild_id = ?',
-                    (str(user_id), str(guild_id))
+                    (str(user_id), str(guild_id)),
+                    guild_id=guild_id,
+                    lane=INTERACTIVE
                 )
                 return True
             return False
@@ -970,7 +1637,9 @@ class Database:
             if stored > 0:
                 self.queue_write(
                     'UPDATE users SET stored_dailies = 0 WHERE user_id = ? AND guild_id = ?',
-                    (str(user_id), str(guild_id))
+                    (str(user_id), str(guild_id)),
+                    guild_id=guild_id,
+                    lane=INTERACTIVE
                 )
             return stored
         except Exception as e:
@@ -981,7 +1650,9 @@ class Database:
         """Set RANGER's focus channel"""
         self.queue_write(
             'UPDATE users SET focus_channel = ?, focus_channel_set = ? WHERE user_id = ? AND guild_id = ?',
-            (str(channel_id), datetime.now().isoformat(), str(user_id), str(guild_id))
+            (str(channel_id), datetime.now().isoformat(), str(user_id), str(guild_id)),
+            guild_id=guild_id,
+            lane=INTERACTIVE
         )
     
     def get_focus_channel(self, user_id, guild_id):
@@ -1008,40 +1679,19 @@ class Database:
             return True  # Allow on error
     
     def increment_message_combo(self, user_id, guild_id):
-        """Increment ASSASSIN's message combo"""
-        self.queue_write(
-            'UPDATE users SET message_combo = message_combo + 1, last_message_time = ? WHERE user_id = ? AND guild_id = ?',
-            (datetime.now().isoformat(), str(user_id), str(guild_id))
-        )
+        """Increment ASSASSIN's message combo (written back in the background)"""
+        now = time.time()
+        state = self.member_state.ensure(guild_id, user_id)
+        self.member_state.set_combo(guild_id, user_id, state.combo_at(now) + 1, now)
     
     def reset_message_combo(self, user_id, guild_id):
         """Reset ASSASSIN's message combo"""
-        self.queue_write(
-            'UPDATE users SET message_combo = 0 WHERE user_id = ? AND guild_id = ?',
-            (str(user_id), str(guild_id))
-        )
+        self.member_state.set_combo(guild_id, user_id, 0)
     
     def get_message_combo(self, user_id, guild_id):
-        """Get ASSASSIN's current combo"""
-        try:
-            user = self.get_user(user_id, guild_id)
-            if not user:
-                return 0
-            
-            # Check if combo expired (5 min gap)
-            if user.get('last_message_time'):
-                try:
-                    last_time = datetime.fromisoformat(user['last_message_time'])
-                    if (datetime.now() - last_time).total_seconds() > 300:  # 5 min
-                        self.reset_message_combo(user_id, guild_id)
-                        return 0
-                except Exception:
-                    return 0
-            
-            return user.get('message_combo', 0)
-        except Exception as e:
-            print(f"❌ Error getting message combo: {e}")
-            return 0
+        """Get ASSASSIN's current combo (0 after a 5 min gap)"""
+        state = self.member_state.get(guild_id, user_id)
+        return state.combo_at(time.time()) if state else 0
     
     # =====================================
     # WEB APP SYNC - QUESTS, HABITS, ETC.
@@ -1049,309 +1699,47 @@ class Database:
     
     async def get_web_quests(self, discord_id: str):
         """Get user's quests from web app."""
-        import config as bot_config
-        
-        if not bot_config.BOT_SYNC_SECRET or not bot_config.SUPABASE_SERVICE_ROLE_KEY:
-            return {"success": False, "error": "Web sync not configured"}
-        
-        url = f"{bot_config.SUPABASE_URL}/functions/v1/bot-sync"
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    url,
-                    json={"discord_id": str(discord_id), "action": "get_quests"},
-                    headers={
-                        "Authorization": f"Bearer {bot_config.SUPABASE_SERVICE_ROLE_KEY}",
-                        "X-Bot-Secret": bot_config.BOT_SYNC_SECRET,
-                        "Content-Type": "application/json"
-                    },
-                    timeout=aiohttp.ClientTimeout(total=10)
-                ) as response:
-                    return await response.json()
-        except Exception as e:
-            print(f"❌ Get quests error: {e}")
-            return {"success": False, "error": str(e)}
+        return await self.bot_sync.request(discord_id, "get_quests")
     
     async def add_web_quest(self, discord_id: str, quest_title: str):
         """Add a quest via web app."""
-        import config as bot_config
-        
-        if not bot_config.BOT_SYNC_SECRET or not bot_config.SUPABASE_SERVICE_ROLE_KEY:
-            return {"success": False, "error": "Web sync not configured"}
-        
-        url = f"{bot_config.SUPABASE_URL}/functions/v1/bot-sync"
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    url,
-                    json={
-                        "discord_id": str(discord_id),
-                        "action": "add_quest",
-                        "data": {"quest_title": quest_title}
-                    },
-                    headers={
-                        "Authorization": f"Bearer {bot_config.SUPABASE_SERVICE_ROLE_KEY}",
-                        "X-Bot-Secret": bot_config.BOT_SYNC_SECRET,
-                        "Content-Type": "application/json"
-                    },
-                    timeout=aiohttp.ClientTimeout(total=10)
-                ) as response:
-                    return await response.json()
-        except Exception as e:
-            print(f"❌ Add quest error: {e}")
-            return {"success": False, "error": str(e)}
+        return await self.bot_sync.request(discord_id, "add_quest", {"quest_title": quest_title})
     
     async def complete_web_quest(self, discord_id: str, quest_index: int):
         """Complete a quest via web app."""
-        import config as bot_config
-        
-        if not bot_config.BOT_SYNC_SECRET or not bot_config.SUPABASE_SERVICE_ROLE_KEY:
-            return {"success": False, "error": "Web sync not configured"}
-        
-        url = f"{bot_config.SUPABASE_URL}/functions/v1/bot-sync"
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    url,
-                    json={
-                        "discord_id": str(discord_id),
-                        "action": "complete_quest",
-                        "data": {"quest_index": quest_index}
-                    },
-                    headers={
-                        "Authorization": f"Bearer {bot_config.SUPABASE_SERVICE_ROLE_KEY}",
-                        "X-Bot-Secret": bot_config.BOT_SYNC_SECRET,
-                        "Content-Type": "application/json"
-                    },
-                    timeout=aiohttp.ClientTimeout(total=10)
-                ) as response:
-                    return await response.json()
-        except Exception as e:
-            print(f"❌ Complete quest error: {e}")
-            return {"success": False, "error": str(e)}
+        return await self.bot_sync.request(discord_id, "complete_quest", {"quest_index": quest_index})
     
     async def get_web_habits(self, discord_id: str):
         """Get user's habits from web app."""
-        import config as bot_config
-        
-        if not bot_config.BOT_SYNC_SECRET or not bot_config.SUPABASE_SERVICE_ROLE_KEY:
-            return {"success": False, "error": "Web sync not configured"}
-        
-        url = f"{bot_config.SUPABASE_URL}/functions/v1/bot-sync"
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    url,
-                    json={"discord_id": str(discord_id), "action": "get_habits"},
-                    headers={
-                        "Authorization": f"Bearer {bot_config.SUPABASE_SERVICE_ROLE_KEY}",
-                        "X-Bot-Secret": bot_config.BOT_SYNC_SECRET,
-                        "Content-Type": "application/json"
-                    },
-                    timeout=aiohttp.ClientTimeout(total=10)
-                ) as response:
-                    return await response.json()
-        except Exception as e:
-            print(f"❌ Get habits error: {e}")
-            return {"success": False, "error": str(e)}
+        return await self.bot_sync.request(discord_id, "get_habits")
     
     async def complete_web_habit(self, discord_id: str, habit_id: str):
         """Complete a habit via web app by ID."""
-        import config as bot_config
-        
-        if not bot_config.BOT_SYNC_SECRET or not bot_config.SUPABASE_SERVICE_ROLE_KEY:
-            return {"success": False, "error": "Web sync not configured"}
-        
-        url = f"{bot_config.SUPABASE_URL}/functions/v1/bot-sync"
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    url,
-                    json={
-                        "discord_id": str(discord_id),
-                        "action": "complete_habit",
-                        "data": {"habit_id": habit_id}
-                    },
-                    headers={
-                        "Authorization": f"Bearer {bot_config.SUPABASE_SERVICE_ROLE_KEY}",
-                        "X-Bot-Secret": bot_config.BOT_SYNC_SECRET,
-                        "Content-Type": "application/json"
-                    },
-                    timeout=aiohttp.ClientTimeout(total=10)
-                ) as response:
-                    return await response.json()
-        except Exception as e:
-            print(f"❌ Complete habit error: {e}")
-            return {"success": False, "error": str(e)}
+        return await self.bot_sync.request(discord_id, "complete_habit", {"habit_id": habit_id})
     
     async def complete_web_habit_by_index(self, discord_id: str, habit_index: int):
         """Complete a habit via web app by index (0-based)."""
-        import config as bot_config
-        
-        if not bot_config.BOT_SYNC_SECRET or not bot_config.SUPABASE_SERVICE_ROLE_KEY:
-            return {"success": False, "error": "Web sync not configured"}
-        
-        url = f"{bot_config.SUPABASE_URL}/functions/v1/bot-sync"
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    url,
-                    json={
-                        "discord_id": str(discord_id),
-                        "action": "complete_habit",
-                        "data": {"habit_index": habit_index}
-                    },
-                    headers={
-                        "Authorization": f"Bearer {bot_config.SUPABASE_SERVICE_ROLE_KEY}",
-                        "X-Bot-Secret": bot_config.BOT_SYNC_SECRET,
-                        "Content-Type": "application/json"
-                    },
-                    timeout=aiohttp.ClientTimeout(total=10)
-                ) as response:
-                    return await response.json()
-        except Exception as e:
-            print(f"❌ Complete habit by index error: {e}")
-            return {"success": False, "error": str(e)}
+        return await self.bot_sync.request(discord_id, "complete_habit", {"habit_index": habit_index})
     
     async def get_web_streak(self, discord_id: str):
         """Get user's streak from web app."""
-        import config as bot_config
-        
-        if not bot_config.BOT_SYNC_SECRET or not bot_config.SUPABASE_SERVICE_ROLE_KEY:
-            return {"success": False, "error": "Web sync not configured"}
-        
-        url = f"{bot_config.SUPABASE_URL}/functions/v1/bot-sync"
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    url,
-                    json={"discord_id": str(discord_id), "action": "get_streak"},
-                    headers={
-                        "Authorization": f"Bearer {bot_config.SUPABASE_SERVICE_ROLE_KEY}",
-                        "X-Bot-Secret": bot_config.BOT_SYNC_SECRET,
-                        "Content-Type": "application/json"
-                    },
-                    timeout=aiohttp.ClientTimeout(total=10)
-                ) as response:
-                    return await response.json()
-        except Exception as e:
-            print(f"❌ Get streak error: {e}")
-            return {"success": False, "error": str(e)}
+        return await self.bot_sync.request(discord_id, "get_streak")
     
     async def get_web_gates(self, discord_id: str):
         """Get user's gates from web app."""
-        import config as bot_config
-        
-        if not bot_config.BOT_SYNC_SECRET or not bot_config.SUPABASE_SERVICE_ROLE_KEY:
-            return {"success": False, "error": "Web sync not configured"}
-        
-        url = f"{bot_config.SUPABASE_URL}/functions/v1/bot-sync"
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    url,
-                    json={"discord_id": str(discord_id), "action": "get_gates"},
-                    headers={
-                        "Authorization": f"Bearer {bot_config.SUPABASE_SERVICE_ROLE_KEY}",
-                        "X-Bot-Secret": bot_config.BOT_SYNC_SECRET,
-                        "Content-Type": "application/json"
-                    },
-                    timeout=aiohttp.ClientTimeout(total=10)
-                ) as response:
-                    return await response.json()
-        except Exception as e:
-            print(f"❌ Get gates error: {e}")
-            return {"success": False, "error": str(e)}
+        return await self.bot_sync.request(discord_id, "get_gates")
     
     async def get_web_challenges(self, discord_id: str):
         """Get user's challenges from web app."""
-        import config as bot_config
-        
-        if not bot_config.BOT_SYNC_SECRET or not bot_config.SUPABASE_SERVICE_ROLE_KEY:
-            return {"success": False, "error": "Web sync not configured"}
-        
-        url = f"{bot_config.SUPABASE_URL}/functions/v1/bot-sync"
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    url,
-                    json={"discord_id": str(discord_id), "action": "get_challenges"},
-                    headers={
-                        "Authorization": f"Bearer {bot_config.SUPABASE_SERVICE_ROLE_KEY}",
-                        "X-Bot-Secret": bot_config.BOT_SYNC_SECRET,
-                        "Content-Type": "application/json"
-                    },
-                    timeout=aiohttp.ClientTimeout(total=10)
-                ) as response:
-                    return await response.json()
-        except Exception as e:
-            print(f"❌ Get challenges error: {e}")
-            return {"success": False, "error": str(e)}
+        return await self.bot_sync.request(discord_id, "get_challenges")
     
     async def get_web_card_data(self, discord_id: str):
         """Get user's stats card data from web app."""
-        import config as bot_config
-        
-        if not bot_config.BOT_SYNC_SECRET or not bot_config.SUPABASE_SERVICE_ROLE_KEY:
-            return {"success": False, "error": "Web sync not configured"}
-        
-        url = f"{bot_config.SUPABASE_URL}/functions/v1/bot-sync"
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    url,
-                    json={"discord_id": str(discord_id), "action": "get_card_data"},
-                    headers={
-                        "Authorization": f"Bearer {bot_config.SUPABASE_SERVICE_ROLE_KEY}",
-                        "X-Bot-Secret": bot_config.BOT_SYNC_SECRET,
-                        "Content-Type": "application/json"
-                    },
-                    timeout=aiohttp.ClientTimeout(total=10)
-                ) as response:
-                    return await response.json()
-        except Exception as e:
-            print(f"❌ Get card data error: {e}")
-            return {"success": False, "error": str(e)}
+        return await self.bot_sync.request(discord_id, "get_card_data")
     
     async def sync_class_to_web(self, discord_id: str, class_id: str):
         """Sync user's class selection to web app."""
-        import config as bot_config
-        
-        if not bot_config.BOT_SYNC_SECRET or not bot_config.SUPABASE_SERVICE_ROLE_KEY:
-            return {"success": False, "error": "Web sync not configured"}
-        
-        url = f"{bot_config.SUPABASE_URL}/functions/v1/bot-sync"
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    url,
-                    json={
-                        "discord_id": str(discord_id),
-                        "action": "link_class",
-                        "data": {"class_id": class_id}
-                    },
-                    headers={
-                        "Authorization": f"Bearer {bot_config.SUPABASE_SERVICE_ROLE_KEY}",
-                        "X-Bot-Secret": bot_config.BOT_SYNC_SECRET,
-                        "Content-Type": "application/json"
-                    },
-                    timeout=aiohttp.ClientTimeout(total=10)
-                ) as response:
-                    result = await response.json()
-                    if result.get('success'):
-                        print(f"✅ Synced class {class_id} to web app for {discord_id}")
-                    return result
-        except Exception as e:
-            print(f"❌ Sync class error: {e}")
-            return {"success": False, "error": str(e)}
+        result = await self.bot_sync.request(discord_id, "link_class", {"class_id": class_id})
+        if result.get('success'):
+            print(f"✅ Synced class {class_id} to web app for {discord_id}")
+        return result
@@ -0,0 +1,90 @@
+"""Measure database throughput under each performance profile.
+
+Usage:
+    python db_benchmark.py [--users 2000] [--writes 20000] [--reads 20000] [--profiles durable,balanced,fast]
+
+Each profile gets a fresh database in a temporary directory, so this never
+touches system.db. Writes go through the normal write queue (add_xp), reads
+through get_user and get_leaderboard, the same paths the bot uses.
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from database import Database, PRAGMA_PROFILES
+
+GUILD_ID = 1
+
+
+def _wait_for_writes(db, expected_messages, timeout=300):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        row = db._execute_query('SELECT SUM(messages) FROM users WHERE guild_id = ?', (str(GUILD_ID),), fetchone=True)
+        if row and row[0] and row[0] >= expected_messages:
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def run_profile(profile, users, writes, reads):
+    """Return {metric: ops_per_second} for one profile."""
+    tmp = tempfile.mkdtemp(prefix=f"bench-{profile}-")
+    db = Database(os.path.join(tmp, "bench.db"), profile=profile)
+    try:
+        with db.get_conn() as conn:
+            conn.executemany(
+                'INSERT INTO users (user_id, guild_id, xp, monthly_xp) VALUES (?, ?, ?, 0)',
+                [(str(u), str(GUILD_ID), random.randint(0, 100000)) for u in range(users)]
+            )
+            conn.commit()
+
+        results = {}
+        start = time.perf_counter()
+        for i in range(writes):
+            db.add_xp(random.randrange(users), GUILD_ID, 20)
+        if not _wait_for_writes(db, writes):
+            print(f"⚠️ {profile}: writes did not finish in time")
+        results["add_xp/s"] = writes / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in range(reads):
+            db.get_user(random.randrange(users), GUILD_ID)
+        results["get_user/s"] = reads / (time.perf_counter() - start)
+
+        lb_reads = max(1, reads // 20)
+        start = time.perf_counter()
+        for _ in range(lb_reads):
+            db.get_leaderboard(GUILD_ID, limit=10)
+        results["leaderboard/s"] = lb_reads / (time.perf_counter() - start)
+        return results
+    finally:
+        db.stop_write_worker()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Benchmark SQLite performance profiles")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--writes", type=int, default=20000)
+    parser.add_argument("--reads", type=int, default=20000)
+    parser.add_argument("--profiles", default=",".join(PRAGMA_PROFILES))
+    args = parser.parse_args()
+
+    rows = []
+    for profile in args.profiles.split(","):
+        profile = profile.strip()
+        print(f"⏱️ Running {profile}...")
+        rows.append((profile, run_profile(profile, args.users, args.writes, args.reads)))
+
+    metrics = list(rows[0][1])
+    print()
+    print(f"{'profile':<10}" + "".join(f"{m:>16}" for m in metrics))
+    for profile, results in rows:
+        print(f"{profile:<10}" + "".join(f"{results[m]:>16,.0f}" for m in metrics))
+
+
+if __name__ == "__main__":
+    _main()
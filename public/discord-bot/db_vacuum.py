@@ -0,0 +1,73 @@
+"""Convert existing database files to incremental auto-vacuum.
+
+Files created by the bot start in incremental mode, so the maintenance task
+can hand free pages back with PRAGMA incremental_vacuum. Older files need a
+one-off full VACUUM to switch, which rewrites the whole file: it holds the
+write lock from start to finish and needs free disk space for another copy
+of the file (plus its WAL). The bot never does that on its own; run this
+while the bot is stopped.
+
+Usage:
+    python db_vacuum.py system.db [system.shard-00.db ...] [--force]
+
+Files already in incremental mode are skipped. Without --force a file is
+only converted when there is at least twice its size free on its disk.
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+
+MODES = {0: "none", 1: "full", 2: "incremental"}
+SPACE_FACTOR = 2  # free disk space needed, as a multiple of the file size
+
+
+def vacuum_mode(conn):
+    return MODES.get(conn.execute("PRAGMA auto_vacuum").fetchone()[0], "unknown")
+
+
+def convert(path, force=False):
+    """Switch one file to incremental auto-vacuum. Returns (size_before, size_after) in bytes,
+    or None if it already was incremental."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found")
+    conn = sqlite3.connect(path, timeout=30.0, isolation_level=None)
+    try:
+        conn.execute("PRAGMA busy_timeout=30000")
+        if vacuum_mode(conn) == "incremental":
+            return None
+        size = os.path.getsize(path)
+        free = shutil.disk_usage(os.path.dirname(os.path.abspath(path))).free
+        if not force and free < size * SPACE_FACTOR:
+            raise ValueError(
+                f"{path} is {size / 1048576:,.0f} MB but only {free / 1048576:,.0f} MB is free; "
+                f"VACUUM needs about {SPACE_FACTOR}x the file size (use --force to try anyway)"
+            )
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return size, os.path.getsize(path)
+    finally:
+        conn.close()
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Convert database files to incremental auto-vacuum")
+    parser.add_argument("paths", nargs="+", metavar="db")
+    parser.add_argument("--force", action="store_true", help="skip the free disk space check")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        try:
+            result = convert(path, args.force)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"❌ {e}")
+            continue
+        if result is None:
+            print(f"✅ {path} already uses incremental auto-vacuum")
+        else:
+            print(f"✅ Converted {path} ({result[0] / 1048576:,.1f} MB -> {result[1] / 1048576:,.1f} MB)")
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,278 @@
+"""In-memory per-guild aggregate counters for /serverstats.
+
+Counters are built once from the users table at startup and then kept up to
+date by the same Database methods that queue XP, voice and user-creation
+writes, so reading a guild's totals, averages and level histogram never
+touches SQLite. Each change is applied once its write has committed, so the
+counters always match the committed rows and can be rebuilt from them at any
+point on the write worker.
+
+Each guild also keeps its members in leaderboard order (RankIndex), so a
+member's position and the rows around it (get_rank, /aroundme) cost
+O(log n) plus the rows returned instead of counting everyone ahead.
+"""
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+from math import isqrt
+
+RANK_LOAD = 500  # target keys per RankIndex bucket; a bucket splits at twice this
+
+
+def level_for_xp(xp):
+    """Level reached with `xp` total XP when level L costs L * 100 XP.
+
+    Matches bot.xp_for_level: 50 * L * (L + 1) XP reaches level L, so this is
+    the largest L with (20L + 10)^2 <= 8 * xp + 100.
+    """
+    if xp <= 0:
+        return 0
+    return (isqrt(8 * xp + 100) - 10) // 20
+
+
+class RankIndex:
+    """Sorted keys with positions: O(log n) add, remove and position lookups.
+
+    The keys are kept in sorted buckets of about RANK_LOAD, with a Fenwick tree
+    over the bucket sizes to turn a bucket number into the count of keys before
+    it (and back). Only splitting or emptying a bucket rebuilds the tree.
+    """
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self._lists = [keys[i:i + RANK_LOAD] for i in range(0, len(keys), RANK_LOAD)]
+        self._maxes = [bucket[-1] for bucket in self._lists]
+        self._build()
+
+    def __len__(self):
+        return self._len
+
+    def _build(self):
+        self._len = sum(len(bucket) for bucket in self._lists)
+        tree = [0] + [len(bucket) for bucket in self._lists]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _update(self, bucket, delta):
+        self._len += delta
+        i = bucket + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _before(self, bucket):
+        """Keys in the buckets before this one."""
+        total, i = 0, bucket
+        while i:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, position):
+        """(bucket, offset) of the key at a 0-based position."""
+        bucket, step = 0, 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            if bucket + step < len(self._tree) and self._tree[bucket + step] <= position:
+                bucket += step
+                position -= self._tree[bucket]
+            step >>= 1
+        return bucket, position
+
+    def add(self, key):
+        if not self._lists:
+            self._lists, self._maxes = [[key]], [key]
+            self._build()
+            return
+        bucket = min(bisect_left(self._maxes, key), len(self._lists) - 1)
+        insort(self._lists[bucket], key)
+        self._maxes[bucket] = self._lists[bucket][-1]
+        if len(self._lists[bucket]) > 2 * RANK_LOAD:
+            half = self._lists[bucket][RANK_LOAD:]
+            del self._lists[bucket][RANK_LOAD:]
+            self._lists.insert(bucket + 1, half)
+            self._maxes[bucket:bucket + 1] = [self._lists[bucket][-1], half[-1]]
+            self._build()
+        else:
+            self._update(bucket, 1)
+
+    def remove(self, key):
+        """Remove a key; does nothing if it isn't there."""
+        bucket = bisect_left(self._maxes, key)
+        if bucket == len(self._lists):
+            return
+        keys = self._lists[bucket]
+        i = bisect_left(keys, key)
+        if i == len(keys) or keys[i] != key:
+            return
+        del keys[i]
+        if keys:
+            self._maxes[bucket] = keys[-1]
+            self._update(bucket, -1)
+        else:
+            del self._lists[bucket], self._maxes[bucket]
+            self._build()
+
+    def position(self, key):
+        """0-based position of a key that is in the index."""
+        bucket = bisect_left(self._maxes, key)
+        return self._before(bucket) + bisect_left(self._lists[bucket], key)
+
+    def slice(self, start, stop):
+        """Keys from position start up to (not including) stop."""
+        start, stop = max(start, 0), min(stop, self._len)
+        if start >= stop:
+            return []
+        bucket, offset = self._locate(start)
+        keys = []
+        while len(keys) < stop - start:
+            keys += self._lists[bucket][offset:offset + stop - start - len(keys)]
+            bucket, offset = bucket + 1, 0
+        return keys
+
+
+def _rank_key(user_id, xp):
+    # Leaderboard order: most XP first, ties by user_id
+    return (-xp, user_id)
+
+
+class _GuildCounters:
+    __slots__ = ('messages', 'xp', 'voice_time', 'user_xp', 'levels', 'ranking')
+
+    def __init__(self):
+        self.messages = 0
+        self.xp = 0
+        self.voice_time = 0
+        self.user_xp = {}         # user_id -> xp, to move users between histogram buckets
+        self.levels = Counter()   # level -> users at that level
+        self.ranking = RankIndex()
+
+
+class GuildStats:
+    def __init__(self):
+        self._guilds = {}
+        self._lock = threading.Lock()
+
+    def _guild(self, guild_id):
+        guild = self._guilds.get(guild_id)
+        if guild is None:
+            guild = self._guilds[guild_id] = _GuildCounters()
+        return guild
+
+    def load(self, rows):
+        """Add (guild_id, user_id, xp, messages, voice_time) rows, e.g. from a users table scan."""
+        with self._lock:
+            loaded = {}
+            for guild_id, user_id, xp, messages, voice_time in rows:
+                xp = xp or 0
+                guild = self._guild(str(guild_id))
+                if str(user_id) in guild.user_xp:
+                    continue
+                guild.user_xp[str(user_id)] = xp
+                guild.levels[level_for_xp(xp)] += 1
+                guild.xp += xp
+                guild.messages += messages or 0
+                guild.voice_time += voice_time or 0
+                loaded.setdefault(guild, []).append(_rank_key(str(user_id), xp))
+            for guild, keys in loaded.items():
+                if guild.ranking:
+                    for key in keys:
+                        guild.ranking.add(key)
+                else:
+                    guild.ranking = RankIndex(keys)
+
+    def guild_ids(self):
+        with self._lock:
+            return list(self._guilds)
+
+    def replace(self, guild_ids, rows):
+        """Drop the counters for guild_ids and load fresh ones from rows, e.g. after
+        another process changed the users table."""
+        fresh = GuildStats()
+        fresh.load(rows)
+        with self._lock:
+            for guild_id in guild_ids:
+                self._guilds.pop(str(guild_id), None)
+            self._guilds.update(fresh._guilds)
+
+    def _set_user_xp(self, guild, user_id, xp):
+        old = guild.user_xp[user_id]
+        guild.user_xp[user_id] = xp
+        guild.xp += xp - old
+        guild.ranking.remove(_rank_key(user_id, old))
+        guild.ranking.add(_rank_key(user_id, xp))
+        old_level, new_level = level_for_xp(old), level_for_xp(xp)
+        if old_level != new_level:
+            guild.levels[old_level] -= 1
+            if not guild.levels[old_level]:
+                del guild.levels[old_level]
+            guild.levels[new_level] += 1
+
+    def add_user(self, guild_id, user_id):
+        with self._lock:
+            guild = self._guild(str(guild_id))
+            if str(user_id) not in guild.user_xp:
+                guild.user_xp[str(user_id)] = 0
+                guild.levels[0] += 1
+                guild.ranking.add(_rank_key(str(user_id), 0))
+
+    # The updates below mirror UPDATE ... WHERE user_id = ?, which does
+    # nothing for a user without a row, so unknown users are ignored.
+
+    def add_xp(self, guild_id, user_id, amount, messages=0):
+        with self._lock:
+            guild = self._guilds.get(str(guild_id))
+            if guild and str(user_id) in guild.user_xp:
+                self._set_user_xp(guild, str(user_id), guild.user_xp[str(user_id)] + amount)
+                guild.messages += messages
+
+    def set_xp(self, guild_id, user_id, xp):
+        with self._lock:
+            guild = self._guilds.get(str(guild_id))
+            if guild and str(user_id) in guild.user_xp:
+                self._set_user_xp(guild, str(user_id), xp)
+
+    def add_voice_time(self, guild_id, user_id, seconds):
+        with self._lock:
+            guild = self._guilds.get(str(guild_id))
+            if guild and str(user_id) in guild.user_xp:
+                guild.voice_time += seconds
+
+    def aggregates(self, guild_id):
+        """Totals, averages and level histogram for a guild."""
+        with self._lock:
+            guild = self._guilds.get(str(guild_id)) or _GuildCounters()
+            users = len(guild.user_xp)
+            level_sum = sum(level * count for level, count in guild.levels.items())
+            return {
+                'total_messages': guild.messages,
+                'total_xp': guild.xp,
+                'total_users': users,
+                'total_voice_time': guild.voice_time,
+                'avg_xp': guild.xp // users if users else 0,
+                'avg_level': level_sum / users if users else 0,
+                'level_histogram': dict(sorted(guild.levels.items())),
+            }
+
+    def rank(self, guild_id, user_id):
+        """1-based leaderboard position of a member, or None if they have no row."""
+        with self._lock:
+            guild = self._guilds.get(str(guild_id))
+            xp = guild.user_xp.get(str(user_id)) if guild else None
+            if xp is None:
+                return None
+            return guild.ranking.position(_rank_key(str(user_id), xp)) + 1
+
+    def window(self, guild_id, user_id, radius):
+        """[(position, user_id, xp)] for up to radius members above and below one, or None if they have no row."""
+        with self._lock:
+            guild = self._guilds.get(str(guild_id))
+            xp = guild.user_xp.get(str(user_id)) if guild else None
+            if xp is None:
+                return None
+            position = guild.ranking.position(_rank_key(str(user_id), xp))
+            start = max(position - radius, 0)
+            keys = guild.ranking.slice(start, position + radius + 1)
+            return [(start + 1 + i, uid, -neg_xp) for i, (neg_xp, uid) in enumerate(keys)]
@@ -0,0 +1,286 @@
+"""Export and import one guild's data as CSV or JSONL.
+
+Usage:
+    python guild_transfer.py export <guild_id> <out_dir> [--format csv|jsonl] [--gzip]
+    python guild_transfer.py import <guild_id> <path> [--table users] [--replace]
+
+Export writes users, xp_history and seasons to <out_dir>/<table>.<format>[.gz].
+Import reads a directory produced by export (the guild id in the files is
+replaced by <guild_id>, so data can be moved between servers) or a single
+users file. Users files from other leveling bots are accepted as long as they
+have a user id and XP column, e.g. MEE6's `id`, `xp`, `message_count`.
+
+Both directions stream rows in chunks, so memory use does not grow with the
+size of the guild. Pass --db/--shards if the bot runs with a non-default
+database path or DB_SHARDS.
+"""
+import argparse
+import csv
+import gzip
+import json
+import itertools
+import operator
+import os
+import sys
+
+import history_partitions
+from database import CACHE_TABLES, Database, PER_GUILD_SHARDS, record_cache_changes
+
+TABLES = ["users", "xp_history", "seasons"]
+CHUNK_SIZE = 10000
+# Rows inserted per executemany; users batches are sorted by user id first, so the
+# key and guild indexes are filled in order rather than at random (~20% faster on 1M rows)
+IMPORT_BATCH = 100000
+FORMATS = ("csv", "jsonl")
+
+# Column names other bots use in their users dumps
+COLUMN_ALIASES = {
+    "id": "user_id",
+    "userid": "user_id",
+    "user": "user_id",
+    "member_id": "user_id",
+    "discord_id": "user_id",
+    "exp": "xp",
+    "experience": "xp",
+    "total_xp": "xp",
+    "totalxp": "xp",
+    "message_count": "messages",
+    "messagecount": "messages",
+    "msg_count": "messages",
+    "voice_seconds": "voice_time",
+}
+
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", compresslevel=5, encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def _ext(path):
+    name = path[:-3] if path.endswith(".gz") else path
+    return os.path.splitext(name)[1].lstrip(".").lower()
+
+
+def _format_of(path):
+    return "jsonl" if _ext(path) in ("jsonl", "json", "ndjson") else "csv"
+
+
+def iter_table(conn, table, guild_id):
+    """Yield chunks of rows for one guild. The first item is the column list."""
+    cursor = conn.execute(f"SELECT * FROM {table} WHERE guild_id = ?", (str(guild_id),))
+    yield [d[0] for d in cursor.description]
+    while True:
+        rows = cursor.fetchmany(CHUNK_SIZE)
+        if not rows:
+            break
+        yield rows
+
+
+def write_rows(path, chunks):
+    """Write a (columns, *row_chunks) stream to CSV or JSONL. Returns the row count."""
+    columns = next(chunks)
+    count = 0
+    with _open(path, "w") as f:
+        if _format_of(path) == "csv":
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for rows in chunks:
+                writer.writerows(rows)
+                count += len(rows)
+        else:
+            for rows in chunks:
+                f.writelines(json.dumps(dict(zip(columns, row))) + "\n" for row in rows)
+                count += len(rows)
+    return count
+
+
+def read_rows(path):
+    """Stream a CSV, JSONL or JSON file like iter_table: normalised column names, then row chunks."""
+    with _open(path, "r") as f:
+        if _format_of(path) == "csv":
+            reader = csv.reader(f)
+            header = next(reader, [])
+            rows = reader
+        else:
+            if _ext(path) == "json":
+                records = _iter_json_document(f)
+            else:
+                records = (json.loads(line) for line in f if line.strip())
+            first = next(records, None)
+            header = list(first) if first else []
+            rows = _record_values(first, records, header)
+        yield [COLUMN_ALIASES.get(h.strip().lower(), h.strip().lower()) for h in header]
+        while True:
+            chunk = list(itertools.islice(rows, CHUNK_SIZE))
+            if not chunk:
+                break
+            yield chunk
+
+
+def _record_values(first, records, keys):
+    if first is not None:
+        yield tuple(first.get(k) for k in keys)
+    for record in records:
+        yield tuple(record.get(k) for k in keys)
+
+
+def _iter_json_document(f):
+    # A saved leaderboard such as MEE6's {"players": [...]} or a plain list;
+    # these are not line-delimited so the document is loaded in one go.
+    data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("players") or data.get("users") or []
+    yield from data
+
+
+def export_guild(db, guild_id, out_dir, fmt="csv", compress=False):
+    """Export every guild table into out_dir. Returns {table: rows}."""
+    os.makedirs(out_dir, exist_ok=True)
+    suffix = f".{fmt}" + (".gz" if compress else "")
+    counts = {}
+    with db.get_conn(db.shard_path(guild_id)) as conn:
+        for table in TABLES:
+            path = os.path.join(out_dir, table + suffix)
+            counts[table] = write_rows(path, iter_table(conn, table, guild_id))
+            print(f"✅ {table}: {counts[table]} rows -> {path}")
+    return counts
+
+
+def import_table(db, guild_id, table, path, replace=False, refresh=True):
+    """Stream a file into one table for guild_id. Returns the row count.
+
+    Running bots pick the import up on their own; refresh=True also reloads
+    db's in-memory copy of the guild (not worth it in a short-lived script).
+    """
+    with db.get_conn(db.shard_path(guild_id)) as conn:
+        table_columns = [col[1] for col in conn.execute(f"PRAGMA table_info({table})")]
+        # Row ids belong to the source database
+        insertable = [c for c in table_columns if c != "id"]
+        chunks = read_rows(path)
+        header = next(chunks)
+        columns = [c for c in insertable if c in header and c != "guild_id"]
+        if table == "users" and "user_id" not in columns:
+            raise ValueError(f"{path} has no user id column")
+        if table == "xp_history":
+            return _import_history(conn, guild_id, path, header, chunks, replace)
+        pick = operator.itemgetter(*[header.index(c) for c in columns])
+        values = (lambda r: (pick(r),)) if len(columns) == 1 else pick
+        sql = _insert_sql(table, ["guild_id"] + columns)
+        guild_key = (str(guild_id),)
+        order = None
+        if table == "users":
+            user_idx = columns.index("user_id")
+            order = lambda v: str(v[user_idx])  # ids may be numbers in JSONL
+
+        count = 0
+        try:
+            # One transaction, so a failed import (or --replace) leaves the guild as it was
+            if replace:
+                conn.execute(f"DELETE FROM {table} WHERE guild_id = ?", guild_key)
+            batch = []
+            for rows in chunks:
+                batch.extend(map(values, rows))
+                if len(batch) >= IMPORT_BATCH:
+                    count += _insert_batch(conn, sql, guild_key, batch, order)
+                    batch = []
+            count += _insert_batch(conn, sql, guild_key, batch, order)
+            if table in CACHE_TABLES:
+                record_cache_changes(conn, {table: [guild_id]}, db.origin)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    if refresh and table in CACHE_TABLES:
+        db.refresh_guild(guild_id, [table])
+    print(f"✅ {table}: imported {count} rows from {path}")
+    return count
+
+
+def _insert_batch(conn, sql, guild_key, batch, order=None):
+    if order:
+        batch.sort(key=order)
+    conn.executemany(sql, (guild_key + row for row in batch))
+    return len(batch)
+
+
+def _import_history(conn, guild_id, path, header, chunks, replace):
+    # xp_history is a view over monthly tables, rows are routed by timestamp
+    missing = {"user_id", "xp", "timestamp"} - set(header)
+    if missing:
+        raise ValueError(f"{path} is missing {', '.join(sorted(missing))}")
+    user_idx, xp_idx, ts_idx = (header.index(c) for c in ("user_id", "xp", "timestamp"))
+    count = 0
+    try:
+        if replace:
+            history_partitions.delete_guild(conn, guild_id)
+        for rows in chunks:
+            count += history_partitions.insert_rows(
+                conn, [(r[user_idx], str(guild_id), r[xp_idx], r[ts_idx]) for r in rows]
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    print(f"✅ xp_history: imported {count} rows from {path}")
+    return count
+
+
+def _insert_sql(table, columns):
+    col_list = ", ".join(columns)
+    # Empty CSV cells become NULL rather than ''
+    placeholders = ", ".join("NULLIF(?, '')" for _ in columns)
+    if table == "users":
+        updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c not in ("user_id", "guild_id"))
+        # A file with only user ids adds the missing members and leaves existing ones alone
+        action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+        return (f"INSERT INTO users ({col_list}) VALUES ({placeholders}) "
+                f"ON CONFLICT(user_id, guild_id) {action}")
+    if table == "seasons":
+        return f"INSERT OR REPLACE INTO seasons ({col_list}) VALUES ({placeholders})"
+    return f"INSERT INTO {table} ({col_list}) VALUES ({placeholders})"
+
+
+def import_guild(db, guild_id, path, table=None, replace=False, refresh=True):
+    """Import an export directory, or a single file into `table` (default users)."""
+    if not os.path.isdir(path):
+        return {table or "users": import_table(db, guild_id, table or "users", path, replace, refresh)}
+    counts = {}
+    for name in TABLES:
+        for fmt in FORMATS:
+            for suffix in (f".{fmt}", f".{fmt}.gz"):
+                file_path = os.path.join(path, name + suffix)
+                if os.path.exists(file_path):
+                    counts[name] = import_table(db, guild_id, name, file_path, replace, refresh)
+    return counts
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Export or import one guild's leveling data")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("guild_id")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--table", choices=TABLES, help="table for a single-file import")
+    parser.add_argument("--replace", action="store_true", help="delete the guild's existing rows first")
+    parser.add_argument("--db", default="system.db")
+    parser.add_argument("--shards", default="0")
+    args = parser.parse_args()
+
+    shards = args.shards.strip().lower()
+    db = Database(args.db, shard_count=PER_GUILD_SHARDS if shards == "guild" else int(shards))
+    try:
+        if args.command == "export":
+            export_guild(db, args.guild_id, args.path, args.format, args.gzip)
+        else:
+            import_guild(db, args.guild_id, args.path, args.table, args.replace, refresh=False)
+    except Exception as e:
+        print(f"❌ {args.command.capitalize()} failed: {e}")
+        sys.exit(1)
+    finally:
+        db.stop_write_worker()
+
+
+if __name__ == "__main__":
+    _main()
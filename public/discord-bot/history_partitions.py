@@ -0,0 +1,293 @@
+"""Monthly partitions and compressed archives for xp_history.
+
+Each month of XP history lives in its own table (xp_history_2026_01, ...)
+in the guild's database file. `xp_history` is a view over all live months,
+so reads keep working unchanged; writes go to the month's table.
+
+Closed months can be archived into a gzip'd SQLite segment file next to the
+database and removed from it, restored later, or attached for an audit.
+Dropping a month is a DROP TABLE, or deleting its segment file.
+
+Usage:
+    python history_partitions.py list [--db system.db]
+    python history_partitions.py archive 2025-01 [--db system.db]
+    python history_partitions.py restore 2025-01 [--db system.db]
+    python history_partitions.py drop 2025-01 [--db system.db]
+
+With DB_SHARDS enabled, run it for each shard file.
+"""
+import argparse
+import glob
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+
+PREFIX = "xp_history_"
+COLUMNS = "user_id, guild_id, xp, timestamp"
+_MONTH_RE = re.compile(r"^\d{4}-\d{2}$")
+
+
+def month_of(timestamp_iso):
+    """'2026-10-19T12:00:00' -> '2026-10'"""
+    month = (timestamp_iso or "")[:7]
+    return month if _MONTH_RE.match(month) else datetime.now().strftime("%Y-%m")
+
+
+def table_for(month):
+    if not _MONTH_RE.match(month):
+        raise ValueError(f"Month must look like YYYY-MM, got {month!r}")
+    return PREFIX + month.replace("-", "_")
+
+
+def segment_path(db_path, month):
+    base, _ = os.path.splitext(db_path)
+    return f"{base}.history-{month}.db.gz"
+
+
+@contextmanager
+def _transaction(conn):
+    if conn.in_transaction:
+        # Join the caller's transaction
+        yield conn
+        return
+    previous = conn.isolation_level
+    conn.isolation_level = None
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.isolation_level = previous
+
+
+def live_months(conn, schema="main"):
+    rows = conn.execute(
+        f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table' AND name LIKE ? ESCAPE '\\'",
+        (PREFIX.replace("_", "\\_") + "%",)
+    ).fetchall()
+    return sorted(name[len(PREFIX):].replace("_", "-") for (name,) in rows)
+
+
+def archived_months(db_path):
+    base, _ = os.path.splitext(db_path)
+    pattern = f"{glob.escape(base)}.history-*.db.gz"
+    return sorted(os.path.basename(p)[len(os.path.basename(base)) + 9:-6] for p in glob.glob(pattern))
+
+
+def _create_partition(conn, month):
+    table = table_for(month)
+    conn.execute(f'''CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT,
+        guild_id TEXT,
+        xp INTEGER,
+        timestamp TEXT
+    )''')
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_guild_ts ON {table} (guild_id, timestamp)")
+    return table
+
+
+def _rebuild_view(conn):
+    months = live_months(conn)
+    if not months:
+        months = [datetime.now().strftime("%Y-%m")]
+        _create_partition(conn, months[0])
+    conn.execute("DROP VIEW IF EXISTS xp_history")
+    conn.execute("CREATE VIEW xp_history AS " + " UNION ALL ".join(
+        f"SELECT id, {COLUMNS} FROM {table_for(m)}" for m in months
+    ))
+
+
+def ensure_partition(conn, month):
+    """Create a month's table (and refresh the view) if it doesn't exist yet."""
+    if month in live_months(conn):
+        return table_for(month)
+    with _transaction(conn):
+        table = _create_partition(conn, month)
+        _rebuild_view(conn)
+    return table
+
+
+def setup(conn):
+    """Convert a legacy xp_history table into monthly partitions and create the view."""
+    kind = conn.execute("SELECT type FROM sqlite_master WHERE name = 'xp_history'").fetchone()
+    with _transaction(conn):
+        if kind and kind[0] == "table":
+            months = [r[0] for r in conn.execute("SELECT DISTINCT substr(timestamp, 1, 7) FROM xp_history")]
+            print(f"➕ Partitioning xp_history into {len(months)} monthly table(s)...")
+            for month in months:
+                target = month_of(month)
+                conn.execute(
+                    f"INSERT INTO {_create_partition(conn, target)} ({COLUMNS}) "
+                    f"SELECT {COLUMNS} FROM xp_history WHERE substr(timestamp, 1, 7) IS ?",
+                    (month,)
+                )
+            conn.execute("DROP TABLE xp_history")
+        _create_partition(conn, datetime.now().strftime("%Y-%m"))
+        _rebuild_view(conn)
+
+
+def insert_rows(conn, rows):
+    """Insert (user_id, guild_id, xp, timestamp) rows into their month tables."""
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(month_of(row[3]), []).append(row)
+    for month, month_rows in by_month.items():
+        table = ensure_partition(conn, month)
+        conn.executemany(f"INSERT INTO {table} ({COLUMNS}) VALUES (?, ?, ?, ?)", month_rows)
+    return sum(len(r) for r in by_month.values())
+
+
+def delete_guild(conn, guild_id):
+    """Delete a guild's history from every live month."""
+    return sum(
+        conn.execute(f"DELETE FROM {table_for(m)} WHERE guild_id = ?", (str(guild_id),)).rowcount
+        for m in live_months(conn)
+    )
+
+
+def prune_before(conn, cutoff_iso):
+    """Drop whole months before the cutoff and delete older rows in its month."""
+    cutoff_month = month_of(cutoff_iso)
+    deleted = 0
+    with _transaction(conn):
+        for month in live_months(conn):
+            if month < cutoff_month:
+                deleted += conn.execute(f"SELECT COUNT(*) FROM {table_for(month)}").fetchone()[0]
+                conn.execute(f"DROP TABLE {table_for(month)}")
+            elif month == cutoff_month:
+                deleted += conn.execute(
+                    f"DELETE FROM {table_for(month)} WHERE timestamp < ?", (cutoff_iso,)
+                ).rowcount
+        _rebuild_view(conn)
+    return deleted
+
+
+def archive_month(conn, db_path, month):
+    """Move a closed month into a compressed segment file. Returns rows archived."""
+    if month >= datetime.now().strftime("%Y-%m"):
+        raise ValueError("Only closed months can be archived")
+    if month not in live_months(conn):
+        raise ValueError(f"No live history for {month}")
+    segment = segment_path(db_path, month)
+    if os.path.exists(segment):
+        raise ValueError(f"{segment} already exists, restore it first")
+
+    raw = segment[:-3]
+    if os.path.exists(raw):
+        os.remove(raw)
+    conn.execute("ATTACH DATABASE ? AS segment", (raw,))
+    try:
+        conn.execute(f"CREATE TABLE segment.xp_history AS SELECT id, {COLUMNS} FROM {table_for(month)}")
+        conn.execute("CREATE INDEX segment.idx_xp_history_guild_user ON xp_history (guild_id, user_id)")
+        count = conn.execute("SELECT COUNT(*) FROM segment.xp_history").fetchone()[0]
+        conn.commit()
+    finally:
+        conn.execute("DETACH DATABASE segment")
+    with open(raw, "rb") as src, gzip.open(segment, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(raw)
+
+    with _transaction(conn):
+        conn.execute(f"DROP TABLE {table_for(month)}")
+        _rebuild_view(conn)
+    return count
+
+
+def _unpack(segment):
+    raw = segment[:-3]
+    if not os.path.exists(raw):
+        with gzip.open(segment, "rb") as src, open(raw + ".tmp", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(raw + ".tmp", raw)
+    return raw
+
+
+@contextmanager
+def attached_archive(conn, db_path, month):
+    """Attach an archived month for ad-hoc queries; yields the table name.
+
+    The segment is decompressed next to the archive on first use and kept
+    there until the month is restored or dropped.
+    """
+    raw = _unpack(segment_path(db_path, month))
+    alias = "archive_" + month.replace("-", "_")
+    conn.execute(f"ATTACH DATABASE ? AS {alias}", (raw,))
+    try:
+        yield f"{alias}.xp_history"
+    finally:
+        conn.execute(f"DETACH DATABASE {alias}")
+
+
+def restore_month(conn, db_path, month):
+    """Bring an archived month back into the live database. Returns rows restored."""
+    segment = segment_path(db_path, month)
+    if not os.path.exists(segment):
+        raise ValueError(f"No archive for {month}")
+    with attached_archive(conn, db_path, month) as archive:
+        with _transaction(conn):
+            table = _create_partition(conn, month)
+            count = conn.execute(f"INSERT INTO {table} ({COLUMNS}) SELECT {COLUMNS} FROM {archive}").rowcount
+            _rebuild_view(conn)
+    os.remove(segment[:-3])
+    os.remove(segment)
+    return count
+
+
+def drop_month(conn, db_path, month):
+    """Delete a month: its archive file if archived, otherwise its live table."""
+    segment = segment_path(db_path, month)
+    if os.path.exists(segment):
+        os.remove(segment)
+        if os.path.exists(segment[:-3]):
+            os.remove(segment[:-3])
+        return "archive"
+    if month in live_months(conn):
+        with _transaction(conn):
+            conn.execute(f"DROP TABLE {table_for(month)}")
+            _rebuild_view(conn)
+        return "table"
+    raise ValueError(f"No history for {month}")
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Manage monthly XP history partitions")
+    parser.add_argument("command", choices=["list", "archive", "restore", "drop"])
+    parser.add_argument("month", nargs="?", help="YYYY-MM")
+    parser.add_argument("--db", default="system.db")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, timeout=30.0)
+    conn.execute("PRAGMA busy_timeout=30000")
+    try:
+        if args.command == "list":
+            for month in live_months(conn):
+                count = conn.execute(f"SELECT COUNT(*) FROM {table_for(month)}").fetchone()[0]
+                print(f"{month}  live      {count:,} rows")
+            for month in archived_months(args.db):
+                size = os.path.getsize(segment_path(args.db, month))
+                print(f"{month}  archived  {size / 1024:,.0f} KB")
+            return
+        if not args.month:
+            parser.error("month is required")
+        if args.command == "archive":
+            print(f"✅ Archived {archive_month(conn, args.db, args.month):,} rows to {segment_path(args.db, args.month)}")
+        elif args.command == "restore":
+            print(f"✅ Restored {restore_month(conn, args.db, args.month):,} rows for {args.month}")
+        else:
+            print(f"✅ Dropped {args.month} ({drop_month(conn, args.db, args.month)})")
+    except ValueError as e:
+        print(f"❌ {e}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,195 @@
+"""Hot per-member XP state: cooldown, ASSASSIN combo and HEALER mention timers.
+
+Every member's timers are loaded from the users table at startup, so the
+per-message gates (XP cooldown, combo expiry, mention cooldown) are answered
+from memory and a cooldown rejection, the most common outcome for a message,
+costs no database work. Awards update the state in place; combo and mention
+changes are written back to SQLite in batches shortly afterwards
+(last_xp_time is already part of the XP award's UPDATE).
+
+Timestamps are kept as epoch seconds and stored as ISO strings, like the
+rest of the users table.
+"""
+import threading
+from datetime import datetime
+
+COMBO_EXPIRY = 300  # seconds without a message before an ASSASSIN combo resets
+COLUMNS = "guild_id, user_id, class, last_xp_time, message_combo, last_message_time, last_mention_xp"
+FLUSH_SQL = (
+    "UPDATE users SET message_combo = ?, last_message_time = ?, last_mention_xp = ? "
+    "WHERE user_id = ? AND guild_id = ?"
+)
+
+
+def _ts(value):
+    """ISO timestamp column -> epoch seconds (0.0 when unset or unreadable)."""
+    if not value:
+        return 0.0
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts).isoformat() if ts else None
+
+
+class MemberState:
+    __slots__ = ('user_class', 'last_xp', 'combo', 'last_message', 'last_mention')
+
+    def __init__(self, user_class=None, last_xp=0.0, combo=0, last_message=0.0, last_mention=0.0):
+        self.user_class = user_class
+        self.last_xp = last_xp
+        self.combo = combo
+        self.last_message = last_message
+        self.last_mention = last_mention
+
+    def can_gain_xp(self, cooldown, now):
+        return not self.last_xp or now - self.last_xp >= cooldown
+
+    def combo_at(self, now):
+        """Current combo, 0 once it has expired."""
+        if self.last_message and now - self.last_message > COMBO_EXPIRY:
+            return 0
+        return self.combo
+
+
+class MemberStateTable:
+    def __init__(self, db, flush_delay=5.0):
+        self.db = db
+        self.flush_delay = flush_delay
+        self._members = {}  # guild_id -> {user_id: MemberState}
+        self._dirty = set()  # (guild_id, user_id) with combo / mention changes not yet written
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def _read(self, path, guild_ids=None):
+        with self.db.get_conn(path) as conn:
+            for sql, params in self.db.guild_selects(f"SELECT {COLUMNS} FROM users", guild_ids):
+                cursor = conn.execute(sql, params)
+                while True:
+                    rows = cursor.fetchmany(5000)
+                    if not rows:
+                        break
+                    yield from self.db.owned_rows(path, rows)
+
+    def load(self, rows):
+        """Merge users rows (in COLUMNS order) into the table.
+
+        Timers only move forward: a row older than what is in memory (e.g. read
+        while our own award was still queued) doesn't roll a member back, and
+        members with unwritten changes keep them.
+        """
+        count = 0
+        with self._lock:
+            for guild_id, user_id, user_class, last_xp, combo, last_message, last_mention in rows:
+                guild_id, user_id = str(guild_id), str(user_id)
+                members = self._members.setdefault(guild_id, {})
+                state = members.get(user_id)
+                if state is None:
+                    members[user_id] = MemberState(
+                        user_class, _ts(last_xp), combo or 0, _ts(last_message), _ts(last_mention)
+                    )
+                else:
+                    state.user_class = user_class
+                    state.last_xp = max(state.last_xp, _ts(last_xp))
+                    if (guild_id, user_id) not in self._dirty:
+                        if _ts(last_message) >= state.last_message:
+                            state.combo = combo or 0
+                            state.last_message = _ts(last_message)
+                        state.last_mention = max(state.last_mention, _ts(last_mention))
+                count += 1
+        return count
+
+    def load_all(self):
+        """Load every member from every database file."""
+        count = sum(self.load(self._read(path)) for path in self.db.all_db_paths())
+        print(f"✅ Loaded XP timers for {count:,} member(s)")
+
+    def reload(self, path, guild_ids=None):
+        """Pick up timers another process wrote to one database file (some or all guilds)."""
+        self.load(self._read(path, guild_ids))
+
+    def get(self, guild_id, user_id):
+        """A member's state, or None if they have no users row yet."""
+        members = self._members.get(str(guild_id))
+        return members.get(str(user_id)) if members else None
+
+    def ensure(self, guild_id, user_id):
+        """A member's state, created empty for a new user."""
+        state = self.get(guild_id, user_id)
+        if state is None:
+            with self._lock:
+                members = self._members.setdefault(str(guild_id), {})
+                state = members.setdefault(str(user_id), MemberState())
+        return state
+
+    def overlay(self, guild_id, user_id, user):
+        """Replace a users row dict's timer columns with the in-memory values."""
+        state = self.get(guild_id, user_id)
+        if state is not None:
+            user['class'] = state.user_class
+            user['last_xp_time'] = _iso(state.last_xp) or user.get('last_xp_time')
+            user['message_combo'] = state.combo
+            user['last_message_time'] = _iso(state.last_message)
+            user['last_mention_xp'] = _iso(state.last_mention)
+        return user
+
+    def _mark_dirty(self, guild_id, user_id):
+        # Caller holds the lock
+        self._dirty.add((str(guild_id), str(user_id)))
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def record_award(self, guild_id, user_id, now, advance_combo=False, mention=False):
+        """Apply a message XP award at `now` (epoch seconds); returns the member's state."""
+        state = self.ensure(guild_id, user_id)
+        with self._lock:
+            state.last_xp = now
+            if advance_combo:
+                state.combo = state.combo_at(now) + 1
+                state.last_message = now
+            if mention:
+                state.last_mention = now
+            if advance_combo or mention:
+                self._mark_dirty(guild_id, user_id)
+        return state
+
+    def set_class(self, guild_id, user_id, user_class):
+        self.ensure(guild_id, user_id).user_class = user_class
+
+    def set_combo(self, guild_id, user_id, combo, last_message=None):
+        state = self.ensure(guild_id, user_id)
+        with self._lock:
+            state.combo = combo
+            if last_message is not None:
+                state.last_message = last_message
+            self._mark_dirty(guild_id, user_id)
+
+    def set_last_mention(self, guild_id, user_id, when):
+        state = self.ensure(guild_id, user_id)
+        with self._lock:
+            state.last_mention = when
+            self._mark_dirty(guild_id, user_id)
+
+    def flush(self):
+        """Queue the combo / mention columns of every member changed since the last flush."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            dirty, self._dirty = self._dirty, set()
+            by_guild = {}
+            for guild_id, user_id in dirty:
+                state = self._members.get(guild_id, {}).get(user_id)
+                if state is not None:
+                    by_guild.setdefault(guild_id, []).append((
+                        FLUSH_SQL,
+                        (state.combo, _iso(state.last_message), _iso(state.last_mention), user_id, guild_id)
+                    ))
+            # One transaction per guild, queued under the lock so flushes stay in order
+            for guild_id, statements in by_guild.items():
+                self.db.queue_transaction(statements, guild_id=guild_id)
@@ -0,0 +1,216 @@
+"""Authoritative in-memory guild settings with write-behind persistence.
+
+All guild settings are loaded once at startup. Readers get an immutable,
+versioned snapshot straight from memory; writers go through mutate(), which
+applies the change under a lock and swaps in a new snapshot, so two quick
+admin edits can never overwrite each other. Changed guilds are written back
+to SQLite as full rows shortly afterwards.
+"""
+import json
+import threading
+from collections.abc import Mapping
+from types import MappingProxyType
+
+from write_scheduler import INTERACTIVE
+
+DEFAULT_SETTINGS = {
+    'xp_min': 15,
+    'xp_max': 25,
+    'xp_cooldown': 60,
+    'voice_xp_enabled': True,
+    'voice_xp_rate': 5,
+    'daily_enabled': True,
+    'daily_reward': 500,
+    'levelup_messages': True,
+    'levelup_channel': None,
+    'blacklisted_channels': [],
+    'whitelisted_channels': [],
+    'role_multipliers': {},
+    'prefix_commands_enabled': True,
+    'xp_formula': None,
+}
+COLUMNS = list(DEFAULT_SETTINGS)
+BOOL_FIELDS = {'voice_xp_enabled', 'daily_enabled', 'levelup_messages', 'prefix_commands_enabled'}
+LIST_FIELDS = {'blacklisted_channels', 'whitelisted_channels'}
+DICT_FIELDS = {'role_multipliers'}
+
+
+class SettingsSnapshot(Mapping):
+    """Read-only view of one guild's settings at a given version."""
+    __slots__ = ('_data', 'version')
+
+    def __init__(self, data, version):
+        self._data = data
+        self.version = version
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f"SettingsSnapshot(v{self.version}, {self._data!r})"
+
+    def to_dict(self):
+        """Mutable deep copy, for building the next version."""
+        data = dict(self._data)
+        for key in LIST_FIELDS:
+            data[key] = list(data[key])
+        for key in DICT_FIELDS:
+            data[key] = dict(data[key])
+        return data
+
+
+def _freeze(guild_id, data, version):
+    frozen = {'guild_id': str(guild_id)}
+    for key, default in DEFAULT_SETTINGS.items():
+        value = data.get(key, default)
+        if key in BOOL_FIELDS:
+            value = True if value is None else bool(value)
+        elif key in LIST_FIELDS:
+            value = tuple(str(v) for v in value or ())
+        elif key in DICT_FIELDS:
+            value = MappingProxyType({str(k): float(v) for k, v in (value or {}).items()})
+        frozen[key] = value
+    return SettingsSnapshot(frozen, version)
+
+
+def _decode_row(data):
+    for key in LIST_FIELDS | DICT_FIELDS:
+        data[key] = json.loads(data[key]) if data.get(key) else None
+    return data
+
+
+def _encode_row(snapshot):
+    row = [snapshot['guild_id']]
+    for key in COLUMNS:
+        value = snapshot[key]
+        if key in BOOL_FIELDS:
+            value = 1 if value else 0
+        elif key in LIST_FIELDS:
+            value = json.dumps(list(value))
+        elif key in DICT_FIELDS:
+            value = json.dumps(dict(value))
+        row.append(value)
+    return tuple(row)
+
+
+UPSERT_SQL = (
+    f"INSERT INTO guild_settings (guild_id, {', '.join(COLUMNS)}) "
+    f"VALUES (?, {', '.join('?' for _ in COLUMNS)}) "
+    f"ON CONFLICT(guild_id) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in COLUMNS)}"
+)
+
+
+class GuildSettingsStore:
+    def __init__(self, db, flush_delay=2.0):
+        self.db = db
+        self.flush_delay = flush_delay
+        self._snapshots = {}
+        self._dirty = set()
+        self._flushing = {}  # guild_id -> flushed writes not yet committed
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def _read(self, path, guild_ids=None):
+        rows = []
+        with self.db.get_conn(path) as conn:
+            for sql, params in self.db.guild_selects("SELECT * FROM guild_settings", guild_ids):
+                cursor = conn.execute(sql, params)
+                names = [d[0] for d in cursor.description]
+                rows += [dict(zip(names, row)) for row in cursor.fetchall()]
+        decoded = (_decode_row(data) for data in rows)
+        return {str(data['guild_id']): data for data in decoded if self.db.owns(path, data['guild_id'])}
+
+    def load_all(self):
+        """Load every guild's settings from every database file."""
+        loaded = {}
+        for path in self.db.all_db_paths():
+            for guild_id, data in self._read(path).items():
+                loaded[guild_id] = _freeze(guild_id, data, 1)
+        with self._lock:
+            self._snapshots = loaded
+        print(f"✅ Loaded settings for {len(loaded)} guild(s)")
+
+    def reload(self, path, guild_ids=None):
+        """Pick up settings another process wrote to one database file (some or all guilds).
+
+        Guilds with edits not yet written (waiting to be flushed, or flushed but
+        not committed) keep them; the write overwrites the other process's row,
+        as it would have anyway.
+        """
+        rows = self._read(path, guild_ids)
+        with self._lock:
+            keep = self._dirty | set(self._flushing)
+            candidates = list(self._snapshots) if guild_ids is None else [str(g) for g in guild_ids]
+            for guild_id in candidates:
+                if (guild_id in self._snapshots and guild_id not in rows and guild_id not in keep
+                        and self.db.owns(path, guild_id)):
+                    del self._snapshots[guild_id]
+            for guild_id, data in rows.items():
+                if guild_id in keep:
+                    continue
+                current = self.get(guild_id)
+                snapshot = _freeze(guild_id, data, current.version + 1)
+                if dict(snapshot) != dict(current):
+                    self._snapshots[guild_id] = snapshot
+
+    def get(self, guild_id):
+        """Current snapshot for a guild (defaults, version 0, if never configured)."""
+        guild_id = str(guild_id)
+        snapshot = self._snapshots.get(guild_id)
+        if snapshot is None:
+            snapshot = _freeze(guild_id, {}, 0)
+        return snapshot
+
+    def mutate(self, guild_id, change):
+        """Atomically apply change(settings_dict) and persist the result write-behind.
+
+        change receives a mutable copy of the current settings and edits it in
+        place. Returns the new snapshot.
+        """
+        guild_id = str(guild_id)
+        with self._lock:
+            current = self.get(guild_id)
+            data = current.to_dict()
+            change(data)
+            unknown = set(data) - set(COLUMNS) - {'guild_id'}
+            if unknown:
+                raise ValueError(f"Unknown guild setting(s): {', '.join(sorted(unknown))}")
+            snapshot = _freeze(guild_id, data, current.version + 1)
+            self._snapshots[guild_id] = snapshot
+            self._dirty.add(guild_id)
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return snapshot
+
+    def update(self, guild_id, **values):
+        """Set one or more settings."""
+        return self.mutate(guild_id, lambda data: data.update(values))
+
+    def flush(self):
+        """Queue a full-row write for every guild changed since the last flush."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            dirty, self._dirty = self._dirty, set()
+            # Queued under the lock so an older version can never land after a newer one
+            for guild_id in dirty:
+                self._flushing[guild_id] = self._flushing.get(guild_id, 0) + 1
+                self.db.queue_write(
+                    UPSERT_SQL, _encode_row(self._snapshots[guild_id]), guild_id=guild_id, lane=INTERACTIVE,
+                    on_commit=lambda guild_id=guild_id: self._committed(guild_id)
+                )
+
+    def _committed(self, guild_id):
+        with self._lock:
+            left = self._flushing.pop(guild_id) - 1
+            if left:
+                self._flushing[guild_id] = left
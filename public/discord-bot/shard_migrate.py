@@ -0,0 +1,107 @@
+"""Split an existing single-file system.db into per-guild shard files.
+
+Usage:
+    python shard_migrate.py system.db 8        # 8 hash buckets
+    python shard_migrate.py system.db guild    # one file per guild
+
+Rows are copied, not moved: the source file keeps them and the bot ignores
+the copies of moved guilds' rows in it. The source stays the bot's main
+file, so like a bot start this brings its schema up to date (xp_history
+becomes monthly tables behind a view, new tables and columns are added);
+copy it first if you want a backup of the file as it was. Run this while
+the bot is stopped, then set DB_SHARDS to the same value in .env.
+"""
+import os
+import sqlite3
+import sys
+
+import history_partitions
+from database import Database, PER_GUILD_SHARDS, shard_path_for
+
+# Tables that are keyed by guild and therefore move into the guild's shard
+GUILD_TABLES = ["users", "guild_settings", "xp_history", "seasons"]
+CHUNK_SIZE = 5000
+
+
+def parse_shard_count(value):
+    value = str(value).strip().lower()
+    return PER_GUILD_SHARDS if value == "guild" else int(value)
+
+
+def split_database(src_path, shard_count, force=False):
+    """Copy every guild's rows from src_path into the shard that owns the guild.
+
+    Returns a dict of {table: rows_copied}.
+    """
+    if not shard_count:
+        raise ValueError("shard_count must be a positive number or 'guild'")
+    if not os.path.exists(src_path):
+        raise FileNotFoundError(src_path)
+
+    src = sqlite3.connect(src_path)
+    guild_ids = [row[0] for row in src.execute(
+        "SELECT DISTINCT guild_id FROM users UNION SELECT guild_id FROM guild_settings"
+    )]
+
+    existing = {shard_path_for(src_path, g, shard_count) for g in guild_ids}
+    existing = [p for p in existing if os.path.exists(p)]
+    if existing and not force:
+        raise RuntimeError(f"Shard files already exist ({len(existing)}), pass --force to merge into them")
+
+    # Creating the Database initialises the schema in every shard file, and
+    # upgrades the source's (it stays the main file); rows are still read through src
+    db = Database(src_path, shard_count=shard_count)
+    copied = {}
+    try:
+        for table in GUILD_TABLES:
+            columns = [col[1] for col in src.execute(f"PRAGMA table_info({table})")]
+            if not columns:
+                continue
+            # xp_history ids are per-file, let each shard assign its own
+            if table == "xp_history":
+                columns = [c for c in columns if c != "id"]
+            col_list = ", ".join(columns)
+            placeholders = ", ".join("?" for _ in columns)
+            guild_idx = columns.index("guild_id")
+
+            shard_conns = {}
+            cursor = src.execute(f"SELECT {col_list} FROM {table}")
+            count = 0
+            while True:
+                rows = cursor.fetchmany(CHUNK_SIZE)
+                if not rows:
+                    break
+                by_shard = {}
+                for row in rows:
+                    by_shard.setdefault(db.shard_path(row[guild_idx]), []).append(row)
+                for path, shard_rows in by_shard.items():
+                    conn = shard_conns.get(path)
+                    if conn is None:
+                        conn = shard_conns[path] = sqlite3.connect(path)
+                    if table == "xp_history":
+                        # (user_id, guild_id, xp, timestamp) rows go to their month's table
+                        history_partitions.insert_rows(conn, shard_rows)
+                    else:
+                        conn.executemany(
+                            f"INSERT OR REPLACE INTO {table} ({col_list}) VALUES ({placeholders})",
+                            shard_rows
+                        )
+                count += len(rows)
+
+            for conn in shard_conns.values():
+                conn.commit()
+                conn.close()
+            copied[table] = count
+            print(f"✅ {table}: {count} rows split into {len(shard_conns)} shard(s)")
+    finally:
+        db.stop_write_worker()
+        src.close()
+    return copied
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if a != "--force"]
+    if len(args) != 2:
+        print(__doc__)
+        sys.exit(1)
+    split_database(args[0], parse_shard_count(args[1]), force="--force" in sys.argv)
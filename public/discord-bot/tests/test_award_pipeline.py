@@ -0,0 +1,107 @@
+import asyncio
+from types import SimpleNamespace
+
+import award_pipeline
+from award_pipeline import AwardPipeline
+
+GUILD = SimpleNamespace(id=6006)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.listeners = []
+        self.known = []
+        self.xp = {}
+
+    def add_xp_listener(self, callback):
+        self.listeners.append(callback)
+
+    def set_xp(self, user_id, guild_id, amount):
+        self.xp[str(user_id)] = amount
+        for callback in self.listeners:
+            callback(str(guild_id), str(user_id))
+
+    def load_message_contexts(self, guild, entries, known):
+        self.known.append(set(known))
+        return [
+            {'user': known.get(str(author.id)) or {'user_id': str(author.id), 'guild_id': str(guild.id),
+                                                    'xp': self.xp.get(str(author.id), 0)},
+             'can_gain_xp': True}
+            for author, channel in entries
+        ]
+
+    def refresh_message_context(self, context):
+        pass
+
+    def award_statements(self, context, xp, advance_combo=False, mention=False):
+        context['user'] = dict(context['user'], xp=context['user']['xp'] + xp)
+        return [("UPDATE users SET xp = xp + ?", (xp,))]
+
+    def queue_transaction(self, statements, guild_id=None):
+        pass
+
+
+def _message(user_id):
+    return SimpleNamespace(guild=GUILD, author=SimpleNamespace(id=user_id), channel=None)
+
+
+async def _settle(check):
+    for _ in range(200):
+        if check():
+            return
+        await asyncio.sleep(0.01)
+
+
+def test_slow_follow_ups_never_block_awards(monkeypatch):
+    monkeypatch.setattr(award_pipeline, "FOLLOWUP_QUEUE_SIZE", 2)
+
+    async def run():
+        stuck = asyncio.Event()
+        followed = []
+
+        async def on_awarded(message, context, award, old_xp, new_xp):
+            await stuck.wait()  # e.g. a rate-limited role edit
+            followed.append((message.author.id, old_xp, new_xp))
+
+        synced = []
+        pipeline = AwardPipeline(FakeDatabase(), lambda message, context: {'xp': 10}, on_awarded, workers=1,
+                                 on_queued=lambda message, award: synced.append(award['xp']))
+        pipeline.start()
+        for n in [1, 2, 3, 4, 5, 4, 4, 6, 5, 4]:
+            assert pipeline.submit(_message(n))
+            await asyncio.sleep(0.01)
+        await _settle(lambda: pipeline.awarded == 10)
+        assert pipeline.awarded == 10
+        # One follow-up running, two queued; the rest were merged per member
+        assert pipeline.followups_merged == 7
+        assert synced == [10] * 10  # web sync bookkeeping runs for every award
+
+        stuck.set()
+        await _settle(lambda: len(followed) == 6)
+        # Every member's level-up check still runs, from before their first merged award
+        assert followed == [(1, 0, 10), (2, 0, 10), (3, 0, 10), (4, 0, 40), (5, 0, 20), (6, 0, 10)]
+        for task in pipeline._tasks:
+            task.cancel()
+
+    asyncio.run(run())
+
+
+def test_xp_changes_outside_the_pipeline_drop_the_remembered_row():
+    async def run():
+        db = FakeDatabase()
+        pipeline = AwardPipeline(db, lambda message, context: {'xp': 10}, lambda *result: asyncio.sleep(0), workers=1)
+        pipeline.start()
+        pipeline.submit(_message(1))
+        await _settle(lambda: pipeline.awarded == 1)
+        pipeline.submit(_message(1))
+        await _settle(lambda: pipeline.awarded == 2)
+        assert db.known[-1] == {"1"}  # trusted while its write may be queued
+
+        db.set_xp(1, GUILD.id, 5000)  # /setxp
+        pipeline.submit(_message(1))
+        await _settle(lambda: pipeline.awarded == 3)
+        assert db.known[-1] == set()
+        for task in pipeline._tasks:
+            task.cancel()
+
+    asyncio.run(run())
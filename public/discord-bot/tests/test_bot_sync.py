@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+
+import web_cache
+from bot_sync import NOT_LINKED, BotSyncClient
+from web_cache import LinkStatusCache, WebResponseCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeSession:
+    """Answers bot-sync posts from a dict of action -> (status, result) and records them."""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.posts = []
+        self.hold = {}  # action -> Event that keeps its requests in flight
+
+    async def post_json(self, url, payload, headers=None, priority=None):
+        self.posts.append(payload)
+        if payload["action"] in self.hold:
+            await self.hold[payload["action"]].wait()
+        if payload["action"] == "batch":
+            results = [dict(zip(("status", "result"), self.answers[item["action"]])) for item in payload["items"]]
+            return 200, {"success": True, "results": results}
+        return self.answers[payload["action"]]
+
+
+@pytest.fixture(autouse=True)
+def credentials(monkeypatch):
+    # config.py (imported for the request headers) refuses to load without them
+    for name in ("DISCORD_TOKEN", "SUPABASE_URL", "SUPABASE_KEY", "BOT_SYNC_SECRET", "SUPABASE_SERVICE_ROLE_KEY"):
+        monkeypatch.setenv(name, "test")
+
+
+def _client(answers, **kwargs):
+    return BotSyncClient(session=FakeSession(answers), **kwargs)
+
+
+def test_reads_are_cached_until_the_user_changes_something(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(web_cache, "time", clock)
+
+    async def run():
+        client = _client({"get_quests": (200, {"quests": [1]}), "complete_quest": (200, {"success": True})})
+        assert await client.call("5", "get_quests") == (200, {"quests": [1]})
+        assert await client.call("5", "get_quests") == (200, {"quests": [1]})
+        assert len(client.session.posts) == 1 and client.cache.hits == 1
+
+        await client.call("5", "complete_quest", {"quest_index": 0})
+        await client.call("5", "get_quests")
+        assert [p["action"] for p in client.session.posts] == ["get_quests", "complete_quest", "get_quests"]
+
+        clock.now += web_cache.TTLS["get_quests"]
+        await client.call("5", "get_quests")
+        assert len(client.session.posts) == 4  # expired
+
+    asyncio.run(run())
+
+
+def test_a_read_in_flight_during_a_change_is_not_cached():
+    async def run():
+        client = _client({"get_habits": (200, {"habits": ["old"]}), "complete_habit": (200, {"success": True})})
+        held = client.session.hold["get_habits"] = asyncio.Event()
+        read = asyncio.create_task(client.call("5", "get_habits"))
+        while not client.session.posts:
+            await asyncio.sleep(0)
+        await client.call("5", "complete_habit", {"habit_index": 0})  # lands while the read is out
+        held.set()
+        assert await read == (200, {"habits": ["old"]})
+
+        await client.call("5", "get_habits")
+        assert [p["action"] for p in client.session.posts] == ["get_habits", "complete_habit", "get_habits"]
+
+    asyncio.run(run())
+
+
+def test_unlinked_members_are_answered_without_asking(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(web_cache, "time", clock)
+
+    async def run():
+        not_linked = (404, {"success": False, "error": NOT_LINKED})
+        client = _client({"get_streak": not_linked, "verify_link": (200, {"linked": False})},
+                         links=LinkStatusCache(unlinked_ttl=300))
+        assert await client.call("9", "get_streak") == not_linked
+        assert await client.call("9", "get_streak") == not_linked
+        assert len(client.session.posts) == 1 and client.links.get("9") is False
+
+        # An explicit link check always asks, so a member who just linked is picked up
+        client.session.answers["verify_link"] = (200, {"linked": True})
+        await client.call("9", "verify_link")
+        assert client.links.get("9") is True
+        client.session.answers["get_streak"] = (200, {"streak": 3})
+        assert await client.call("9", "get_streak") == (200, {"streak": 3})
+
+        # Forgotten after the TTL
+        client.links.set("9", False)
+        clock.now += 301
+        assert client.links.get("9") is None
+
+    asyncio.run(run())
+
+
+def test_batch_answers_cached_and_unlinked_items_locally():
+    async def run():
+        client = _client({"get_stats": (200, {"level": 3}), "add_xp": (200, {"success": True})})
+        client.links.set("2", False)
+        await client.call("1", "get_stats")
+        answers = await client.batch([("1", "get_stats", None), ("2", "get_stats", None), ("3", "add_xp", {"xp": 5})])
+        assert answers == [(200, {"level": 3}), (404, {"success": False, "error": NOT_LINKED}),
+                           (200, {"success": True})]
+        assert client.session.posts[-1] == {"action": "batch",
+                                            "items": [{"discord_id": "3", "action": "add_xp", "data": {"xp": 5}}]}
+
+    asyncio.run(run())
+
+
+def test_response_cache_evicts_the_least_recently_used():
+    cache = WebResponseCache(max_entries=2)
+    for user in ("a", "b"):
+        cache.put(user, "get_quests", {"user": user}, cache.begin())
+    assert cache.get("a", "get_quests") == {"user": "a"}
+    cache.put("c", "get_quests", {"user": "c"}, cache.begin())
+    assert cache.get("b", "get_quests") is None
+    assert cache.get("a", "get_quests") == {"user": "a"}
@@ -0,0 +1,74 @@
+import sqlite3
+import time
+
+from database import Database
+
+GUILD = "4004"
+OTHER = "4005"
+
+
+def _wait_for(check, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return True
+        time.sleep(0.05)
+    return check()
+
+
+def test_only_other_processes_changes_refresh_and_only_their_guilds(tmp_path):
+    path = str(tmp_path / "system.db")
+    bot, script = Database(path), Database(path)
+    refreshed = []
+    try:
+        bot.add_invalidation_listener('users', lambda db_path, guild_ids: refreshed.append(guild_ids))
+        bot.create_user("1", GUILD, wait=False)
+        bot.add_xp("1", GUILD, 100)
+        bot.create_user("1", OTHER, wait=False)
+        assert _wait_for(lambda: bot.get_server_aggregates(GUILD)["total_xp"] == 100)
+        time.sleep(1.5)  # a couple of idle polls
+        assert refreshed == []
+
+        script.create_user("2", GUILD, wait=False)
+        script.add_xp("2", GUILD, 50)
+        assert _wait_for(lambda: bot.get_server_aggregates(GUILD)["total_xp"] == 150)
+        assert {GUILD} in refreshed and all(guilds == {GUILD} for guilds in refreshed)
+
+        with sqlite3.connect(path) as conn:
+            assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger'").fetchone()[0] == 0
+    finally:
+        script.stop_write_worker()
+        bot.stop_write_worker()
+
+
+def test_reload_keeps_queued_xp(tmp_path):
+    db = Database(str(tmp_path / "system.db"))
+    try:
+        db.create_user("1", GUILD, wait=False)
+        # Reloads on the write worker, interleaved with queued awards
+        for _ in range(200):
+            db.add_xp("1", GUILD, 5)
+            db.refresh_guild(GUILD, ["users"])
+        db.stop_write_worker()
+        assert db.get_server_aggregates(GUILD)["total_xp"] == 1000
+    finally:
+        db.stop_write_worker()
+
+
+def test_flushed_settings_survive_a_reload_until_committed(tmp_path):
+    path = str(tmp_path / "system.db")
+    db = Database(path)
+    blocker = sqlite3.connect(path, isolation_level=None)
+    try:
+        blocker.execute("BEGIN IMMEDIATE")  # the write worker can't commit yet
+        db.settings.update(GUILD, xp_min=40)
+        db.settings.flush()
+        db.settings.reload(path, [GUILD])
+        assert db.get_guild_settings(GUILD)["xp_min"] == 40
+        blocker.execute("COMMIT")
+        db.stop_write_worker()
+        db.settings.reload(path, [GUILD])
+        assert db.get_guild_settings(GUILD)["xp_min"] == 40
+    finally:
+        blocker.close()
+        db.stop_write_worker()
@@ -0,0 +1,58 @@
+import threading
+
+import consistency
+from database import Database
+
+GUILD = "2002"
+
+
+def test_users_repair_keeps_awards_made_during_it(tmp_path):
+    db = Database(str(tmp_path / "system.db"))
+    try:
+        for n in range(20):
+            db.create_user(str(n), GUILD, wait=False)
+            db.add_xp(str(n), GUILD, 10)
+        db.adjust_xp("0", GUILD, 50)  # no history behind it: 50 XP of drift
+        db.stop_write_worker()
+        db.start_write_worker()
+
+        (_, drifts, _), = consistency.check(db, [GUILD])
+        assert [(d.user_id, d.users_xp, d.history_xp) for d in drifts] == [("0", 60, 10)]
+
+        # Awards for the same user keep arriving while the repair is queued
+        awards = threading.Thread(target=lambda: [db.add_xp("0", GUILD, 5) for _ in range(50)])
+        awards.start()
+        assert consistency.repair(db, drifts, "users") == 1
+        awards.join()
+        db.stop_write_worker()
+
+        user = db.get_user("0", GUILD)
+        assert user["xp"] == 10 + 50 * 5
+        assert db.get_server_aggregates(GUILD)["total_xp"] == 19 * 10 + user["xp"]
+        (_, drifts, _), = consistency.check(db, [GUILD])
+        assert drifts == []
+    finally:
+        db.stop_write_worker()
+
+
+def test_daily_and_set_xp_keep_history_in_step(tmp_path):
+    db = Database(str(tmp_path / "system.db"))
+    try:
+        db.init_guild_settings(GUILD)
+        db.update_guild_settings(GUILD, daily_enabled=1, daily_reward=100)
+        for n in range(3):
+            db.create_user(str(n), GUILD, wait=False)
+            db.add_xp(str(n), GUILD, 10)
+        db.stop_write_worker()
+        db.start_write_worker()
+
+        assert db.claim_daily("0", GUILD) == (True, 100)
+        db.set_xp("1", GUILD, 500)
+        db.set_xp("2", GUILD, 4)
+        db.stop_write_worker()
+
+        assert [db.get_user(str(n), GUILD)["xp"] for n in range(3)] == [110, 500, 4]
+        (_, drifts, _), = consistency.check(db, [GUILD])
+        assert drifts == []
+    finally:
+        db.stop_write_worker()
@@ -0,0 +1,40 @@
+import guild_transfer
+from database import Database
+
+GUILD = "5005"
+
+
+def test_import_of_user_ids_only_adds_missing_members(tmp_path):
+    db = Database(str(tmp_path / "system.db"))
+    try:
+        db.create_user("1", GUILD, wait=False)
+        db.set_xp("1", GUILD, 300)
+        db.stop_write_worker()
+        db.start_write_worker()
+
+        ids = tmp_path / "ids.csv"
+        ids.write_text("user_id\n1\n2\n")
+        assert guild_transfer.import_guild(db, GUILD, str(ids)) == {"users": 2}
+        db.stop_write_worker()
+
+        assert db.get_user("1", GUILD)["xp"] == 300
+        assert db.get_user("2", GUILD)["xp"] == 0
+        assert db.get_server_aggregates(GUILD)["total_users"] == 2
+    finally:
+        db.stop_write_worker()
+
+
+def test_import_sorts_batches_and_updates_existing_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(guild_transfer, "IMPORT_BATCH", 3)
+    db = Database(str(tmp_path / "system.db"))
+    try:
+        users = tmp_path / "users.jsonl"
+        users.write_text("".join(f'{{"id": {n}, "exp": {n * 10}}}\n' for n in (9, 4, 7, 1, 8, 4)))
+        assert guild_transfer.import_guild(db, GUILD, str(users)) == {"users": 6}
+        db.stop_write_worker()
+        with db.get_conn(db.db_path) as conn:
+            rows = conn.execute("SELECT user_id, xp FROM users WHERE guild_id = ? ORDER BY user_id", (GUILD,)).fetchall()
+        assert rows == [("1", 10), ("4", 40), ("7", 70), ("8", 80), ("9", 90)]
+        assert db.get_server_aggregates(GUILD)["total_xp"] == 290
+    finally:
+        db.stop_write_worker()
@@ -0,0 +1,51 @@
+import random
+
+import guild_stats
+from database import Database
+from guild_stats import RankIndex
+
+GUILD = "3003"
+
+
+def test_rank_and_window_agree_on_ties(tmp_path):
+    db = Database(str(tmp_path / "system.db"))
+    try:
+        # Three users tied at 200 XP between one above and two below
+        for user_id, xp in [("10", 500), ("31", 200), ("23", 200), ("27", 200), ("40", 100), ("15", 100)]:
+            db.create_user(user_id, GUILD, wait=False)
+            db.set_xp(user_id, GUILD, xp)
+        db.stop_write_worker()
+
+        expected = ["10", "23", "27", "31", "15", "40"]
+        assert [row[0] for row in db.get_leaderboard(GUILD, limit=10)] == expected
+        for position, user_id in enumerate(expected, start=1):
+            assert db.get_rank(user_id, GUILD) == position
+            window = db.get_leaderboard_window(user_id, GUILD, radius=2)
+            assert (position, user_id) in [(pos, uid) for pos, uid, _ in window]
+            assert [uid for _, uid, _ in window] == expected[max(position - 3, 0):position + 2]
+    finally:
+        db.stop_write_worker()
+
+
+def test_rank_index_matches_a_sorted_list(monkeypatch):
+    monkeypatch.setattr(guild_stats, "RANK_LOAD", 4)  # lots of bucket splits and empty buckets
+    rng = random.Random(7)
+    keys = {(-rng.randrange(50), str(n)) for n in range(40)}
+    index = RankIndex(keys)
+    for _ in range(2000):
+        if keys and rng.random() < 0.5:
+            key = rng.choice(sorted(keys))
+            keys.discard(key)
+            index.remove(key)
+        else:
+            key = (-rng.randrange(50), str(rng.randrange(200)))
+            if key not in keys:
+                keys.add(key)
+                index.add(key)
+        ordered = sorted(keys)
+        assert len(index) == len(ordered)
+        if ordered:
+            probe = rng.choice(ordered)
+            position = ordered.index(probe)
+            assert index.position(probe) == position
+            assert index.slice(position - 3, position + 4) == ordered[max(position - 3, 0):position + 4]
@@ -0,0 +1,33 @@
+from database import Database
+from shard_migrate import split_database
+
+GUILD = "1001"
+
+
+def _populate(path, users=5, xp=100):
+    db = Database(path)
+    for n in range(users):
+        db.create_user(str(n), GUILD, wait=False)
+        db.add_xp(str(n), GUILD, xp)
+    db.stop_write_worker()
+
+
+def test_migrated_rows_are_counted_once(tmp_path):
+    path = str(tmp_path / "system.db")
+    _populate(path)
+    split_database(path, 4)
+
+    db = Database(path, shard_count=4)
+    try:
+        stats = db.get_server_aggregates(GUILD)
+        assert stats["total_xp"] == 500
+        assert stats["total_messages"] == 5
+        assert stats["total_users"] == 5
+        assert sum(stats["level_histogram"].values()) == 5
+
+        # The stale copies in the main file don't overwrite the shard's counters either
+        db.reload_guild_stats(path)
+        db.reload_guild_stats(db.shard_path(GUILD))
+        assert db.get_server_aggregates(GUILD)["total_xp"] == 500
+    finally:
+        db.stop_write_worker()
@@ -0,0 +1,175 @@
+import asyncio
+import time
+
+import pytest
+
+import web_client
+from web_client import (BACKGROUND, INTERACTIVE, CircuitBreaker, CircuitOpenError, RequestScheduler, SingleFlight,
+                        WebSession)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeResponse:
+    def __init__(self, status, body=None, headers=None):
+        self.status = status
+        self.headers = headers or {}
+        self._body = body if body is not None else {}
+
+    async def json(self):
+        return self._body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeHTTP:
+    """Stands in for the aiohttp session: answers requests from a list."""
+    closed = False
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.sent = 0
+
+    def request(self, method, url, **kwargs):
+        self.sent += 1
+        return self.responses.pop(0)
+
+
+def test_breaker_opens_probes_once_and_closes(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(web_client, "time", clock)
+    breaker = CircuitBreaker(window=10, min_calls=4, failure_rate=0.5, open_seconds=30)
+    for failed in (False, True, False):
+        breaker.record(failed, 0.1)
+    assert breaker.state == CircuitBreaker.CLOSED  # too few calls to judge
+    breaker.record(True, 0.1, "HTTP 503")
+    assert breaker.state == CircuitBreaker.OPEN and breaker.is_open()
+    assert not breaker.allow() and breaker.rejected == 1
+
+    clock.now += 31
+    assert breaker.allow()          # the probe
+    assert not breaker.allow()      # only one at a time
+    breaker.record(True, 0.1, "Timeout")
+    assert breaker.is_open() and breaker.trips == 2 and breaker.last_error == "Timeout"
+
+    clock.now += 31
+    assert breaker.allow()
+    breaker.record(False, 0.1)
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+
+
+def test_breaker_opens_on_slow_calls_and_frees_a_cancelled_probe(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(web_client, "time", clock)
+    breaker = CircuitBreaker(min_calls=2, slow_seconds=3.0, slow_rate=0.5)
+    breaker.record(False, 5.0)
+    breaker.record(False, 4.0)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.now += breaker.open_seconds
+    assert breaker.allow()
+    breaker.release()  # the probe was cancelled
+    assert breaker.allow()
+
+
+def test_interactive_requests_go_first_and_background_leaves_room():
+    async def run():
+        scheduler = RequestScheduler(max_in_flight=3, reserved=1, rate=1000, burst=1000)
+        order = []
+
+        async def request(name, priority):
+            await scheduler.acquire(priority)
+            order.append(name)
+
+        await scheduler.acquire(BACKGROUND)
+        await scheduler.acquire(BACKGROUND)
+        # Background may only use max_in_flight - reserved slots
+        background = asyncio.create_task(request("background", BACKGROUND))
+        await asyncio.sleep(0)
+        assert order == []
+        interactive = asyncio.create_task(request("interactive", INTERACTIVE))
+        await asyncio.sleep(0)
+        assert order == ["interactive"]
+        scheduler.release()  # 2 in flight: still the background limit
+        await asyncio.sleep(0)
+        assert order == ["interactive"]
+        scheduler.release()
+        await asyncio.wait_for(background, 1)
+        await interactive
+        assert order == ["interactive", "background"]
+
+    asyncio.run(run())
+
+
+def test_429_pauses_every_request_for_retry_after():
+    async def run():
+        session = WebSession(scheduler=RequestScheduler(rate=1000, burst=1000))
+        session._session = FakeHTTP(FakeResponse(429, {"error": "slow down"}, {"Retry-After": "0.2"}),
+                                    FakeResponse(200, {"success": True}))
+        assert await session.post_json("https://web.example/bot-sync", {}) == (429, {"error": "slow down"})
+        assert session.scheduler.throttled == 1
+        assert session.breaker.status()["failures"] == 1
+
+        started = time.monotonic()
+        assert await session.post_json("https://web.example/bot-sync", {}) == (200, {"success": True})
+        assert time.monotonic() - started >= 0.15
+
+    asyncio.run(run())
+
+
+def test_open_circuit_refuses_without_sending():
+    async def run():
+        http = FakeHTTP(*[FakeResponse(503) for _ in range(5)])
+        session = WebSession(breaker=CircuitBreaker(min_calls=5))
+        session._session = http
+        for _ in range(5):
+            assert (await session.post_json("https://web.example/bot-sync", {}))[0] == 503
+        with pytest.raises(CircuitOpenError):
+            await session.post_json("https://web.example/bot-sync", {})
+        assert http.sent == 5
+
+    asyncio.run(run())
+
+
+def test_single_flight_shares_one_call_and_survives_a_cancelled_caller():
+    async def run():
+        flight = SingleFlight()
+        calls = []
+        release = asyncio.Event()
+
+        async def fetch():
+            calls.append(1)
+            await release.wait()
+            return len(calls)
+
+        first = asyncio.create_task(flight.do("k", fetch))
+        second = asyncio.create_task(flight.do("k", fetch))
+        third = asyncio.create_task(flight.do("k", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        release.set()
+        assert await second == 1 and await third == 1
+        assert calls == [1] and flight.shared == 2 and flight.in_flight() == 0
+
+        # forget() makes the next caller start over
+        release.clear()
+        old = asyncio.create_task(flight.do("k", fetch))
+        await asyncio.sleep(0)
+        flight.forget("k")
+        new = asyncio.create_task(flight.do("k", fetch))
+        await asyncio.sleep(0)
+        release.set()
+        assert (await old, await new) == (3, 3)
+        assert len(calls) == 3
+
+    asyncio.run(run())
@@ -0,0 +1,178 @@
+import asyncio
+import sqlite3
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+import web_outbox
+from web_outbox import WebOutbox
+from web_sync import XPSyncAggregator
+
+
+class FakeBotSync:
+    """Answers every item with 200, or with the status queued for its key, and
+    records which requests were in flight at the same time."""
+
+    def __init__(self):
+        self.session = SimpleNamespace(breaker=SimpleNamespace(is_open=lambda: self.open))
+        self.requests = []
+        self.statuses = {}
+        self.in_flight = 0
+        self.overlapped = False
+        self.error = None  # raised by the next batch() calls while set
+        self.open = False
+
+    async def batch(self, items):
+        if self.error:
+            raise self.error
+        self.in_flight += 1
+        self.overlapped |= self.in_flight > 1
+        try:
+            await asyncio.sleep(0.01)
+            self.requests.append(items)
+            answers = []
+            for discord_id, action, data in items:
+                status = self.statuses.pop(data['idempotency_key'], 200)
+                answers.append((status, {} if status == 200 else {'error': f"HTTP {status}"}))
+            return answers
+        finally:
+            self.in_flight -= 1
+
+
+class FakeDatabase:
+    db_path = ":memory:"
+
+    def __init__(self):
+        self.conn = sqlite3.connect(":memory:", isolation_level=None, check_same_thread=False)
+        web_outbox.create_table(self.conn)
+        self.bot_sync = FakeBotSync()
+
+    @contextmanager
+    def get_conn(self, path):
+        yield self.conn
+
+    def queue_write(self, query, params=(), lane=None):
+        self.conn.execute(query, params)
+
+
+def test_batches_go_out_one_at_a_time_in_order(monkeypatch):
+    monkeypatch.setattr(web_outbox, "MAX_BATCH_ITEMS", 3)
+    db = FakeDatabase()
+    outbox = WebOutbox(db)
+    for xp in (1000, 1000, 1000, 1000, 500):
+        outbox.add("42", "add_xp", {"xp": xp})
+
+    asyncio.run(outbox.drain())
+
+    assert not db.bot_sync.overlapped
+    assert [len(items) for items in db.bot_sync.requests] == [3, 2]
+    sent = [data['xp'] for items in db.bot_sync.requests for _, _, data in items]
+    assert sent == [1000, 1000, 1000, 1000, 500]
+    assert outbox.pending() == 0 and outbox.sent == 5
+
+
+def test_split_xp_is_sent_in_order_one_request_at_a_time(monkeypatch):
+    monkeypatch.setattr(web_outbox, "MAX_BATCH_ITEMS", 2)
+    db = FakeDatabase()
+    db.outbox = WebOutbox(db)
+    db.web_sync_enabled = lambda: True
+    aggregator = XPSyncAggregator(db)
+    aggregator.add("42", 1500)
+    aggregator.add("42", 1200)
+    aggregator.add("7", 30)
+
+    aggregator.flush()
+    asyncio.run(db.outbox.drain())
+
+    assert not db.bot_sync.overlapped
+    sent = [(discord_id, data['xp']) for items in db.bot_sync.requests for discord_id, _, data in items]
+    assert sent == [("42", 1000), ("42", 1000), ("42", 700), ("7", 30)]
+
+
+class Clock:
+    """web_outbox's time module, with time() moved by hand."""
+
+    def __init__(self):
+        self.now = time.time()
+        self.strftime = time.strftime
+        self.localtime = time.localtime
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(web_outbox, "time", clock)
+    return clock
+
+
+def _keys(db):
+    return [data['idempotency_key'] for items in db.bot_sync.requests for _, _, data in items]
+
+
+def test_failed_rows_are_retried_with_the_same_key_and_backoff(clock):
+    db = FakeDatabase()
+    outbox = WebOutbox(db)
+    key = outbox.add("42", "add_xp", {"xp": 10})
+    db.bot_sync.statuses[key] = 500
+
+    asyncio.run(outbox.drain())
+    attempts, next_attempt = db.conn.execute("SELECT attempts, next_attempt FROM web_outbox").fetchone()
+    assert attempts == 1 and next_attempt == clock.now + web_outbox.BACKOFF_BASE
+    clock.now += web_outbox.BACKOFF_BASE - 1
+    asyncio.run(outbox.drain())
+    assert len(db.bot_sync.requests) == 1  # not due yet
+
+    clock.now += 1
+    asyncio.run(outbox.drain())
+    # The retry carries the same key, so bot-sync can tell it from new XP
+    assert _keys(db) == [key, key]
+    assert outbox.pending() == 0 and (outbox.sent, outbox.retried) == (1, 1)
+    assert [web_outbox.backoff(n) for n in (1, 2, 3, 20)] == [5, 10, 20, web_outbox.BACKOFF_MAX]
+
+
+def test_a_failed_batch_keeps_every_row_and_permanent_errors_drop_them(clock):
+    db = FakeDatabase()
+    outbox = WebOutbox(db)
+    linked = outbox.add("1", "add_xp", {"xp": 10})
+    unlinked = outbox.add("2", "add_xp", {"xp": 10})
+    db.bot_sync.error = asyncio.TimeoutError()
+    asyncio.run(outbox.drain())
+    assert outbox.pending() == 2 and outbox.retried == 2
+
+    db.bot_sync.error = None
+    db.bot_sync.statuses[unlinked] = 404  # not linked: retrying won't help
+    clock.now += web_outbox.BACKOFF_BASE
+    asyncio.run(outbox.drain())
+    assert _keys(db) == [linked, unlinked]
+    assert outbox.pending() == 0 and (outbox.sent, outbox.dropped) == (1, 1)
+
+
+def test_nothing_is_sent_while_the_circuit_is_open():
+    db = FakeDatabase()
+    outbox = WebOutbox(db)
+    outbox.add("1", "add_xp", {"xp": 10})
+    db.bot_sync.open = True
+    asyncio.run(outbox.drain())
+    assert db.bot_sync.requests == [] and outbox.pending() == 1
+
+    db.bot_sync.open = False
+    asyncio.run(outbox.drain())  # read back from the table
+    assert len(db.bot_sync.requests) == 1 and outbox.pending() == 0
+
+
+def test_rows_older_than_max_age_are_dropped_instead_of_retried():
+    db = FakeDatabase()
+    outbox = WebOutbox(db)
+    key = outbox.add("1", "add_xp", {"xp": 10})
+    old = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(time.time() - web_outbox.MAX_AGE - 60))
+    db.conn.execute("UPDATE web_outbox SET created_at = ?", (old,))
+    outbox._fresh = []  # as after a restart, so the row is read back with its age
+    db.bot_sync.statuses[key] = 503
+
+    asyncio.run(outbox.drain())
+    assert outbox.pending() == 0 and outbox.dropped == 1
@@ -0,0 +1,30 @@
+from write_scheduler import BULK, INTERACTIVE, FairWriteQueue
+
+
+def _drain(q):
+    items = []
+    while not q.empty():
+        items.append(q.get(block=False))
+    return items
+
+
+def test_interactive_writes_go_first_and_guilds_take_turns():
+    q = FairWriteQueue()
+    q.put("a1", guild_id="a")
+    q.put("a2", guild_id="a")
+    q.put("b1", guild_id="b")
+    q.put("set", guild_id="a", lane=INTERACTIVE)
+    assert _drain(q) == ["set", "a1", "b1", "a2"]
+
+
+def test_absolute_write_waits_for_older_bulk_writes_of_its_guild():
+    q = FairWriteQueue()
+    q.put("b1", guild_id="b")
+    q.put("a1", guild_id="a")
+    q.put("a2", guild_id="a")
+    q.put("set", guild_id="a", lane=INTERACTIVE, after_bulk=True)
+    q.put("a3", guild_id="a")
+    # a1 and a2 were queued before the set, so they're applied first (ahead of
+    # guild b's bulk write); a3 came after it and stays behind
+    assert _drain(q) == ["a1", "a2", "set", "b1", "a3"]
+    assert q.served == {INTERACTIVE: 1, BULK: 4}
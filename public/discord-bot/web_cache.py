@@ -0,0 +1,147 @@
+"""Short-lived cache of web app reads, per user and action.
+
+/viewquests, /habits, /streak, /gates, /challenges and /card each cost a
+bot-sync round trip (and !xp a Supabase read), even when a member runs
+/viewquests and then /complete a few seconds later. WebResponseCache keeps
+successful answers to the read actions for a few seconds to minutes (TTLS,
+configurable) so a repeat view is answered from memory, and drops all of a
+user's entries as soon as any other action (adding or completing a quest or
+habit, XP from the outbox, a class change) is sent for them.
+
+A read that was already on its way when a user's entries were dropped is
+not cached, so an answer from before a change can't come back after it.
+The cache holds at most max_entries answers and evicts the least recently
+used first.
+
+LinkStatusCache remembers which members are linked to a web account and,
+more usefully, which aren't: most members never link, and every web command
+they ran (including !xp, which falls back to local data) paid a remote
+lookup to find that out again. It learns from every bot-sync answer and
+profile lookup; an explicit link check (!link, /weblink) always asks the
+web app, which is how a member who just linked gets picked up.
+"""
+import time
+from collections import OrderedDict
+
+# Seconds each read action is answered from the cache; 0 turns it off
+TTLS = {
+    "get_quests": 60,
+    "get_habits": 60,
+    "get_streak": 300,
+    "get_gates": 120,
+    "get_challenges": 120,
+    "get_card_data": 60,
+    "get_stats": 30,
+    "web_app_user": 60,   # profile and stats read from Supabase by !xp and !link
+}
+MAX_ENTRIES = 5000
+
+LINKED_SECONDS = 600     # how long a member is known to be linked
+UNLINKED_SECONDS = 300   # ... or not linked
+
+
+def parse_ttls(value):
+    """'get_quests=30,get_streak=0' -> {'get_quests': 30.0, 'get_streak': 0.0}; bad pairs are skipped."""
+    ttls = {}
+    for pair in (value or "").split(","):
+        action, _, seconds = pair.partition("=")
+        try:
+            ttls[action.strip()] = float(seconds)
+        except ValueError:
+            continue
+    return ttls
+
+
+class WebResponseCache:
+    def __init__(self, ttls=None, max_entries=MAX_ENTRIES):
+        self.ttls = {**TTLS, **(ttls or {})}
+        self.max_entries = max_entries
+        self._entries = OrderedDict()        # (discord_id, action) -> (expires, result)
+        self._invalidated = OrderedDict()    # discord_id -> tick of the last invalidation
+        self._tick = 0
+        # Totals since start, for /webstatus
+        self.hits = 0
+        self.misses = 0
+
+    def cacheable(self, payload):
+        return not payload.get("data") and self.ttls.get(payload.get("action"), 0) > 0
+
+    def get(self, discord_id, action):
+        """The cached result, or None."""
+        key = (str(discord_id), action)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def begin(self):
+        """Token to pass to put() for a read that is about to be sent."""
+        return self._tick
+
+    def put(self, discord_id, action, result, token):
+        discord_id = str(discord_id)
+        if self.ttls.get(action, 0) <= 0:
+            return
+        if self._invalidated.get(discord_id, -1) >= token:
+            return  # the user changed something while this read was out
+        self._entries[(discord_id, action)] = (time.monotonic() + self.ttls[action], result)
+        self._entries.move_to_end((discord_id, action))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, discord_id):
+        """Forget everything cached for a user (call after sending them a change)."""
+        discord_id = str(discord_id)
+        for action in self.ttls:
+            self._entries.pop((discord_id, action), None)
+        self._invalidated[discord_id] = self._tick
+        self._invalidated.move_to_end(discord_id)
+        self._tick += 1
+        # Only reads still in flight need the record, so keep it bounded
+        while len(self._invalidated) > self.max_entries:
+            self._invalidated.popitem(last=False)
+
+    def status(self):
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class LinkStatusCache:
+    def __init__(self, linked_ttl=LINKED_SECONDS, unlinked_ttl=UNLINKED_SECONDS, max_entries=MAX_ENTRIES):
+        self.linked_ttl = linked_ttl
+        self.unlinked_ttl = unlinked_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # discord_id -> (expires, linked)
+        # Totals since start, for /webstatus
+        self.hits = 0
+
+    def get(self, discord_id):
+        """True / False while known, None when it has to be looked up."""
+        discord_id = str(discord_id)
+        entry = self._entries.get(discord_id)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[discord_id]
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def set(self, discord_id, linked):
+        discord_id = str(discord_id)
+        ttl = self.linked_ttl if linked else self.unlinked_ttl
+        if ttl <= 0:
+            self._entries.pop(discord_id, None)
+            return
+        self._entries[discord_id] = (time.monotonic() + ttl, bool(linked))
+        self._entries.move_to_end(discord_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def status(self):
+        linked = sum(1 for _, known in self._entries.values() if known)
+        return {'linked': linked, 'unlinked': len(self._entries) - linked, 'hits': self.hits}
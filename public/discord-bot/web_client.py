@@ -0,0 +1,334 @@
+"""One long-lived HTTP session for calls to the web app.
+
+Opening an aiohttp.ClientSession per call paid DNS, TCP and TLS setup on
+every XP sync. WebSession keeps a single session per process with a
+keep-alive connection pool and a DNS cache. The bot opens it (and warms a
+connection) at startup and closes it on shutdown; a call made outside that
+window opens it on demand.
+
+Every request goes through a CircuitBreaker. When too many recent calls
+fail or are slow, it opens and requests fail at once with CircuitOpenError
+instead of each holding a connection for the full timeout. After a
+cool-down one probe request is let through (half-open); it closes the
+circuit again if it succeeds.
+
+Requests that are let through then wait for the RequestScheduler: a global
+limit on requests in flight and a token bucket on requests per second,
+paused for Retry-After when the web app answers 429. Waiting requests go
+out by priority, so a member's /habits goes before background XP sync,
+and a few connections are always kept free for INTERACTIVE requests.
+
+SingleFlight lets concurrent identical reads (same action, same user) share
+one request instead of each sending their own.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+
+import aiohttp
+
+CONNECTION_LIMIT = 20     # open connections to the web app at once
+KEEPALIVE_SECONDS = 30    # idle connections are kept this long
+DNS_CACHE_SECONDS = 300
+REQUEST_TIMEOUT = 10      # seconds, per request
+
+MAX_IN_FLIGHT = 8         # requests to the web app at once
+RESERVED_INTERACTIVE = 2  # of those, never taken by BACKGROUND requests
+REQUESTS_PER_SECOND = 10.0
+BURST = 20
+
+# Request priorities, lower goes first
+INTERACTIVE = 0           # a member is waiting for the answer
+BACKGROUND = 1            # sync nobody is waiting on
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while the circuit is open."""
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, window=20, min_calls=5, failure_rate=0.5, slow_seconds=3.0, slow_rate=0.5,
+                 open_seconds=30.0):
+        """Opens when at least min_calls of the last `window` calls are in and failure_rate of
+        them failed, or slow_rate of them took longer than slow_seconds."""
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self._calls = deque(maxlen=window)  # (failed, seconds)
+        self._opened_at = 0.0
+        self._probing = False
+        # Totals since start, for /webstatus
+        self.trips = 0
+        self.rejected = 0
+        self.last_error = None
+
+    def is_open(self):
+        """True while requests are being refused (open and still cooling down)."""
+        return self.state == self.OPEN and time.monotonic() - self._opened_at < self.open_seconds
+
+    def allow(self):
+        """Whether a request may be sent now; in half-open state only one probe at a time."""
+        if self.state == self.OPEN:
+            if self.is_open():
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+            self._probing = False
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                self.rejected += 1
+                return False
+            self._probing = True
+        return True
+
+    def record(self, failed, seconds, error=None):
+        if failed:
+            self.last_error = error
+        if self.state == self.HALF_OPEN:
+            self._probing = False
+            if failed:
+                self._open()
+            else:
+                self.state = self.CLOSED
+                self._calls.clear()
+                print("✅ Web circuit closed, web app reachable again")
+            return
+        self._calls.append((failed, seconds))
+        if self.state == self.CLOSED and len(self._calls) >= self.min_calls:
+            failures = sum(1 for f, _ in self._calls if f)
+            slow = sum(1 for _, t in self._calls if t >= self.slow_seconds)
+            if (failures / len(self._calls) >= self.failure_rate
+                    or slow / len(self._calls) >= self.slow_rate):
+                self._open()
+
+    def release(self):
+        """Forget an allowed request that ended without an answer (e.g. cancelled)."""
+        self._probing = False
+
+    def _open(self):
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self.trips += 1
+        print(f"⚠️ Web circuit open for {self.open_seconds:.0f}s ({self.last_error or 'slow responses'})")
+
+    def status(self):
+        calls = list(self._calls)
+        return {
+            'state': self.HALF_OPEN if self.state == self.OPEN and not self.is_open() else self.state,
+            'calls': len(calls),
+            'failures': sum(1 for f, _ in calls if f),
+            'avg_seconds': sum(t for _, t in calls) / len(calls) if calls else 0.0,
+            'retry_in': max(0.0, self.open_seconds - (time.monotonic() - self._opened_at)) if self.is_open() else 0.0,
+            'trips': self.trips,
+            'rejected': self.rejected,
+            'last_error': self.last_error,
+        }
+
+
+class RequestScheduler:
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, rate=REQUESTS_PER_SECOND, burst=BURST,
+                 reserved=RESERVED_INTERACTIVE):
+        self.max_in_flight = max_in_flight
+        self.rate = rate
+        self.burst = burst
+        self.reserved = reserved
+        self._in_flight = 0
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._timer = None
+        # Totals since start, for /webstatus
+        self.throttled = 0
+
+    async def acquire(self, priority=INTERACTIVE):
+        """Wait for a request slot; call release() when the request is done."""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as we were cancelled: hand the slot on
+                self.release()
+            raise
+
+    def release(self):
+        self._in_flight -= 1
+        self._dispatch()
+
+    def retry_after(self, seconds):
+        """The web app answered 429: send nothing for `seconds`."""
+        self.throttled += 1
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    def _dispatch(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            limit = self.max_in_flight if priority == INTERACTIVE else self.max_in_flight - self.reserved
+            if self._in_flight >= limit:
+                return  # release() dispatches again
+            if now < self._paused_until:
+                return self._wake_in(self._paused_until - now)
+            if self._tokens < 1:
+                return self._wake_in((1 - self._tokens) / self.rate)
+            heapq.heappop(self._waiters)
+            self._tokens -= 1
+            self._in_flight += 1
+            future.set_result(None)
+
+    def _wake_in(self, delay):
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def status(self):
+        waiting = [p for p, _, f in self._waiters if not f.done()]
+        return {
+            'in_flight': self._in_flight,
+            'waiting_interactive': waiting.count(INTERACTIVE),
+            'waiting_background': len(waiting) - waiting.count(INTERACTIVE),
+            'paused_for': max(0.0, self._paused_until - time.monotonic()),
+            'throttled': self.throttled,
+        }
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one in-flight call and its result."""
+
+    def __init__(self):
+        self._calls = {}  # key -> future of the call in flight
+        # Totals since start, for /webstatus
+        self.shared = 0
+
+    async def do(self, key, call):
+        """Await call() (a coroutine function), or the identical call already in flight."""
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(call())
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._done(key, f))
+        else:
+            self.shared += 1
+        # One caller giving up doesn't cancel the call for the others
+        return await asyncio.shield(future)
+
+    def forget(self, key):
+        """Callers from now on start a new call instead of joining the one in flight."""
+        self._calls.pop(key, None)
+
+    def _done(self, key, future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        if not future.cancelled():
+            future.exception()  # retrieved, even if every caller was cancelled
+
+    def in_flight(self):
+        return len(self._calls)
+
+
+def _retry_after_seconds(value, default=5.0):
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return default  # missing, or an HTTP date
+
+
+class WebSession:
+    def __init__(self, limit=CONNECTION_LIMIT, breaker=None, scheduler=None):
+        self.limit = limit
+        self.breaker = breaker or CircuitBreaker()
+        self.scheduler = scheduler or RequestScheduler()
+        self._session = None
+
+    def _open(self):
+        # Only called from coroutines: aiohttp binds the session to the running loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                ttl_dns_cache=DNS_CACHE_SECONDS,
+                keepalive_timeout=KEEPALIVE_SECONDS,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+            )
+        return self._session
+
+    async def start(self, warm_url=None):
+        """Open the session, and with warm_url, set up a pooled connection to that host."""
+        session = self._open()
+        if not warm_url:
+            return
+        try:
+            # A CORS preflight is answered without touching the database
+            async with session.options(warm_url) as response:
+                await response.read()
+            print("✅ Web session ready")
+        except Exception as e:
+            print(f"⚠️ Could not warm web session: {e}")
+
+    async def post_json(self, url, payload, headers=None, priority=INTERACTIVE):
+        """POST payload as JSON; returns (status, decoded JSON body)."""
+        return await self.request_json("POST", url, priority, json=payload, headers=headers)
+
+    async def get_json(self, url, params=None, headers=None, priority=INTERACTIVE):
+        """GET url with query params; returns (status, decoded JSON body)."""
+        return await self.request_json("GET", url, priority, params=params, headers=headers)
+
+    async def request_json(self, method, url, priority=INTERACTIVE, **kwargs):
+        """Send a request (kwargs as for aiohttp) and decode the JSON answer; returns (status, body).
+
+        Raises CircuitOpenError without sending while the circuit is open.
+        5xx and 429 answers, timeouts and connection errors count as failures.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError("Web app unavailable (circuit open)")
+        try:
+            await self.scheduler.acquire(priority)
+        except BaseException:
+            self.breaker.release()
+            raise
+        started = time.monotonic()
+        try:
+            async with self._open().request(method, url, **kwargs) as response:
+                if response.status == 429:
+                    self.scheduler.retry_after(_retry_after_seconds(response.headers.get("Retry-After")))
+                result = await response.json()
+        except Exception as e:
+            self.breaker.record(True, time.monotonic() - started, str(e) or type(e).__name__)
+            raise
+        except BaseException:
+            # Cancelled: says nothing about the web app, but free the probe slot
+            self.breaker.release()
+            raise
+        finally:
+            self.scheduler.release()
+        failed = response.status >= 500 or response.status == 429
+        self.breaker.record(failed, time.monotonic() - started, f"HTTP {response.status}" if failed else None)
+        return response.status, result
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
@@ -0,0 +1,195 @@
+"""Durable outbox for web app mutations.
+
+Web mutations (today the batched XP from web_sync.py) are written to a
+web_outbox table in the main database file, each with an idempotency key,
+and sent to bot-sync by a background task. A call that times out or fails
+stays in the outbox and is retried with exponential backoff, also after a
+restart. The edge function remembers the keys it has applied, so a retry of
+a call that did land (e.g. a timeout after the update) isn't counted twice.
+It forgets them after a week, so a row still failing after MAX_AGE is
+dropped rather than retried with a key that may no longer be known.
+
+Rows are sent as soon as they are added, up to MAX_BATCH_ITEMS per
+request (bot_sync.BotSyncClient.batch) and one request at a time, so a
+user's rows are applied in order; the table is only read back for retries
+and for rows left over from a previous run.
+"""
+import asyncio
+import json
+import time
+import uuid
+
+from bot_sync import MAX_BATCH_ITEMS
+from write_scheduler import BULK
+
+BATCH_SIZE = 50
+POLL_SECONDS = 5.0          # how often due retries are looked for
+BACKOFF_BASE = 5.0          # seconds before the first retry, doubled per attempt
+BACKOFF_MAX = 3600.0
+# Seconds a row is retried before it is dropped; well inside the week
+# bot-sync keeps applied keys (KEY_RETENTION_DAYS in its index.ts)
+MAX_AGE = 3 * 86400
+# Answers that won't change on retry: bad request, user not linked
+PERMANENT_STATUSES = {400, 404}
+
+
+def create_table(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS web_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        idempotency_key TEXT UNIQUE NOT NULL,
+        discord_id TEXT NOT NULL,
+        action TEXT NOT NULL,
+        data TEXT,
+        attempts INTEGER DEFAULT 0,
+        next_attempt REAL DEFAULT 0,
+        last_error TEXT,
+        created_at TEXT
+    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_web_outbox_due ON web_outbox (next_attempt)')
+
+
+def backoff(attempts):
+    return min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+
+
+class WebOutbox:
+    def __init__(self, db, poll_interval=POLL_SECONDS):
+        self.db = db
+        self.poll_interval = poll_interval
+        self._fresh = []        # rows added since the last drain, sent without reading them back
+        self._skip = {}         # idempotency_key -> epoch before which it isn't re-read (writes still queued)
+        self._wake = None
+        self._task = None
+        # Totals since start, for metrics
+        self.sent = 0
+        self.retried = 0
+        self.dropped = 0
+
+    def add(self, discord_id, action, data):
+        """Record a mutation durably (via the write queue) and send it soon. Returns its key."""
+        row = {
+            'idempotency_key': uuid.uuid4().hex,
+            'discord_id': str(discord_id),
+            'action': action,
+            'data': dict(data or {}),
+            'attempts': 0,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        self.db.queue_write(
+            'INSERT OR IGNORE INTO web_outbox (idempotency_key, discord_id, action, data, created_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (row['idempotency_key'], row['discord_id'], action, json.dumps(row['data']), row['created_at']),
+            lane=BULK
+        )
+        self._fresh.append(row)
+        if self._wake is not None:
+            self._wake.set()
+        return row['idempotency_key']
+
+    def _due(self, now, limit):
+        with self.db.get_conn(self.db.db_path) as conn:
+            rows = conn.execute(
+                'SELECT idempotency_key, discord_id, action, data, attempts, created_at FROM web_outbox '
+                'WHERE next_attempt <= ? ORDER BY next_attempt, id LIMIT ?',
+                (now, limit)
+            ).fetchall()
+        return [
+            {'idempotency_key': key, 'discord_id': discord_id, 'action': action,
+             'data': json.loads(data) if data else {}, 'attempts': attempts or 0, 'created_at': created_at}
+            for key, discord_id, action, data, attempts, created_at in rows
+        ]
+
+    def pending(self):
+        """Rows waiting in the outbox (including ones backing off)."""
+        with self.db.get_conn(self.db.db_path) as conn:
+            return conn.execute('SELECT COUNT(*) FROM web_outbox').fetchone()[0]
+
+    def start(self):
+        """Start the sender (call from the running event loop)."""
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.drain()
+            except Exception as e:
+                print(f"❌ Web outbox error: {e}")
+
+    async def drain(self):
+        """Send fresh rows and every row whose retry is due."""
+        now = time.time()
+        self._skip = {key: until for key, until in self._skip.items() if until > now}
+        batch, self._fresh = self._fresh, []
+        if self.db.bot_sync.session.breaker.is_open():
+            # Everything is in the table already; sent once the circuit lets requests through
+            return
+        fresh_keys = {row['idempotency_key'] for row in batch}
+        stored = await asyncio.to_thread(self._due, now, BATCH_SIZE + len(self._skip) + len(fresh_keys))
+        batch += [row for row in stored
+                  if row['idempotency_key'] not in self._skip and row['idempotency_key'] not in fresh_keys]
+        if not batch:
+            return
+        # One request at a time: bot-sync applies a user's items in order only within
+        # one request, and a user's rows can straddle two (add_xp reads the total,
+        # adds and writes it back, so overlapping requests would lose XP). Paced by
+        # the web session's scheduler, behind any interactive request.
+        for i in range(0, len(batch), MAX_BATCH_ITEMS):
+            await self._send(batch[i:i + MAX_BATCH_ITEMS])
+
+    async def _send(self, rows):
+        items = [
+            (row['discord_id'], row['action'], {**row['data'], 'idempotency_key': row['idempotency_key']})
+            for row in rows
+        ]
+        try:
+            answers = await self.db.bot_sync.batch(items)
+        except Exception as e:
+            error = "Timeout" if isinstance(e, asyncio.TimeoutError) else str(e) or type(e).__name__
+            print(f"⚠️ Web outbox batch of {len(rows)} failed ({error}), will retry")
+            for row in rows:
+                self._settle(row, None, error, quiet=True)
+            return
+        for row, (status, result) in zip(rows, answers):
+            error = None if status == 200 else (result or {}).get('error', f"HTTP {status}")
+            self._settle(row, status, error)
+
+    def _settle(self, row, status, error, quiet=False):
+        key = row['idempotency_key']
+        cutoff = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(time.time() - MAX_AGE))
+        expired = bool(row.get('created_at')) and row['created_at'] < cutoff
+        if error is None or status in PERMANENT_STATUSES or expired:
+            if error is None:
+                self.sent += 1
+            else:
+                self.dropped += 1
+                if expired and status not in PERMANENT_STATUSES:
+                    print(f"⚠️ Web {row['action']} for {row['discord_id']} still failing ({error}) "
+                          f"after {MAX_AGE // 86400} days, dropped")
+            self.db.queue_write('DELETE FROM web_outbox WHERE idempotency_key = ?', (key,), lane=BULK)
+            self._skip[key] = time.time() + 300
+            return
+
+        attempts = row['attempts'] + 1
+        next_attempt = time.time() + backoff(attempts)
+        self.retried += 1
+        if attempts == 1 and not quiet:
+            print(f"⚠️ Web {row['action']} for {row['discord_id']} failed ({error}), will retry")
+        self.db.queue_write(
+            'UPDATE web_outbox SET attempts = ?, next_attempt = ?, last_error = ? WHERE idempotency_key = ?',
+            (attempts, next_attempt, error, key),
+            lane=BULK
+        )
+        self._skip[key] = next_attempt
+
+    def stop(self):
+        """Stop the sender. Unsent rows are already queued for the table and go out on the next run."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
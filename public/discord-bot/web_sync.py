@@ -0,0 +1,80 @@
+"""Batched XP sync to the web app.
+
+Every message, voice tick, daily and admin grant used to POST its own
+add_xp call to bot-sync. XPSyncAggregator sums awards per Discord ID and
+source instead and sends the totals every few seconds, so an active member
+costs one call per flush rather than one per message, and a voice tick
+costs one call per member per flush rather than per tick.
+
+The edge function adds at most MAX_XP_PER_CALL per add_xp call, so larger
+totals are sent as several calls instead of being cut off. add_xp reads
+the total and writes it back, so a member's calls must never overlap: they
+go into the web outbox (web_outbox.py) in order, which sends them one batch
+at a time and retries them. XP still being summed when the bot dies (a few
+seconds' worth) is lost.
+"""
+import asyncio
+
+FLUSH_SECONDS = 5.0
+MAX_XP_PER_CALL = 1000   # enforced by the bot-sync edge function
+
+
+def split_amount(amount, cap=MAX_XP_PER_CALL):
+    """[1000, 1000, 500] for 2500: chunks no larger than cap that add up to amount."""
+    chunks = [cap] * (amount // cap)
+    if amount % cap:
+        chunks.append(amount % cap)
+    return chunks
+
+
+class XPSyncAggregator:
+    def __init__(self, db, flush_interval=FLUSH_SECONDS):
+        self.db = db
+        self.flush_interval = flush_interval
+        self._pending = {}  # (discord_id, source) -> XP not sent yet
+        self._task = None
+        # Totals since start, for metrics
+        self.awards = 0
+        self.calls = 0
+
+    def add(self, discord_id, amount, source="discord"):
+        """Queue XP for the web app; sent with the next flush. Never waits."""
+        amount = int(amount)
+        if amount <= 0:
+            return
+        key = (str(discord_id), source)
+        self._pending[key] = self._pending.get(key, 0) + amount
+        self.awards += 1
+
+    def pending(self):
+        return len(self._pending)
+
+    def start(self):
+        """Start the background flush loop (call from the running event loop)."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Web XP sync flush error: {e}")
+
+    def flush(self):
+        """Hand everything summed so far to the web outbox."""
+        pending, self._pending = self._pending, {}
+        if not pending or not self.db.web_sync_enabled():
+            return
+        for (discord_id, source), amount in pending.items():
+            for chunk in split_amount(amount):
+                self.db.outbox.add(discord_id, "add_xp", {"xp": chunk, "source": source})
+                self.calls += 1
+
+    def stop(self):
+        """Stop the flush loop and hand over what is left."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.flush()
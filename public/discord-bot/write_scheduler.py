@@ -0,0 +1,105 @@
+"""Fair, prioritised queue for the database write workers.
+
+A drop-in replacement for queue.Queue with two lanes. Interactive writes
+(admin commands, class changes, dailies, settings) are always taken before
+bulk writes (message and voice XP ticks). Within a lane, guilds are served
+round-robin, so one guild with thousands of queued writes only delays its
+own writes, not everyone else's. Writes for the same guild and lane keep
+their order; writes in different lanes may overtake each other, which is
+why row-creating writes (create_user) go in the interactive lane.
+
+That is fine for increments, but an absolute write (set_xp, a season reset)
+overtaking older XP increments would have them land on top of the new
+value. Those are queued with after_bulk=True: when one reaches the front,
+its guild's older bulk writes are taken first (still ahead of other guilds'
+bulk writes), then the absolute write.
+"""
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+
+
+class FairWriteQueue:
+    def __init__(self):
+        self._lanes = {lane: OrderedDict() for lane in LANES}  # lane -> {guild_id: deque}
+        self._depths = dict.fromkeys(LANES, 0)
+        self._control = deque()  # stop sentinels, handed out once every lane is empty
+        self._cond = threading.Condition()
+        self._seq = 0  # queue order across lanes, for after_bulk
+        # Totals since start, for metrics
+        self.served = dict.fromkeys(LANES, 0)
+
+    def put(self, item, guild_id=None, lane=BULK, after_bulk=False):
+        """Queue a write. after_bulk=True keeps it behind the guild's bulk writes queued before it."""
+        with self._cond:
+            if item is None:
+                self._control.append(item)
+            else:
+                guilds = self._lanes[lane]
+                pending = guilds.get(guild_id)
+                if pending is None:
+                    pending = guilds[guild_id] = deque()
+                self._seq += 1
+                pending.append((self._seq, item, after_bulk))
+                self._depths[lane] += 1
+            self._cond.notify()
+
+    def _take(self, lane, guild_id):
+        guilds = self._lanes[lane]
+        pending = guilds[guild_id]
+        _, item, _ = pending.popleft()
+        if not pending:
+            del guilds[guild_id]
+        self._depths[lane] -= 1
+        self.served[lane] += 1
+        return item
+
+    def _pop(self):
+        for lane in LANES:
+            guilds = self._lanes[lane]
+            if guilds:
+                guild_id, pending = next(iter(guilds.items()))
+                # Move the guild to the back of the rotation
+                del guilds[guild_id]
+                guilds[guild_id] = pending
+                seq, _, after_bulk = pending[0]
+                older = self._lanes[BULK].get(guild_id) if lane != BULK else None
+                if after_bulk and older and older[0][0] < seq:
+                    return self._take(BULK, guild_id)
+                return self._take(lane, guild_id)
+        if self._control:
+            return self._control.popleft()
+        raise queue.Empty
+
+    def get(self, block=True, timeout=None):
+        """Next write by lane priority and guild rotation; raises queue.Empty like queue.Queue."""
+        with self._cond:
+            if not block:
+                return self._pop()
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not self._control and not any(self._depths.values()):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self._cond.wait(remaining)
+            return self._pop()
+
+    def qsize(self):
+        with self._cond:
+            return sum(self._depths.values())
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def depths(self):
+        """Queued writes per lane plus the number of guilds waiting in each."""
+        with self._cond:
+            return {
+                lane: {'writes': self._depths[lane], 'guilds': len(self._lanes[lane])}
+                for lane in LANES
+            }
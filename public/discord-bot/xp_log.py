@@ -0,0 +1,240 @@
+"""Append-only binary log of XP, voice and daily events.
+
+Every XP change the bot makes is also written here as a fixed-width record,
+in the order it happened. The log is the source of truth for recovery: the
+replay tool folds it back into `users` totals, `monthly_xp` and `xp_history`.
+
+Usage:
+    python xp_log.py dump xp_events.log [--limit 20]
+    python xp_log.py replay xp_events.log system.db [--rebuild] [--since 2025-01-01T00:00:00] [--shards N|guild]
+
+--rebuild zeroes the counters and history of every guild in the log before
+applying it. Without it, events are added on top of the current values, which
+is what you want after restoring a backup taken when the log was started.
+"""
+import argparse
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+from datetime import datetime
+
+import database
+import history_partitions
+
+MAGIC = b"XPLG"
+VERSION = 1
+HEADER = struct.Struct("<4sHH")
+# timestamp, guild_id, user_id, amount, kind (+3 pad bytes) = 32 bytes
+RECORD = struct.Struct("<dQQiB3x")
+
+# Event kinds
+XP = 1            # message XP: xp, monthly_xp, messages, history
+VOICE = 2         # voice seconds
+DAILY = 3         # daily reward: xp, monthly_xp, last_daily
+SET_XP = 4        # admin override of total xp
+SEASON_RESET = 5  # monthly_xp = 0 for the whole guild (user_id = 0)
+ADJUST_XP = 6     # correction of total xp only (consistency.py repairs)
+
+KIND_NAMES = {
+    XP: "xp", VOICE: "voice", DAILY: "daily", SET_XP: "set_xp", SEASON_RESET: "season_reset", ADJUST_XP: "adjust_xp",
+}
+CHUNK_SIZE = 5000
+
+
+class XPEventLog:
+    """Thread-safe appender for the event log."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+            self._file.flush()
+        else:
+            _check_header(path)
+
+    def append(self, kind, guild_id, user_id, amount, ts=None):
+        """Append one event. Never raises: a logging failure must not block XP."""
+        try:
+            record = RECORD.pack(ts or time.time(), int(guild_id), int(user_id or 0), int(amount), kind)
+            with self._lock:
+                self._file.write(record)
+                self._file.flush()
+        except Exception as e:
+            print(f"❌ Error writing XP event log: {e}")
+
+    def sync(self):
+        """Force appended events to disk."""
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+                self._file.close()
+
+
+def _check_header(path):
+    with open(path, "rb") as f:
+        magic, version, size = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION or size != RECORD.size:
+        raise ValueError(f"{path} is not a v{VERSION} XP event log")
+
+
+def read_events(path, since=None):
+    """Yield (ts, guild_id, user_id, amount, kind) tuples in log order.
+
+    The file is memory-mapped, and a partially written record at the tail
+    (from a crash mid-append) is ignored.
+    """
+    if os.path.getsize(path) <= HEADER.size:
+        return
+    _check_header(path)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        count = (len(mm) - HEADER.size) // RECORD.size
+        view = memoryview(mm)[HEADER.size:HEADER.size + count * RECORD.size]
+        try:
+            for event in RECORD.iter_unpack(view):
+                if since is None or event[0] >= since:
+                    yield event
+        finally:
+            view.release()
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts).isoformat() if ts else None
+
+
+def fold_events(events):
+    """Fold events into per-user deltas, history rows and season resets.
+
+    Returns (users, history, resets) where users maps (guild, user) to
+    [xp_keep, xp, monthly_keep, monthly, messages, voice, last_xp_ts, last_daily_ts].
+    A *_keep of 0 means the value is absolute rather than a delta. Monthly XP
+    earned before a guild's last season reset is dropped, since replay zeroes
+    the guild's monthly_xp before applying the deltas.
+    """
+    users = {}
+    history = {}
+    resets = set()
+    for ts, guild_id, user_id, amount, kind in events:
+        guild_id, user_id = str(guild_id), str(user_id)
+        if kind == SEASON_RESET:
+            resets.add(guild_id)
+            for key, state in users.items():
+                if key[0] == guild_id:
+                    state[3] = 0
+            continue
+
+        state = users.get((guild_id, user_id))
+        if state is None:
+            state = users[(guild_id, user_id)] = [1, 0, 1, 0, 0, 0, None, None]
+        if kind == XP:
+            state[1] += amount
+            state[3] += amount
+            state[4] += 1
+            state[6] = ts
+            history.setdefault(guild_id, []).append((user_id, guild_id, amount, _iso(ts)))
+        elif kind == VOICE:
+            state[5] += amount
+        elif kind == DAILY:
+            state[1] += amount
+            state[3] += amount
+            state[7] = ts
+            history.setdefault(guild_id, []).append((user_id, guild_id, amount, _iso(ts)))
+        elif kind == SET_XP:
+            state[0], state[1] = 0, amount
+        elif kind == ADJUST_XP:
+            state[1] += amount
+    return users, history, resets
+
+
+def replay(log_path, db_path, shard_count=0, rebuild=False, since=None):
+    """Apply the log to the database files. Returns the number of users touched."""
+    users, history, resets = fold_events(read_events(log_path, since))
+
+    guilds = {g for g, _ in users} | resets | set(history)
+    by_path = {}
+    for guild_id in guilds:
+        by_path.setdefault(database.shard_path_for(db_path, guild_id, shard_count), set()).add(guild_id)
+
+    for path, path_guilds in by_path.items():
+        conn = sqlite3.connect(path)
+        try:
+            with conn:
+                if rebuild:
+                    conn.executemany(
+                        "UPDATE users SET xp = 0, monthly_xp = 0, messages = 0, voice_time = 0 WHERE guild_id = ?",
+                        [(g,) for g in path_guilds]
+                    )
+                    for g in path_guilds:
+                        history_partitions.delete_guild(conn, g)
+                conn.executemany(
+                    "UPDATE users SET monthly_xp = 0 WHERE guild_id = ?",
+                    [(g,) for g in path_guilds if g in resets]
+                )
+
+                keys = [k for k in users if k[0] in path_guilds]
+                conn.executemany(
+                    "INSERT OR IGNORE INTO users (user_id, guild_id, xp, monthly_xp) VALUES (?, ?, 0, 0)",
+                    [(u, g) for g, u in keys]
+                )
+                conn.executemany(
+                    '''UPDATE users SET xp = xp * ? + ?,
+                                        monthly_xp = monthly_xp * ? + ?,
+                                        messages = messages + ?,
+                                        voice_time = voice_time + ?,
+                                        last_xp_time = COALESCE(?, last_xp_time),
+                                        last_daily = COALESCE(?, last_daily)
+                       WHERE guild_id = ? AND user_id = ?''',
+                    [(*users[k][:6], _iso(users[k][6]), _iso(users[k][7]), k[0], k[1]) for k in keys]
+                )
+
+                rows = [row for g in path_guilds for row in history.get(g, ())]
+                for start in range(0, len(rows), CHUNK_SIZE):
+                    history_partitions.insert_rows(conn, rows[start:start + CHUNK_SIZE])
+                # A running bot refreshes these guilds' cached totals
+                database.create_cache_changes_table(conn)
+                database.record_cache_changes(conn, {"users": path_guilds}, "xp_log.replay")
+            print(f"✅ Replayed {len(keys)} users into {os.path.basename(path)}")
+        finally:
+            conn.close()
+    return len(users)
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Inspect or replay the XP event log")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    dump = sub.add_parser("dump", help="print events")
+    dump.add_argument("log")
+    dump.add_argument("--limit", type=int, default=0)
+
+    rep = sub.add_parser("replay", help="apply events to a database")
+    rep.add_argument("log")
+    rep.add_argument("db")
+    rep.add_argument("--rebuild", action="store_true")
+    rep.add_argument("--since", help="only apply events at or after this ISO timestamp")
+    rep.add_argument("--shards", default="0", help="DB_SHARDS value the bot runs with")
+
+    args = parser.parse_args()
+    if args.command == "dump":
+        for i, (ts, guild_id, user_id, amount, kind) in enumerate(read_events(args.log)):
+            if args.limit and i >= args.limit:
+                break
+            print(f"{_iso(ts)}  {KIND_NAMES.get(kind, kind):<12} guild={guild_id} user={user_id} amount={amount}")
+    else:
+        since = datetime.fromisoformat(args.since).timestamp() if args.since else None
+        shards = args.shards.strip().lower()
+        shard_count = database.PER_GUILD_SHARDS if shards == "guild" else int(shards)
+        replay(args.log, args.db, shard_count, rebuild=args.rebuild, since=since)
+
+
+if __name__ == "__main__":
+    _main()
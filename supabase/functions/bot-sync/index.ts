@@ -1,5 +1,5 @@
 import { serve } from "https://deno.land/std@0.168.0/http/server.ts";
-import { createClient } from "https://esm.sh/@supabase/supabase-js@2";
+import { createClient, SupabaseClient } from "https://esm.sh/@supabase/supabase-js@2";
 
 const corsHeaders = {
   'Access-Control-Allow-Origin': '*',
@@ -9,6 +9,17 @@ const corsHeaders = {
 // Bot secret for authentication (set this in Supabase Edge Function secrets)
 const BOT_SECRET = Deno.env.get('BOT_SYNC_SECRET');
 
+// Most items accepted in one 'batch' request
+const MAX_BATCH_ITEMS = 50;
+
+// Applied idempotency keys are kept this long. The bot's outbox gives up on
+// a row after 3 days (MAX_AGE in web_outbox.py), so a retry never outlives its key.
+const KEY_RETENTION_DAYS = 7;
+// Share of new keys whose claim also deletes expired ones (idx_bot_sync_requests_created_at)
+const KEY_PRUNE_RATE = 0.01;
+// add_xp tries this many times when the stats change between reading and writing them
+const ADD_XP_ATTEMPTS = 3;
+
 interface BotSyncRequest {
   discord_id: string;
   action: 
@@ -34,6 +45,7 @@ interface BotSyncRequest {
     quest_index?: number;
     habit_id?: string;
     habit_index?: number;
+    idempotency_key?: string;
     stats?: {
       strength?: number;
       agility?: number;
@@ -44,144 +56,144 @@ interface BotSyncRequest {
   };
 }
 
-serve(async (req) => {
-  // Handle CORS preflight requests
-  if (req.method === 'OPTIONS') {
-    return new Response(null, { headers: corsHeaders });
-  }
+async function handleAction(supabase: SupabaseClient, body: BotSyncRequest): Promise<Response> {
+  const { discord_id, action, data } = body;
 
-  try {
-    // Verify bot authentication
-    const botSecret = req.headers.get('x-bot-secret');
-    if (!BOT_SECRET || botSecret !== BOT_SECRET) {
-      console.error('Invalid or missing bot secret');
-      return new Response(
-        JSON.stringify({ error: 'Unauthorized - Invalid bot secret' }),
-        { status: 401, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-      );
-    }
+  console.log(`Bot sync request: action=${action}, discord_id=${discord_id}`);
 
-    // Create Supabase client with service role key for bypassing RLS
-    const supabaseUrl = Deno.env.get('SUPABASE_URL')!;
-    const supabaseServiceKey = Deno.env.get('SUPABASE_SERVICE_ROLE_KEY')!;
-    const supabase = createClient(supabaseUrl, supabaseServiceKey);
-
-    const body: BotSyncRequest = await req.json();
-    const { discord_id, action, data } = body;
+  if (!discord_id) {
+    return new Response(
+      JSON.stringify({ error: 'Missing discord_id' }),
+      { status: 400, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+    );
+  }
 
-    console.log(`Bot sync request: action=${action}, discord_id=${discord_id}`);
+  // Find user by Discord ID
+  const { data: profile, error: profileError } = await supabase
+    .from('profiles')
+    .select('user_id, hunter_name, avatar, title')
+    .eq('discord_id', discord_id)
+    .maybeSingle();
 
-    if (!discord_id) {
-      return new Response(
-        JSON.stringify({ error: 'Missing discord_id' }),
-        { status: 400, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-      );
-    }
+  if (profileError) {
+    console.error('Error fetching profile:', profileError);
+    return new Response(
+      JSON.stringify({ error: 'Database error fetching profile' }),
+      { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+    );
+  }
 
-    // Find user by Discord ID
-    const { data: profile, error: profileError } = await supabase
-      .from('profiles')
-      .select('user_id, hunter_name, avatar, title')
-      .eq('discord_id', discord_id)
-      .maybeSingle();
+  // Handle verify_link action (doesn't require existing link)
+  if (action === 'verify_link') {
+    return new Response(
+      JSON.stringify({ 
+        linked: !!profile,
+        hunter_name: profile?.hunter_name || null 
+      }),
+      { headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+    );
+  }
 
-    if (profileError) {
-      console.error('Error fetching profile:', profileError);
-      return new Response(
-        JSON.stringify({ error: 'Database error fetching profile' }),
-        { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-      );
-    }
+  if (!profile) {
+    return new Response(
+      JSON.stringify({ 
+        error: 'User not linked',
+        message: 'This Discord account is not linked to a web app account. Please log in to the web app with Discord to link your accounts.'
+      }),
+      { status: 404, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+    );
+  }
 
-    // Handle verify_link action (doesn't require existing link)
-    if (action === 'verify_link') {
-      return new Response(
-        JSON.stringify({ 
-          linked: !!profile,
-          hunter_name: profile?.hunter_name || null 
-        }),
-        { headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-      );
-    }
+  // Get player stats
+  const { data: playerStats, error: statsError } = await supabase
+    .from('player_stats')
+    .select('*')
+    .eq('user_id', profile.user_id)
+    .single();
 
-    if (!profile) {
-      return new Response(
-        JSON.stringify({ 
-          error: 'User not linked',
-          message: 'This Discord account is not linked to a web app account. Please log in to the web app with Discord to link your accounts.'
-        }),
-        { status: 404, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-      );
-    }
+  if (statsError || !playerStats) {
+    console.error('Error fetching player stats:', statsError);
+    return new Response(
+      JSON.stringify({ error: 'Player stats not found' }),
+      { status: 404, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+    );
+  }
 
-    // Get player stats
-    const { data: playerStats, error: statsError } = await supabase
-      .from('player_stats')
-      .select('*')
-      .eq('user_id', profile.user_id)
-      .single();
+  let result: Record<string, unknown> = {};
 
-    if (statsError || !playerStats) {
-      console.error('Error fetching player stats:', statsError);
-      return new Response(
-        JSON.stringify({ error: 'Player stats not found' }),
-        { status: 404, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-      );
+  switch (action) {
+    case 'get_stats': {
+      // Return current stats
+      result = {
+        success: true,
+        profile: {
+          hunter_name: profile.hunter_name,
+          avatar: profile.avatar,
+          title: profile.title,
+        },
+        stats: {
+          level: playerStats.level,
+          total_xp: playerStats.total_xp,
+          weekly_xp: playerStats.weekly_xp,
+          rank: playerStats.rank,
+          strength: playerStats.strength,
+          agility: playerStats.agility,
+          intelligence: playerStats.intelligence,
+          vitality: playerStats.vitality,
+          sense: playerStats.sense,
+          gold: playerStats.gold,
+          gems: playerStats.gems,
+          credits: playerStats.credits,
+          unlocked_classes: playerStats.unlocked_classes,
+          selected_card_frame: playerStats.selected_card_frame,
+        }
+      };
+      break;
     }
 
-    let result: Record<string, unknown> = {};
+    case 'add_xp': {
+      const xpAmount = data?.xp || 0;
+      const source = data?.source || 'discord_bot';
 
-    switch (action) {
-      case 'get_stats': {
-        // Return current stats
-        result = {
-          success: true,
-          profile: {
-            hunter_name: profile.hunter_name,
-            avatar: profile.avatar,
-            title: profile.title,
-          },
-          stats: {
-            level: playerStats.level,
-            total_xp: playerStats.total_xp,
-            weekly_xp: playerStats.weekly_xp,
-            rank: playerStats.rank,
-            strength: playerStats.strength,
-            agility: playerStats.agility,
-            intelligence: playerStats.intelligence,
-            vitality: playerStats.vitality,
-            sense: playerStats.sense,
-            gold: playerStats.gold,
-            gems: playerStats.gems,
-            credits: playerStats.credits,
-            unlocked_classes: playerStats.unlocked_classes,
-            selected_card_frame: playerStats.selected_card_frame,
-          }
-        };
-        break;
+      if (xpAmount <= 0) {
+        return new Response(
+          JSON.stringify({ error: 'XP amount must be positive' }),
+          { status: 400, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+        );
       }
 
-      case 'add_xp': {
-        const xpAmount = data?.xp || 0;
-        const source = data?.source || 'discord_bot';
-
-        if (xpAmount <= 0) {
-          return new Response(
-            JSON.stringify({ error: 'XP amount must be positive' }),
-            { status: 400, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-          );
+      // Rate limit: max 1000 XP per call
+      const cappedXP = Math.min(xpAmount, 1000);
+
+      // Retries from the bot's outbox carry an idempotency key. apply_bot_sync_xp
+      // records the key and updates the stats in one transaction, so a key is
+      // only ever stored for XP that was applied, and a key that was returns the
+      // stored result instead of adding the XP twice. The update only goes through
+      // if total_xp is still what was read here; otherwise the stats are read again.
+      const idempotencyKey = data?.idempotency_key ?? null;
+      let stats = playerStats;
+      let applied = false;
+      for (let attempt = 0; attempt < ADD_XP_ATTEMPTS && !applied; attempt++) {
+        if (attempt > 0) {
+          const { data: fresh, error: freshError } = await supabase
+            .from('player_stats')
+            .select('*')
+            .eq('user_id', profile.user_id)
+            .single();
+          if (freshError || !fresh) {
+            console.error('Error re-reading player stats:', freshError);
+            break;
+          }
+          stats = fresh;
         }
 
-        // Rate limit: max 1000 XP per call
-        const cappedXP = Math.min(xpAmount, 1000);
-
         // Calculate new level
-        const newTotalXP = playerStats.total_xp + cappedXP;
-        const newWeeklyXP = playerStats.weekly_xp + cappedXP;
-        
+        const newTotalXP = stats.total_xp + cappedXP;
+        const newWeeklyXP = stats.weekly_xp + cappedXP;
+
         // Level calculation: XP needed for level L = L * 100
         // Total XP for level L = 100 * (L-1) * L / 2
-        let newLevel = playerStats.level;
+        let newLevel = stats.level;
         while (100 * newLevel * (newLevel + 1) / 2 <= newTotalXP) {
           newLevel += 1;
         }
@@ -194,678 +206,791 @@ serve(async (req) => {
         else if (newLevel >= 25) newRank = 'C-Rank';
         else if (newLevel >= 6) newRank = 'D-Rank';
 
-        const levelsGained = newLevel - playerStats.level;
+        const levelsGained = newLevel - stats.level;
         const abilityPointsGained = levelsGained * 5;
 
-        // Update stats
-        const { error: updateError } = await supabase
-          .from('player_stats')
-          .update({
-            total_xp: newTotalXP,
-            weekly_xp: newWeeklyXP,
-            level: newLevel,
-            rank: newRank,
-            available_points: playerStats.available_points + abilityPointsGained,
-          })
-          .eq('user_id', profile.user_id);
-
-        if (updateError) {
-          console.error('Error updating stats:', updateError);
-          return new Response(
-            JSON.stringify({ error: 'Failed to update stats' }),
-            { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-          );
-        }
-
-        console.log(`Added ${cappedXP} XP to ${profile.hunter_name} (${discord_id}). Level: ${playerStats.level} -> ${newLevel}`);
-
         result = {
           success: true,
           xp_added: cappedXP,
           source,
-          old_level: playerStats.level,
+          old_level: stats.level,
           new_level: newLevel,
-          old_rank: playerStats.rank,
+          old_rank: stats.rank,
           new_rank: newRank,
           levels_gained: levelsGained,
           ability_points_gained: abilityPointsGained,
           total_xp: newTotalXP,
           weekly_xp: newWeeklyXP,
         };
-        break;
-      }
 
-      case 'link_class': {
-        const classId = data?.class_id;
-        if (!classId) {
+        // Update stats
+        const { data: outcome, error: updateError } = await supabase.rpc('apply_bot_sync_xp', {
+          _idempotency_key: idempotencyKey,
+          _discord_id: discord_id,
+          _user_id: profile.user_id,
+          _expected_total_xp: stats.total_xp,
+          _total_xp: newTotalXP,
+          _weekly_xp: newWeeklyXP,
+          _level: newLevel,
+          _rank: newRank,
+          _available_points: stats.available_points + abilityPointsGained,
+          _result: result,
+        });
+
+        if (updateError && updateError.code !== '23505') {
+          console.error('Error updating stats:', updateError);
           return new Response(
-            JSON.stringify({ error: 'Missing class_id' }),
-            { status: 400, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+            JSON.stringify({ error: 'Failed to update stats' }),
+            { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
           );
         }
 
-        const currentClasses = playerStats.unlocked_classes || [];
-        if (currentClasses.includes(classId)) {
-          result = {
-            success: true,
-            message: 'Class already unlocked',
-            unlocked_classes: currentClasses,
-          };
-        } else {
-          const newClasses = [...currentClasses, classId];
-          
-          const { error: updateError } = await supabase
-            .from('player_stats')
-            .update({ unlocked_classes: newClasses })
-            .eq('user_id', profile.user_id);
-
+        if (updateError || outcome?.status === 'duplicate') {
+          // Applied before (or by a concurrent request with the same key, 23505)
+          let previous = outcome?.result;
           if (updateError) {
-            console.error('Error updating classes:', updateError);
-            return new Response(
-              JSON.stringify({ error: 'Failed to update classes' }),
-              { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-            );
+            const { data: stored } = await supabase
+              .from('bot_sync_requests')
+              .select('result')
+              .eq('idempotency_key', idempotencyKey)
+              .maybeSingle();
+            previous = stored?.result;
           }
+          console.log(`Duplicate add_xp ${idempotencyKey} for ${discord_id}, not applied again`);
+          return new Response(
+            JSON.stringify({ ...(previous ?? { success: true }), duplicate: true }),
+            { headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+          );
+        }
 
-          console.log(`Unlocked class ${classId} for ${profile.hunter_name}`);
-
-          result = {
-            success: true,
-            message: `Class ${classId} unlocked`,
-            unlocked_classes: newClasses,
-          };
+        applied = outcome?.status === 'applied';
+        if (applied) {
+          console.log(`Added ${cappedXP} XP to ${profile.hunter_name} (${discord_id}). Level: ${stats.level} -> ${newLevel}`);
         }
-        break;
       }
 
-      case 'sync_stats': {
-        // Sync specific stats from Discord bot
-        const statsUpdate = data?.stats || {};
-        const updateFields: Record<string, number> = {};
+      if (!applied) {
+        // Nothing was stored, so a retry with the same key goes through
+        return new Response(
+          JSON.stringify({ error: 'Failed to update stats' }),
+          { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+        );
+      }
 
-        if (statsUpdate.strength !== undefined) {
-          updateFields.strength = Math.max(10, statsUpdate.strength);
-        }
-        if (statsUpdate.agility !== undefined) {
-          updateFields.agility = Math.max(10, statsUpdate.agility);
-        }
-        if (statsUpdate.intelligence !== undefined) {
-          updateFields.intelligence = Math.max(10, statsUpdate.intelligence);
-        }
-        if (statsUpdate.vitality !== undefined) {
-          updateFields.vitality = Math.max(10, statsUpdate.vitality);
-        }
-        if (statsUpdate.sense !== undefined) {
-          updateFields.sense = Math.max(10, statsUpdate.sense);
+      if (idempotencyKey && Math.random() < KEY_PRUNE_RATE) {
+        const cutoff = new Date(Date.now() - KEY_RETENTION_DAYS * 86400 * 1000).toISOString();
+        const { error: pruneError } = await supabase
+          .from('bot_sync_requests')
+          .delete()
+          .lt('created_at', cutoff);
+        if (pruneError) {
+          console.error('Error pruning idempotency keys:', pruneError);
         }
+      }
+      break;
+    }
 
-        if (Object.keys(updateFields).length === 0) {
-          return new Response(
-            JSON.stringify({ error: 'No stats to update' }),
-            { status: 400, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-          );
-        }
+    case 'link_class': {
+      const classId = data?.class_id;
+      if (!classId) {
+        return new Response(
+          JSON.stringify({ error: 'Missing class_id' }),
+          { status: 400, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+        );
+      }
+
+      const currentClasses = playerStats.unlocked_classes || [];
+      if (currentClasses.includes(classId)) {
+        result = {
+          success: true,
+          message: 'Class already unlocked',
+          unlocked_classes: currentClasses,
+        };
+      } else {
+        const newClasses = [...currentClasses, classId];
 
         const { error: updateError } = await supabase
           .from('player_stats')
-          .update(updateFields)
+          .update({ unlocked_classes: newClasses })
           .eq('user_id', profile.user_id);
 
         if (updateError) {
-          console.error('Error syncing stats:', updateError);
+          console.error('Error updating classes:', updateError);
           return new Response(
-            JSON.stringify({ error: 'Failed to sync stats' }),
+            JSON.stringify({ error: 'Failed to update classes' }),
             { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
           );
         }
 
-        console.log(`Synced stats for ${profile.hunter_name}:`, updateFields);
+        console.log(`Unlocked class ${classId} for ${profile.hunter_name}`);
 
         result = {
           success: true,
-          updated_stats: updateFields,
+          message: `Class ${classId} unlocked`,
+          unlocked_classes: newClasses,
         };
-        break;
       }
+      break;
+    }
 
-      // =====================
-      // NEW: QUESTS
-      // =====================
-      case 'get_quests': {
-        const { data: questData, error: questError } = await supabase
-          .from('user_quests')
-          .select('quests, last_reset_date')
-          .eq('user_id', profile.user_id)
-          .maybeSingle();
+    case 'sync_stats': {
+      // Sync specific stats from Discord bot
+      const statsUpdate = data?.stats || {};
+      const updateFields: Record<string, number> = {};
 
-        if (questError) {
-          console.error('Error fetching quests:', questError);
-          return new Response(
-            JSON.stringify({ error: 'Failed to fetch quests' }),
-            { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-          );
-        }
-
-        const quests = questData?.quests || [];
-        // Filter to today's active quests (not completed)
-        const activeQuests = Array.isArray(quests) 
-          ? quests.filter((q: { completed?: boolean }) => !q.completed)
-          : [];
+      if (statsUpdate.strength !== undefined) {
+        updateFields.strength = Math.max(10, statsUpdate.strength);
+      }
+      if (statsUpdate.agility !== undefined) {
+        updateFields.agility = Math.max(10, statsUpdate.agility);
+      }
+      if (statsUpdate.intelligence !== undefined) {
+        updateFields.intelligence = Math.max(10, statsUpdate.intelligence);
+      }
+      if (statsUpdate.vitality !== undefined) {
+        updateFields.vitality = Math.max(10, statsUpdate.vitality);
+      }
+      if (statsUpdate.sense !== undefined) {
+        updateFields.sense = Math.max(10, statsUpdate.sense);
+      }
 
-        result = {
-          success: true,
-          quests: activeQuests,
-          total: Array.isArray(quests) ? quests.length : 0,
-          completed: Array.isArray(quests) ? quests.filter((q: { completed?: boolean }) => q.completed).length : 0,
-        };
-        break;
+      if (Object.keys(updateFields).length === 0) {
+        return new Response(
+          JSON.stringify({ error: 'No stats to update' }),
+          { status: 400, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+        );
       }
 
-      case 'add_quest': {
-        const questTitle = data?.quest_title;
-        if (!questTitle) {
-          return new Response(
-            JSON.stringify({ error: 'Missing quest_title' }),
-            { status: 400, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-          );
-        }
+      const { error: updateError } = await supabase
+        .from('player_stats')
+        .update(updateFields)
+        .eq('user_id', profile.user_id);
 
-        // Get current quests
-        const { data: questData, error: questError } = await supabase
-          .from('user_quests')
-          .select('quests')
-          .eq('user_id', profile.user_id)
-          .maybeSingle();
-
-        const currentQuests = Array.isArray(questData?.quests) ? questData.quests : [];
-        
-        // Create new quest with structure matching web app's DailyQuest interface
-        const xpReward = Math.floor(Math.random() * 30) + 20; // 20-50 XP
-        const statOptions = ['strength', 'agility', 'intelligence', 'vitality', 'sense'];
-        const randomStat = statOptions[Math.floor(Math.random() * statOptions.length)];
-        
-        const newQuest = {
-          id: crypto.randomUUID(),
-          name: questTitle, // Web app uses 'name' not 'title'
-          xpReward: xpReward, // Web app uses 'xpReward' not 'xp'
-          statBoost: { stat: randomStat, amount: 1 }, // Required by web app
-          completed: false,
-          createdAt: new Date().toISOString(),
-          source: 'discord',
-        };
+      if (updateError) {
+        console.error('Error syncing stats:', updateError);
+        return new Response(
+          JSON.stringify({ error: 'Failed to sync stats' }),
+          { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+        );
+      }
 
-        const updatedQuests = [...currentQuests, newQuest];
+      console.log(`Synced stats for ${profile.hunter_name}:`, updateFields);
 
-        // Upsert quests
-        const { error: updateError } = await supabase
-          .from('user_quests')
-          .upsert({
-            user_id: profile.user_id,
-            quests: updatedQuests,
-            updated_at: new Date().toISOString(),
-          }, { onConflict: 'user_id' });
+      result = {
+        success: true,
+        updated_stats: updateFields,
+      };
+      break;
+    }
 
-        if (updateError) {
-          console.error('Error adding quest:', updateError);
-          return new Response(
-            JSON.stringify({ error: 'Failed to add quest' }),
-            { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-          );
-        }
+    // =====================
+    // NEW: QUESTS
+    // =====================
+    case 'get_quests': {
+      const { data: questData, error: questError } = await supabase
+        .from('user_quests')
+        .select('quests, last_reset_date')
+        .eq('user_id', profile.user_id)
+        .maybeSingle();
+
+      if (questError) {
+        console.error('Error fetching quests:', questError);
+        return new Response(
+          JSON.stringify({ error: 'Failed to fetch quests' }),
+          { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+        );
+      }
 
-        console.log(`Added quest for ${profile.hunter_name}: ${questTitle}`);
+      const quests = questData?.quests || [];
+      // Filter to today's active quests (not completed)
+      const activeQuests = Array.isArray(quests) 
+        ? quests.filter((q: { completed?: boolean }) => !q.completed)
+        : [];
+
+      result = {
+        success: true,
+        quests: activeQuests,
+        total: Array.isArray(quests) ? quests.length : 0,
+        completed: Array.isArray(quests) ? quests.filter((q: { completed?: boolean }) => q.completed).length : 0,
+      };
+      break;
+    }
 
-        result = {
-          success: true,
-          quest: newQuest,
-          xp: xpReward,
-          stat: randomStat,
-          message: `Quest "${questTitle}" added!`,
-        };
-        break;
+    case 'add_quest': {
+      const questTitle = data?.quest_title;
+      if (!questTitle) {
+        return new Response(
+          JSON.stringify({ error: 'Missing quest_title' }),
+          { status: 400, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+        );
       }
 
-      case 'complete_quest': {
-        const questIndex = data?.quest_index;
-        if (questIndex === undefined || questIndex < 0) {
-          return new Response(
-            JSON.stringify({ error: 'Missing or invalid quest_index' }),
-            { status: 400, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-          );
-        }
+      // Get current quests
+      const { data: questData, error: questError } = await supabase
+        .from('user_quests')
+        .select('quests')
+        .eq('user_id', profile.user_id)
+        .maybeSingle();
+
+      const currentQuests = Array.isArray(questData?.quests) ? questData.quests : [];
+
+      // Create new quest with structure matching web app's DailyQuest interface
+      const xpReward = Math.floor(Math.random() * 30) + 20; // 20-50 XP
+      const statOptions = ['strength', 'agility', 'intelligence', 'vitality', 'sense'];
+      const randomStat = statOptions[Math.floor(Math.random() * statOptions.length)];
+
+      const newQuest = {
+        id: crypto.randomUUID(),
+        name: questTitle, // Web app uses 'name' not 'title'
+        xpReward: xpReward, // Web app uses 'xpReward' not 'xp'
+        statBoost: { stat: randomStat, amount: 1 }, // Required by web app
+        completed: false,
+        createdAt: new Date().toISOString(),
+        source: 'discord',
+      };
+
+      const updatedQuests = [...currentQuests, newQuest];
+
+      // Upsert quests
+      const { error: updateError } = await supabase
+        .from('user_quests')
+        .upsert({
+          user_id: profile.user_id,
+          quests: updatedQuests,
+          updated_at: new Date().toISOString(),
+        }, { onConflict: 'user_id' });
+
+      if (updateError) {
+        console.error('Error adding quest:', updateError);
+        return new Response(
+          JSON.stringify({ error: 'Failed to add quest' }),
+          { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+        );
+      }
 
-        // Get current quests
-        const { data: questData, error: questError } = await supabase
-          .from('user_quests')
-          .select('quests')
-          .eq('user_id', profile.user_id)
-          .maybeSingle();
+      console.log(`Added quest for ${profile.hunter_name}: ${questTitle}`);
 
-        const currentQuests = Array.isArray(questData?.quests) ? questData.quests : [];
-        const activeQuests = currentQuests.filter((q: { completed?: boolean }) => !q.completed);
+      result = {
+        success: true,
+        quest: newQuest,
+        xp: xpReward,
+        stat: randomStat,
+        message: `Quest "${questTitle}" added!`,
+      };
+      break;
+    }
 
-        if (questIndex >= activeQuests.length) {
-          return new Response(
-            JSON.stringify({ error: `Quest #${questIndex + 1} not found. You have ${activeQuests.length} active quests.` }),
-            { status: 400, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-          );
-        }
+    case 'complete_quest': {
+      const questIndex = data?.quest_index;
+      if (questIndex === undefined || questIndex < 0) {
+        return new Response(
+          JSON.stringify({ error: 'Missing or invalid quest_index' }),
+          { status: 400, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+        );
+      }
 
-        const questToComplete = activeQuests[questIndex];
-        // Support both old (xp/gold) and new (xpReward) formats
-        const xpReward = questToComplete.xpReward || questToComplete.xp || 25;
-        const goldReward = questToComplete.gold || 10;
+      // Get current quests
+      const { data: questData, error: questError } = await supabase
+        .from('user_quests')
+        .select('quests')
+        .eq('user_id', profile.user_id)
+        .maybeSingle();
 
-        // Mark quest as completed
-        const questId = questToComplete.id;
-        const updatedQuests = currentQuests.map((q: { id: string; completed?: boolean }) => 
-          q.id === questId ? { ...q, completed: true, completedAt: new Date().toISOString() } : q
+      const currentQuests = Array.isArray(questData?.quests) ? questData.quests : [];
+      const activeQuests = currentQuests.filter((q: { completed?: boolean }) => !q.completed);
+
+      if (questIndex >= activeQuests.length) {
+        return new Response(
+          JSON.stringify({ error: `Quest #${questIndex + 1} not found. You have ${activeQuests.length} active quests.` }),
+          { status: 400, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
         );
+      }
 
-        // Update quests
-        const { error: updateQuestError } = await supabase
-          .from('user_quests')
-          .update({ quests: updatedQuests, updated_at: new Date().toISOString() })
-          .eq('user_id', profile.user_id);
+      const questToComplete = activeQuests[questIndex];
+      // Support both old (xp/gold) and new (xpReward) formats
+      const xpReward = questToComplete.xpReward || questToComplete.xp || 25;
+      const goldReward = questToComplete.gold || 10;
 
-        if (updateQuestError) {
-          console.error('Error completing quest:', updateQuestError);
-          return new Response(
-            JSON.stringify({ error: 'Failed to complete quest' }),
-            { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-          );
-        }
+      // Mark quest as completed
+      const questId = questToComplete.id;
+      const updatedQuests = currentQuests.map((q: { id: string; completed?: boolean }) => 
+        q.id === questId ? { ...q, completed: true, completedAt: new Date().toISOString() } : q
+      );
 
-        // Award XP and gold
-        const newTotalXP = playerStats.total_xp + xpReward;
-        const newWeeklyXP = playerStats.weekly_xp + xpReward;
-        const newGold = playerStats.gold + goldReward;
+      // Update quests
+      const { error: updateQuestError } = await supabase
+        .from('user_quests')
+        .update({ quests: updatedQuests, updated_at: new Date().toISOString() })
+        .eq('user_id', profile.user_id);
 
-        let newLevel = playerStats.level;
-        while (100 * newLevel * (newLevel + 1) / 2 <= newTotalXP) {
-          newLevel += 1;
-        }
+      if (updateQuestError) {
+        console.error('Error completing quest:', updateQuestError);
+        return new Response(
+          JSON.stringify({ error: 'Failed to complete quest' }),
+          { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+        );
+      }
 
-        const { error: updateStatsError } = await supabase
-          .from('player_stats')
-          .update({
-            total_xp: newTotalXP,
-            weekly_xp: newWeeklyXP,
-            level: newLevel,
-            gold: newGold,
-          })
-          .eq('user_id', profile.user_id);
+      // Award XP and gold
+      const newTotalXP = playerStats.total_xp + xpReward;
+      const newWeeklyXP = playerStats.weekly_xp + xpReward;
+      const newGold = playerStats.gold + goldReward;
 
-        if (updateStatsError) {
-          console.error('Error updating stats after quest:', updateStatsError);
-        }
+      let newLevel = playerStats.level;
+      while (100 * newLevel * (newLevel + 1) / 2 <= newTotalXP) {
+        newLevel += 1;
+      }
 
-        console.log(`Completed quest for ${profile.hunter_name}: ${questToComplete.title}`);
+      const { error: updateStatsError } = await supabase
+        .from('player_stats')
+        .update({
+          total_xp: newTotalXP,
+          weekly_xp: newWeeklyXP,
+          level: newLevel,
+          gold: newGold,
+        })
+        .eq('user_id', profile.user_id);
 
-        result = {
-          success: true,
-          quest: questToComplete,
-          xp_earned: xpReward,
-          gold_earned: goldReward,
-          new_level: newLevel,
-          leveled_up: newLevel > playerStats.level,
-        };
-        break;
+      if (updateStatsError) {
+        console.error('Error updating stats after quest:', updateStatsError);
       }
 
-      // =====================
-      // NEW: HABITS
-      // =====================
-      case 'get_habits': {
-        const { data: habitData, error: habitError } = await supabase
-          .from('user_habits')
-          .select('habits')
-          .eq('user_id', profile.user_id)
-          .maybeSingle();
+      console.log(`Completed quest for ${profile.hunter_name}: ${questToComplete.title}`);
+
+      result = {
+        success: true,
+        quest: questToComplete,
+        xp_earned: xpReward,
+        gold_earned: goldReward,
+        new_level: newLevel,
+        leveled_up: newLevel > playerStats.level,
+      };
+      break;
+    }
 
-        if (habitError) {
-          console.error('Error fetching habits:', habitError);
-          return new Response(
-            JSON.stringify({ error: 'Failed to fetch habits' }),
-            { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-          );
-        }
+    // =====================
+    // NEW: HABITS
+    // =====================
+    case 'get_habits': {
+      const { data: habitData, error: habitError } = await supabase
+        .from('user_habits')
+        .select('habits')
+        .eq('user_id', profile.user_id)
+        .maybeSingle();
+
+      if (habitError) {
+        console.error('Error fetching habits:', habitError);
+        return new Response(
+          JSON.stringify({ error: 'Failed to fetch habits' }),
+          { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+        );
+      }
 
-        const habits = habitData?.habits || [];
-        const today = new Date().toISOString().split('T')[0];
-        
-        // Filter to only active goals (status = 'active')
-        // Web app Habit interface uses: completionGrid: Record<string, boolean>
-        const activeHabits = Array.isArray(habits) ? habits.filter((h: { 
-          status?: string;
-        }) => {
-          const status = h.status || 'active';
-          return status === 'active';
-        }) : [];
-        
-        // Process active habits - filter out those already completed today
-        // Web app uses completionGrid[date] = true/false
-        const todayHabits = activeHabits.filter((h: { 
-          id: string; 
-          name: string; 
-          completionGrid?: Record<string, boolean>;
-        }) => {
-          // Check if completed today using completionGrid
-          return !h.completionGrid?.[today];
-        });
-        
-        const processedHabits = todayHabits.map((h: { 
-          id: string; 
-          name: string; 
-          winXP?: number;
-          goalDays?: number;
-          icon?: string;
-        }) => ({
-          id: h.id,
-          name: h.name,
-          icon: h.icon || '🌱',
-          xp: 15, // Fixed daily XP reward for completing a habit
-        }));
+      const habits = habitData?.habits || [];
+      const today = new Date().toISOString().split('T')[0];
+
+      // Filter to only active goals (status = 'active')
+      // Web app Habit interface uses: completionGrid: Record<string, boolean>
+      const activeHabits = Array.isArray(habits) ? habits.filter((h: { 
+        status?: string;
+      }) => {
+        const status = h.status || 'active';
+        return status === 'active';
+      }) : [];
+
+      // Process active habits - filter out those already completed today
+      // Web app uses completionGrid[date] = true/false
+      const todayHabits = activeHabits.filter((h: { 
+        id: string; 
+        name: string; 
+        completionGrid?: Record<string, boolean>;
+      }) => {
+        // Check if completed today using completionGrid
+        return !h.completionGrid?.[today];
+      });
+
+      const processedHabits = todayHabits.map((h: { 
+        id: string; 
+        name: string; 
+        winXP?: number;
+        goalDays?: number;
+        icon?: string;
+      }) => ({
+        id: h.id,
+        name: h.name,
+        icon: h.icon || '🌱',
+        xp: 15, // Fixed daily XP reward for completing a habit
+      }));
+
+      result = {
+        success: true,
+        habits: processedHabits,
+        total: activeHabits.length,
+        remaining_today: processedHabits.length,
+      };
+      break;
+    }
 
-        result = {
-          success: true,
-          habits: processedHabits,
-          total: activeHabits.length,
-          remaining_today: processedHabits.length,
-        };
-        break;
+    case 'complete_habit': {
+      // Support both habit_id (string) and habit_index (number)
+      const habitId = data?.habit_id;
+      const habitIndex = data?.habit_index;
+
+      if (habitId === undefined && habitIndex === undefined) {
+        return new Response(
+          JSON.stringify({ error: 'Missing habit_id or habit_index' }),
+          { status: 400, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+        );
+      }
+
+      const { data: habitData, error: habitError } = await supabase
+        .from('user_habits')
+        .select('habits')
+        .eq('user_id', profile.user_id)
+        .maybeSingle();
+
+      const habits = Array.isArray(habitData?.habits) ? habitData.habits : [];
+      const today = new Date().toISOString().split('T')[0];
+
+      // Filter to only active habits first
+      const activeHabits = habits.filter((h: { status?: string }) => {
+        const status = h.status || 'active';
+        return status === 'active';
+      });
+
+      // Filter to habits not completed today
+      const todayActiveHabits = activeHabits.filter((h: { completionGrid?: Record<string, boolean> }) => {
+        return !h.completionGrid?.[today];
+      });
+
+      interface HabitType {
+        id: string;
+        name: string;
+        icon?: string;
+        status?: string;
+        completionGrid?: Record<string, boolean>;
+        winXP?: number;
+        goalDays?: number;
       }
 
-      case 'complete_habit': {
-        // Support both habit_id (string) and habit_index (number)
-        const habitId = data?.habit_id;
-        const habitIndex = data?.habit_index;
-        
-        if (habitId === undefined && habitIndex === undefined) {
+      let targetHabit: HabitType | null = null;
+      let targetHabitIndex = -1;
+
+      if (habitIndex !== undefined) {
+        // Find by index in today's active habits list
+        if (habitIndex < 0 || habitIndex >= todayActiveHabits.length) {
           return new Response(
-            JSON.stringify({ error: 'Missing habit_id or habit_index' }),
+            JSON.stringify({ error: `Habit #${habitIndex + 1} not found. You have ${todayActiveHabits.length} habits remaining today.` }),
             { status: 400, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
           );
         }
-
-        const { data: habitData, error: habitError } = await supabase
-          .from('user_habits')
-          .select('habits')
-          .eq('user_id', profile.user_id)
-          .maybeSingle();
-
-        const habits = Array.isArray(habitData?.habits) ? habitData.habits : [];
-        const today = new Date().toISOString().split('T')[0];
-        
-        // Filter to only active habits first
-        const activeHabits = habits.filter((h: { status?: string }) => {
-          const status = h.status || 'active';
-          return status === 'active';
-        });
-        
-        // Filter to habits not completed today
-        const todayActiveHabits = activeHabits.filter((h: { completionGrid?: Record<string, boolean> }) => {
-          return !h.completionGrid?.[today];
-        });
-        
-        interface HabitType {
-          id: string;
-          name: string;
-          icon?: string;
-          status?: string;
-          completionGrid?: Record<string, boolean>;
-          winXP?: number;
-          goalDays?: number;
-        }
-        
-        let targetHabit: HabitType | null = null;
-        let targetHabitIndex = -1;
-        
-        if (habitIndex !== undefined) {
-          // Find by index in today's active habits list
-          if (habitIndex < 0 || habitIndex >= todayActiveHabits.length) {
-            return new Response(
-              JSON.stringify({ error: `Habit #${habitIndex + 1} not found. You have ${todayActiveHabits.length} habits remaining today.` }),
-              { status: 400, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-            );
-          }
-          targetHabit = todayActiveHabits[habitIndex] as HabitType;
-          // Find the original index in the full habits array
-          targetHabitIndex = habits.findIndex((h: { id: string }) => h.id === targetHabit!.id);
-        } else {
-          // Find by ID
-          targetHabitIndex = habits.findIndex((h: { id: string }) => h.id === habitId);
-          if (targetHabitIndex === -1) {
-            return new Response(
-              JSON.stringify({ error: 'Habit not found' }),
-              { status: 404, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-            );
-          }
-          targetHabit = habits[targetHabitIndex] as HabitType;
-        }
-        
-        if (!targetHabit) {
+        targetHabit = todayActiveHabits[habitIndex] as HabitType;
+        // Find the original index in the full habits array
+        targetHabitIndex = habits.findIndex((h: { id: string }) => h.id === targetHabit!.id);
+      } else {
+        // Find by ID
+        targetHabitIndex = habits.findIndex((h: { id: string }) => h.id === habitId);
+        if (targetHabitIndex === -1) {
           return new Response(
             JSON.stringify({ error: 'Habit not found' }),
             { status: 404, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
           );
         }
+        targetHabit = habits[targetHabitIndex] as HabitType;
+      }
 
-        // Check if already completed using completionGrid
-        const alreadyCompleted = targetHabit.completionGrid?.[today] === true;
-        
-        if (alreadyCompleted) {
-          return new Response(
-            JSON.stringify({ error: 'Habit already completed today', habit_name: targetHabit.name }),
-            { status: 400, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-          );
-        }
-
-        // Mark habit as completed for today using completionGrid (matching web app format)
-        const updatedHabits = [...habits];
-        updatedHabits[targetHabitIndex] = {
-          ...targetHabit,
-          completionGrid: {
-            ...(targetHabit.completionGrid || {}),
-            [today]: true,
-          },
-        };
+      if (!targetHabit) {
+        return new Response(
+          JSON.stringify({ error: 'Habit not found' }),
+          { status: 404, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+        );
+      }
 
-        const { error: updateError } = await supabase
-          .from('user_habits')
-          .update({ habits: updatedHabits, updated_at: new Date().toISOString() })
-          .eq('user_id', profile.user_id);
+      // Check if already completed using completionGrid
+      const alreadyCompleted = targetHabit.completionGrid?.[today] === true;
 
-        if (updateError) {
-          console.error('Error completing habit:', updateError);
-          return new Response(
-            JSON.stringify({ error: 'Failed to complete habit' }),
-            { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-          );
-        }
+      if (alreadyCompleted) {
+        return new Response(
+          JSON.stringify({ error: 'Habit already completed today', habit_name: targetHabit.name }),
+          { status: 400, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+        );
+      }
 
-        // Award XP - use a reasonable daily reward (winXP is for completing the whole goal)
-        const dailyXpReward = 15; // Fixed daily reward for habit completion
-        const newTotalXP = playerStats.total_xp + dailyXpReward;
-        const newWeeklyXP = playerStats.weekly_xp + dailyXpReward;
+      // Mark habit as completed for today using completionGrid (matching web app format)
+      const updatedHabits = [...habits];
+      updatedHabits[targetHabitIndex] = {
+        ...targetHabit,
+        completionGrid: {
+          ...(targetHabit.completionGrid || {}),
+          [today]: true,
+        },
+      };
+
+      const { error: updateError } = await supabase
+        .from('user_habits')
+        .update({ habits: updatedHabits, updated_at: new Date().toISOString() })
+        .eq('user_id', profile.user_id);
+
+      if (updateError) {
+        console.error('Error completing habit:', updateError);
+        return new Response(
+          JSON.stringify({ error: 'Failed to complete habit' }),
+          { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+        );
+      }
 
-        let newLevel = playerStats.level;
-        while (100 * newLevel * (newLevel + 1) / 2 <= newTotalXP) {
-          newLevel += 1;
-        }
+      // Award XP - use a reasonable daily reward (winXP is for completing the whole goal)
+      const dailyXpReward = 15; // Fixed daily reward for habit completion
+      const newTotalXP = playerStats.total_xp + dailyXpReward;
+      const newWeeklyXP = playerStats.weekly_xp + dailyXpReward;
 
-        await supabase
-          .from('player_stats')
-          .update({ total_xp: newTotalXP, weekly_xp: newWeeklyXP, level: newLevel })
-          .eq('user_id', profile.user_id);
+      let newLevel = playerStats.level;
+      while (100 * newLevel * (newLevel + 1) / 2 <= newTotalXP) {
+        newLevel += 1;
+      }
 
-        console.log(`Completed habit for ${profile.hunter_name}: ${targetHabit.name}`);
+      await supabase
+        .from('player_stats')
+        .update({ total_xp: newTotalXP, weekly_xp: newWeeklyXP, level: newLevel })
+        .eq('user_id', profile.user_id);
+
+      console.log(`Completed habit for ${profile.hunter_name}: ${targetHabit.name}`);
+
+      result = {
+        success: true,
+        habit_name: targetHabit.name,
+        habit_icon: targetHabit.icon || '🌱',
+        xp_earned: dailyXpReward,
+        new_level: newLevel,
+        leveled_up: newLevel > playerStats.level,
+      };
+      break;
+    }
 
-        result = {
-          success: true,
-          habit_name: targetHabit.name,
-          habit_icon: targetHabit.icon || '🌱',
-          xp_earned: dailyXpReward,
-          new_level: newLevel,
-          leveled_up: newLevel > playerStats.level,
-        };
-        break;
+    // =====================
+    // NEW: STREAK
+    // =====================
+    case 'get_streak': {
+      const { data: streakData, error: streakError } = await supabase
+        .from('user_streaks')
+        .select('current_streak, longest_streak, last_completion_date, total_rewards')
+        .eq('user_id', profile.user_id)
+        .maybeSingle();
+
+      if (streakError) {
+        console.error('Error fetching streak:', streakError);
+        return new Response(
+          JSON.stringify({ error: 'Failed to fetch streak' }),
+          { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+        );
       }
 
-      // =====================
-      // NEW: STREAK
-      // =====================
-      case 'get_streak': {
-        const { data: streakData, error: streakError } = await supabase
-          .from('user_streaks')
-          .select('current_streak, longest_streak, last_completion_date, total_rewards')
-          .eq('user_id', profile.user_id)
-          .maybeSingle();
+      const today = new Date().toISOString().split('T')[0];
+      const yesterday = new Date(Date.now() - 86400000).toISOString().split('T')[0];
+      const lastCompletion = streakData?.last_completion_date?.split('T')[0];
 
-        if (streakError) {
-          console.error('Error fetching streak:', streakError);
-          return new Response(
-            JSON.stringify({ error: 'Failed to fetch streak' }),
-            { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-          );
-        }
+      let streakStatus = 'at_risk';
+      if (lastCompletion === today) {
+        streakStatus = 'safe';
+      } else if (lastCompletion === yesterday) {
+        streakStatus = 'pending';
+      }
 
-        const today = new Date().toISOString().split('T')[0];
-        const yesterday = new Date(Date.now() - 86400000).toISOString().split('T')[0];
-        const lastCompletion = streakData?.last_completion_date?.split('T')[0];
-        
-        let streakStatus = 'at_risk';
-        if (lastCompletion === today) {
-          streakStatus = 'safe';
-        } else if (lastCompletion === yesterday) {
-          streakStatus = 'pending';
-        }
+      result = {
+        success: true,
+        current_streak: streakData?.current_streak || 0,
+        longest_streak: streakData?.longest_streak || 0,
+        last_completion: lastCompletion || null,
+        status: streakStatus,
+        total_rewards: streakData?.total_rewards || 0,
+      };
+      break;
+    }
 
-        result = {
-          success: true,
-          current_streak: streakData?.current_streak || 0,
-          longest_streak: streakData?.longest_streak || 0,
-          last_completion: lastCompletion || null,
-          status: streakStatus,
-          total_rewards: streakData?.total_rewards || 0,
-        };
-        break;
+    // =====================
+    // NEW: GATES
+    // =====================
+    case 'get_gates': {
+      const { data: gateData, error: gateError } = await supabase
+        .from('user_gates')
+        .select('gates')
+        .eq('user_id', profile.user_id)
+        .maybeSingle();
+
+      if (gateError) {
+        console.error('Error fetching gates:', gateError);
+        return new Response(
+          JSON.stringify({ error: 'Failed to fetch gates' }),
+          { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+        );
       }
 
-      // =====================
-      // NEW: GATES
-      // =====================
-      case 'get_gates': {
-        const { data: gateData, error: gateError } = await supabase
-          .from('user_gates')
-          .select('gates')
-          .eq('user_id', profile.user_id)
-          .maybeSingle();
+      const gates = gateData?.gates || [];
+      const activeGates = Array.isArray(gates) 
+        ? gates.filter((g: { completed?: boolean }) => !g.completed)
+        : [];
+
+      result = {
+        success: true,
+        gates: activeGates,
+        total: Array.isArray(gates) ? gates.length : 0,
+        completed: Array.isArray(gates) ? gates.filter((g: { completed?: boolean }) => g.completed).length : 0,
+      };
+      break;
+    }
 
-        if (gateError) {
-          console.error('Error fetching gates:', gateError);
-          return new Response(
-            JSON.stringify({ error: 'Failed to fetch gates' }),
-            { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-          );
-        }
+    // =====================
+    // NEW: CHALLENGES
+    // =====================
+    case 'get_challenges': {
+      const { data: challengeData, error: challengeError } = await supabase
+        .from('user_challenges')
+        .select('challenges, claimed_challenges')
+        .eq('user_id', profile.user_id)
+        .maybeSingle();
+
+      if (challengeError) {
+        console.error('Error fetching challenges:', challengeError);
+        return new Response(
+          JSON.stringify({ error: 'Failed to fetch challenges' }),
+          { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+        );
+      }
 
-        const gates = gateData?.gates || [];
-        const activeGates = Array.isArray(gates) 
-          ? gates.filter((g: { completed?: boolean }) => !g.completed)
-          : [];
+      const challenges = challengeData?.challenges || [];
+      const claimed = challengeData?.claimed_challenges || [];
+
+      // Separate daily and weekly
+      const daily = Array.isArray(challenges) 
+        ? challenges.filter((c: { type?: string }) => c.type === 'daily' || !c.type)
+        : [];
+      const weekly = Array.isArray(challenges) 
+        ? challenges.filter((c: { type?: string }) => c.type === 'weekly')
+        : [];
+
+      result = {
+        success: true,
+        daily: daily,
+        weekly: weekly,
+        claimed_count: Array.isArray(claimed) ? claimed.length : 0,
+      };
+      break;
+    }
 
-        result = {
-          success: true,
-          gates: activeGates,
-          total: Array.isArray(gates) ? gates.length : 0,
-          completed: Array.isArray(gates) ? gates.filter((g: { completed?: boolean }) => g.completed).length : 0,
-        };
-        break;
-      }
+    // =====================
+    // NEW: CARD DATA (for /card command)
+    // =====================
+    case 'get_card_data': {
+      const totalPower = playerStats.strength + playerStats.agility + 
+                        playerStats.intelligence + playerStats.vitality + playerStats.sense;
+
+      result = {
+        success: true,
+        hunter_name: profile.hunter_name,
+        title: profile.title || 'Awakened Hunter',
+        avatar: profile.avatar,
+        level: playerStats.level,
+        rank: playerStats.rank,
+        total_xp: playerStats.total_xp,
+        weekly_xp: playerStats.weekly_xp,
+        power: totalPower,
+        stats: {
+          strength: playerStats.strength,
+          agility: playerStats.agility,
+          intelligence: playerStats.intelligence,
+          vitality: playerStats.vitality,
+          sense: playerStats.sense,
+        },
+        gold: playerStats.gold,
+        gems: playerStats.gems,
+        credits: playerStats.credits,
+        selected_frame: playerStats.selected_card_frame || 'default',
+      };
+      break;
+    }
 
-      // =====================
-      // NEW: CHALLENGES
-      // =====================
-      case 'get_challenges': {
-        const { data: challengeData, error: challengeError } = await supabase
-          .from('user_challenges')
-          .select('challenges, claimed_challenges')
-          .eq('user_id', profile.user_id)
-          .maybeSingle();
+    default:
+      return new Response(
+        JSON.stringify({ error: `Unknown action: ${action}` }),
+        { status: 400, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+      );
+  }
 
-        if (challengeError) {
-          console.error('Error fetching challenges:', challengeError);
-          return new Response(
-            JSON.stringify({ error: 'Failed to fetch challenges' }),
-            { status: 500, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-          );
-        }
+  return new Response(
+    JSON.stringify(result),
+    { headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+  );
+}
 
-        const challenges = challengeData?.challenges || [];
-        const claimed = challengeData?.claimed_challenges || [];
-        
-        // Separate daily and weekly
-        const daily = Array.isArray(challenges) 
-          ? challenges.filter((c: { type?: string }) => c.type === 'daily' || !c.type)
-          : [];
-        const weekly = Array.isArray(challenges) 
-          ? challenges.filter((c: { type?: string }) => c.type === 'weekly')
-          : [];
+// Runs each item as if it had been sent on its own and returns every item's
+// status and body, in order. Items for different users run concurrently; a
+// user's own items run one after another, so e.g. two add_xp calls for the
+// same user don't both read the old total.
+async function handleBatch(supabase: SupabaseClient, items: unknown): Promise<Response> {
+  if (!Array.isArray(items) || items.length === 0 || items.length > MAX_BATCH_ITEMS) {
+    return new Response(
+      JSON.stringify({ error: `Batch needs 1 to ${MAX_BATCH_ITEMS} items` }),
+      { status: 400, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+    );
+  }
 
-        result = {
-          success: true,
-          daily: daily,
-          weekly: weekly,
-          claimed_count: Array.isArray(claimed) ? claimed.length : 0,
-        };
-        break;
+  const results: { status: number; result: unknown }[] = new Array(items.length);
+  const byUser = new Map<string, number[]>();
+  items.forEach((item: BotSyncRequest, index: number) => {
+    const key = String(item?.discord_id ?? '');
+    byUser.set(key, [...(byUser.get(key) ?? []), index]);
+  });
+
+  await Promise.all([...byUser.values()].map(async (indexes) => {
+    for (const index of indexes) {
+      try {
+        const response = await handleAction(supabase, items[index] as BotSyncRequest);
+        results[index] = { status: response.status, result: await response.json() };
+      } catch (error: unknown) {
+        console.error('Bot sync batch item error:', error);
+        const errorMessage = error instanceof Error ? error.message : 'Unknown error';
+        results[index] = { status: 500, result: { error: 'Internal server error', details: errorMessage } };
       }
+    }
+  }));
 
-      // =====================
-      // NEW: CARD DATA (for /card command)
-      // =====================
-      case 'get_card_data': {
-        const totalPower = playerStats.strength + playerStats.agility + 
-                          playerStats.intelligence + playerStats.vitality + playerStats.sense;
+  console.log(`Bot sync batch: ${items.length} items for ${byUser.size} users`);
+  return new Response(
+    JSON.stringify({ success: true, results }),
+    { headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+  );
+}
 
-        result = {
-          success: true,
-          hunter_name: profile.hunter_name,
-          title: profile.title || 'Awakened Hunter',
-          avatar: profile.avatar,
-          level: playerStats.level,
-          rank: playerStats.rank,
-          total_xp: playerStats.total_xp,
-          weekly_xp: playerStats.weekly_xp,
-          power: totalPower,
-          stats: {
-            strength: playerStats.strength,
-            agility: playerStats.agility,
-            intelligence: playerStats.intelligence,
-            vitality: playerStats.vitality,
-            sense: playerStats.sense,
-          },
-          gold: playerStats.gold,
-          gems: playerStats.gems,
-          credits: playerStats.credits,
-          selected_frame: playerStats.selected_card_frame || 'default',
-        };
-        break;
-      }
+serve(async (req) => {
+  // Handle CORS preflight requests
+  if (req.method === 'OPTIONS') {
+    return new Response(null, { headers: corsHeaders });
+  }
 
-      default:
-        return new Response(
-          JSON.stringify({ error: `Unknown action: ${action}` }),
-          { status: 400, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-        );
+  try {
+    // Verify bot authentication
+    const botSecret = req.headers.get('x-bot-secret');
+    if (!BOT_SECRET || botSecret !== BOT_SECRET) {
+      console.error('Invalid or missing bot secret');
+      return new Response(
+        JSON.stringify({ error: 'Unauthorized - Invalid bot secret' }),
+        { status: 401, headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
+      );
     }
 
-    return new Response(
-      JSON.stringify(result),
-      { headers: { ...corsHeaders, 'Content-Type': 'application/json' } }
-    );
+    // Create Supabase client with service role key for bypassing RLS
+    const supabaseUrl = Deno.env.get('SUPABASE_URL')!;
+    const supabaseServiceKey = Deno.env.get('SUPABASE_SERVICE_ROLE_KEY')!;
+    const supabase = createClient(supabaseUrl, supabaseServiceKey);
+
+    const body = await req.json();
+
+    // Several requests in one round trip: { action: 'batch', items: [{ discord_id, action, data }] }
+    if (body.action === 'batch') {
+      return await handleBatch(supabase, body.items);
+    }
 
+    return await handleAction(supabase, body as BotSyncRequest);
   } catch (error: unknown) {
     console.error('Bot sync error:', error);
     const errorMessage = error instanceof Error ? error.message : 'Unknown error';
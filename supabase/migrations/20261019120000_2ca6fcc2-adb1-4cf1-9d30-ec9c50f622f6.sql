@@ -0,0 +1,14 @@
+-- Idempotency keys for bot-sync mutations retried from the Discord bot's outbox
+CREATE TABLE public.bot_sync_requests (
+  idempotency_key TEXT NOT NULL PRIMARY KEY,
+  discord_id TEXT NOT NULL,
+  action TEXT NOT NULL,
+  result JSONB,
+  created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+-- Only the edge function (service role) reads or writes it
+ALTER TABLE public.bot_sync_requests ENABLE ROW LEVEL SECURITY;
+
+-- For clearing out old keys
+CREATE INDEX idx_bot_sync_requests_created_at ON public.bot_sync_requests (created_at);
@@ -0,0 +1,9 @@
+-- Let PostgREST embed a profile's stats (profiles?select=...,player_stats(*)), so the
+-- Discord bot reads both in one request. Both rows are created together by
+-- handle_new_user, profile first; NOT VALID skips checking existing rows.
+ALTER TABLE public.player_stats
+  ADD CONSTRAINT player_stats_user_id_profiles_fkey
+  FOREIGN KEY (user_id) REFERENCES public.profiles (user_id) ON DELETE CASCADE
+  NOT VALID;
+
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,63 @@
+-- Apply a bot-sync add_xp and record its idempotency key in one transaction.
+-- Claiming the key in a separate step first meant a crash or timeout between
+-- the two left a key with no XP behind it, and every retry was then answered
+-- as a duplicate. Now a stored key always means the XP was applied.
+--
+-- The stats are only written if total_xp is still _expected_total_xp (what the
+-- edge function read and computed the new level from); otherwise nothing is
+-- written and 'conflict' is returned so the caller reads the stats again.
+-- A concurrent call with the same key fails on the primary key (23505) and
+-- its update is rolled back with it.
+CREATE OR REPLACE FUNCTION public.apply_bot_sync_xp(
+  _idempotency_key text,
+  _discord_id text,
+  _user_id uuid,
+  _expected_total_xp integer,
+  _total_xp integer,
+  _weekly_xp integer,
+  _level integer,
+  _rank text,
+  _available_points integer,
+  _result jsonb
+)
+RETURNS jsonb
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  _previous jsonb;
+BEGIN
+  IF _idempotency_key IS NOT NULL THEN
+    SELECT result INTO _previous
+    FROM public.bot_sync_requests
+    WHERE idempotency_key = _idempotency_key;
+    IF FOUND THEN
+      RETURN jsonb_build_object('status', 'duplicate', 'result', _previous);
+    END IF;
+  END IF;
+
+  UPDATE public.player_stats
+  SET total_xp = _total_xp,
+      weekly_xp = _weekly_xp,
+      level = _level,
+      rank = _rank,
+      available_points = _available_points
+  WHERE user_id = _user_id
+    AND total_xp = _expected_total_xp;
+  IF NOT FOUND THEN
+    RETURN jsonb_build_object('status', 'conflict');
+  END IF;
+
+  IF _idempotency_key IS NOT NULL THEN
+    INSERT INTO public.bot_sync_requests (idempotency_key, discord_id, action, result)
+    VALUES (_idempotency_key, _discord_id, 'add_xp', _result);
+  END IF;
+
+  RETURN jsonb_build_object('status', 'applied');
+END;
+$$;
+
+-- Only the edge function (service role) may call it
+REVOKE EXECUTE ON FUNCTION public.apply_bot_sync_xp(text, text, uuid, integer, integer, integer, integer, text, integer, jsonb) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.apply_bot_sync_xp(text, text, uuid, integer, integer, integer, integer, text, integer, jsonb) TO service_role;